@@ -0,0 +1,287 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+# Local Module
+from metrics import METRICS
+import token_budget
+
+# The token budget of the previous cells sent as context of a code generation.
+HISTORY_TOKENS = 600
+# The last cells are always part of the context: a query often continues the previous one.
+RECENT_CELLS = 1
+# The cells scoring less than this share of the best score are left out, even if the budget allows them.
+MIN_RELATIVE_SCORE = 0.5
+MAX_INDEXED_NOTEBOOKS = 4
+# The parameters of Okapi BM25.
+K1 = 1.2
+B = 0.75
+
+_IDENTIFIER = re.compile(r"[A-Za-zÀ-ÖØ-öø-ÿ_][\wÀ-ÖØ-öø-ÿ]*")
+_SUBWORD = re.compile(r"[A-Z]?[a-zà-öø-ÿ]+|[A-Z]+(?![a-z])|\d+")
+_IMPORT = re.compile(r"^[ \t]*(?:import[ \t]+\S.*|from[ \t]+\S+[ \t]+import[ \t]+.+)$", re.MULTILINE)
+# The names defined by a cell (assignments, functions, classes and import aliases) count twice: the cell which
+# defines a dataframe is more useful than a cell which only reads it. A selected cell also brings the last cell
+# defining each name it uses, within the budget.
+_DEFINITION = re.compile(r"^[ \t]*(?:def|class)[ \t]+(\w+)"
+                         r"|^[ \t]*([\w, \t]+?)[ \t]*=[^=]"
+                         r"|\bimport[ \t]+(?:\S+[ \t]+as[ \t]+)?(\w+)", re.MULTILINE)
+# The words of the queries and of the comments which do not help to find a cell.
+_STOPWORDS = {"le", "la", "les", "de", "des", "du", "un", "une", "et", "en", "dans", "pour", "sur", "avec", "par",
+              "au", "aux", "ce", "cette", "ces", "que", "qui", "est", "à", "a", "il", "on", "se", "sa", "son", "ses",
+              "moi", "fais", "fait", "code", "cellule", "the", "of", "to", "in", "and", "for", "is", "self"}
+
+
+class _Document(NamedTuple):
+    """
+    The indexed terms of a cell.
+    """
+    terms: Counter
+    length: int
+    imports: tuple
+    defines: frozenset
+    imports_only: bool
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text (code or query) into lowercase terms: the identifiers and the parts of the snake_case and
+    camelCase identifiers, without the stopwords.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The terms.
+    """
+    terms = []
+    for identifier in _IDENTIFIER.findall(text):
+        parts = [part.lower() for part in _SUBWORD.findall(identifier)]
+        lowered = identifier.lower()
+        terms.extend(term for term in ([lowered] + (parts if len(parts) > 1 else [])) if term not in _STOPWORDS)
+    return terms
+
+
+def _index_cell(source: str) -> _Document:
+    """
+    Index the terms of a cell.
+
+    Args:
+        source (str): The source of the cell.
+
+    Returns:
+        _Document: The terms of the cell, their total count, its import lines, the names it defines and whether
+            it only contains imports.
+    """
+    terms = Counter(tokenize(source))
+    defines = set()
+    for match in _DEFINITION.finditer(source):
+        names = " ".join(group for group in match.groups() if group)
+        # The import aliases are brought by the import lines of the context, not by their cell.
+        if match.group(3) is None:
+            defines.update(name.lower() for name in _IDENTIFIER.findall(names))
+        for name in tokenize(names):
+            terms[name] += 1
+    imports = tuple(line.strip() for line in _IMPORT.findall(source))
+    return _Document(terms, sum(terms.values()), imports, frozenset(defines), 
+                     not _IMPORT.sub("", source).strip())
+
+
+class CellIndex():
+    """
+    A BM25 index of the code cells of a notebook. It is updated incrementally: only the new or modified cells
+    are tokenized, the cells being identified by the hash of their source.
+    """
+
+    def __init__(self) -> None:
+        self.hashes = []
+        self.sources = []
+        self._documents = {}
+        self._counts = Counter()
+        self._frequencies = Counter()
+        self._total_length = 0
+
+    def update(self, sources: list[str]) -> None:
+        """
+        Synchronize the index with the current code cells of the notebook.
+
+        Args:
+            sources (list): The sources of the code cells, in order.
+
+        Returns:
+            None
+        """
+        hashes = [hashlib.sha1(source.encode('utf-8')).hexdigest() for source in sources]
+        new = Counter(hashes)
+        for digest, count in (new - self._counts).items():
+            if digest not in self._documents:
+                self._documents[digest] = _index_cell(sources[hashes.index(digest)])
+                METRICS.increment("retrieval.indexed_cells")
+            document = self._documents[digest]
+            self._frequencies.update({term: count for term in document.terms})
+            self._total_length += count * document.length
+        for digest, count in (self._counts - new).items():
+            document = self._documents[digest]
+            self._frequencies.subtract({term: count for term in document.terms})
+            self._total_length -= count * document.length
+            if digest not in new:
+                del self._documents[digest]
+        self._frequencies = +self._frequencies
+        self._counts = new
+        self.hashes, self.sources = hashes, list(sources)
+
+    def scores(self, query: str) -> list[float]:
+        """
+        Score each cell against a query with Okapi BM25.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            list: The score of each cell, in order.
+        """
+        n_cells = len(self.hashes)
+        if not n_cells:
+            return []
+        average_length = max(self._total_length / n_cells, 1)
+        weights = {}
+        for term in set(tokenize(query)):
+            frequency = self._frequencies.get(term, 0)
+            if frequency:
+                weights[term] = math.log(1 + (n_cells - frequency + 0.5) / (frequency + 0.5))
+        scores = []
+        for digest in self.hashes:
+            document = self._documents[digest]
+            norm = K1 * (1 - B + B * document.length / average_length)
+            score = 0.0
+            for term, weight in weights.items():
+                count = document.terms.get(term, 0)
+                if count:
+                    score += weight * count * (K1 + 1) / (count + norm)
+            scores.append(score)
+        return scores
+
+    def imports(self) -> list[str]:
+        """
+        Collect the import lines of the notebook, without duplicates.
+
+        Returns:
+            list: The import lines, in order of first appearance.
+        """
+        return list(dict.fromkeys(line for digest in self.hashes for line in self._documents[digest].imports))
+
+    def _definitions(self, ind: int) -> list[int]:
+        """
+        Find the cells defining the names used by a cell: for each name, the last cell before it which defines it.
+
+        Args:
+            ind (int): The position of the cell.
+
+        Returns:
+            list: The positions of the defining cells, the closest first.
+        """
+        used = set(self._documents[self.hashes[ind]].terms)
+        found = []
+        for previous in range(ind - 1, -1, -1):
+            defined = used & self._documents[self.hashes[previous]].defines
+            if defined:
+                found.append(previous)
+                used -= defined
+                if not used:
+                    break
+        return found
+
+    def select(self,
+               query: str,
+               max_tokens: int = HISTORY_TOKENS,
+               recent: int = RECENT_CELLS,
+               compact: Optional[Callable[[str], str]] = None) -> list[str]:
+        """
+        Select the context of a query within a token budget: the import lines of the notebook, the last cells,
+        then the most relevant cells by decreasing score, down to MIN_RELATIVE_SCORE of the best score.
+
+        Args:
+            query (str): The query.
+            max_tokens (int): The token budget of the context.
+            recent (int): The number of last cells always selected.
+            compact (Optional[Callable]): The rewriting of the selected cells for the prompt 
+                (prompt_compaction.compact_code), applied before counting their tokens.
+
+        Returns:
+            RankedList: The import lines (as one block) followed by the selected cells, in notebook order, ranked
+                by their order of selection after the imports.
+        """
+        scores = self.scores(query)
+        n_cells = len(scores)
+        ranked = list(range(n_cells - 1, max(n_cells - recent, 0) - 1, -1))
+        threshold = max(scores, default=0.0) * MIN_RELATIVE_SCORE
+        ranked += sorted((ind for ind in range(n_cells - recent) if scores[ind] > 0 and scores[ind] >= threshold),
+                         key=lambda ind: -scores[ind])
+        imports = "\n".join(self.imports())
+        budget = max_tokens - token_budget.count_tokens(imports)
+        sources = {}
+        # Selected position -> rank of selection.
+        selected = {}
+        while ranked:
+            ind = ranked.pop(0)
+            if ind in selected or self._documents[self.hashes[ind]].imports_only:
+                continue
+            sources[ind] = compact(self.sources[ind]) if compact is not None else self.sources[ind]
+            tokens = token_budget.count_tokens(sources[ind])
+            if tokens <= budget:
+                selected[ind] = len(selected) + 1
+                budget -= tokens
+                ranked[:0] = self._definitions(ind)
+        positions = sorted(selected)
+        context = token_budget.RankedList(([imports] if imports else []) + [sources[ind] for ind in positions],
+                                          ([0] if imports else []) + [selected[ind] for ind in positions])
+        METRICS.observe("retrieval.selected_cells", len(selected))
+        METRICS.observe("retrieval.context_tokens", max_tokens - budget)
+        return context
+
+
+class CellRetriever():
+    """
+    A process-wide LRU store of the cell indexes of the notebooks, kept across the queries and the Streamlit reruns.
+    """
+
+    def __init__(self,
+                 max_notebooks: int = MAX_INDEXED_NOTEBOOKS) -> None:
+        self.max_notebooks = max_notebooks
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def context(self,
+                nb_path: str,
+                sources: list[str],
+                query: str,
+                max_tokens: int = HISTORY_TOKENS,
+                compact: Optional[Callable[[str], str]] = None) -> list[str]:
+        """
+        Update the index of a notebook with its current code cells and select the context of a query.
+
+        Args:
+            nb_path (str): The path to the Jupyter notebook file.
+            sources (list): The sources of the code cells, in order.
+            query (str): The query.
+            max_tokens (int): The token budget of the context.
+            compact (Optional[Callable]): The rewriting of the selected cells for the prompt, if any.
+
+        Returns:
+            list: The import lines and the selected cells, see CellIndex.select.
+        """
+        key = os.path.normcase(os.path.abspath(nb_path))
+        with METRICS.timer("retrieval.duration"), self._lock:
+            index = self._indexes.pop(key, None) or CellIndex()
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_notebooks:
+                self._indexes.popitem(last=False)
+            index.update(sources)
+            return index.select(query, max_tokens, compact=compact)
+
+
+CELL_RETRIEVER = CellRetriever()
@@ -1,20 +1,20 @@
+from collections import OrderedDict
+import json
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
-from typing import Any
-
-def chain_router(llm: Any, 
-                 query:str) -> str:
-    """
-    Create the LLMChain to query the LLM to select the adequate function to realize the user's query and invoke it.
-
-    Args:
-        llm (Any): The large language model object for the LangChain's LLMChain function.
-        query (str): The users' query
-
-    Returns:
-        str: The action or function corresponding to the query.
-    """
-    prompt_router =  """[[INST] Identifie l'action à réaliser en fonction de "QUERY" puis donnes le nom de la fonction à choisir.
+import threading
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+# Local Module
+import code_patch
+from fast_router import ACTIONS
+from llm_cache import LLM_CACHE
+from metrics import METRICS
+from response_extraction import extract_code, find_cut_off
+import token_budget
+
+PROMPT_ROUTER =  """[[INST] Identifie l'action à réaliser en fonction de "QUERY" puis donnes le nom de la fonction à choisir.
     L'utilisateur doit explicitement demander une mise à jour pour utiliser update_last_cell ou update_cell, sinon, il faut toujours créer une nouvelle cellule.
     L'utilisateur doit demander explicitement un markdown pour utiliser une cellule en relation avec les markdowns.
     Si l'utilisateur précise une cellule avec une clé JupyCoder, utilises update_selected_cell, update_selected_markdown ou delete_selected_cell.
@@ -49,221 +49,802 @@ def chain_router(llm: Any,
     
     Nom de la fonction à choisir:
     """
-    prompt_router_templ = PromptTemplate(input_variables=["query"], template=prompt_router)
-    chain_router = LLMChain(prompt=prompt_router_templ, llm=llm)
-    answer = chain_router.invoke({"query": query})
+
+PROMPT_CODE_GENERATION =  """[INST]Génères uniquement les lignes de code python pour réaliser la requête suivante : {query}. 
+    Voici les imports et les cellules du notebook les plus utiles pour cette requête, si besoin, sers en toi pour améliorer le code: 
+    {history}
+
+    Ajoutes du texte supplémentaire comme commentaire si besoin. 
+    Si tu crées une fonction, ajoutes un docstring et penses à retourner la variable d'intérêt. 
+
+    Limite ta réponse à des lignes de code. N'ajoutes pas d'explication.
+    [/INST] 
+
+    Le code python est:"""
+
+PROMPT_CODE_UPDATE =  """[INST]Update the code to respect the following query : {query}.
+    Do not add additional text or explanation. Add commentaries if necessary.
+    Do not explain the arguments of the code and do not explain the change lines. Do not use a list.
+    
+    {code}
+    
+    Limit yourself to the code lines. 
+    [/INST] 
+
+    Updated Code:"""
+
+PROMPT_CODE_PATCH =  """[INST]Update the code to respect the following query : {query}.
+    Do not rewrite the whole code: answer only with the edits, as one or more blocks of the following form, 
+    the SEARCH part copying exactly a few consecutive lines of the code and the REPLACE part giving their new version.
+    <<<<<<< SEARCH
+    lines of the code to change
+    =======
+    new lines
+    >>>>>>> REPLACE
+    To add lines at the end of the code, leave the SEARCH part empty. Do not add additional text or explanation.
+
+    Code:
+    {code}
+    [/INST] 
+
+    Edits:"""
+
+PROMPT_MARKDOWN_GENERATION =  """[INST]Ta tâche est de créer un document markdown.
+    {query}.
+    Sois bref. Limites toi à un paragraphe. N'ajoutes pas d'onglet Explication.
+    [/INST] 
+
+    Markdown:"""
+
+PROMPT_MARKDOWN_UPDATE =  """[INST]{query}.
+    
+    Markdown: 
+    {markdown}
+
+    Sois bref. Limites toi à un paragraphe.
+    [/INST] 
+
+    Markdown modifié:"""
+
+PROMPT_CODE_EXPLANATION =  """[INST]Tu dois expliquer en quelques lignes le code suivant:
+    {code}
+    
+    [/INST] 
+
+    Explication:"""
+
+PROMPT_SUMMARY =  """[INST]Ton rôle est de résumer  en language naturel les commandes python réalisée dans ce notebook:
+    {codes}
+    
+    Utilise simplement les lignes de code données. S'il n'y a pas de code, expliques que le notebook est vide.
+    Limite toi à un paragraphe. 
+    [/INST] 
+
+    Réponse:
+    Dans ce notebook,"""
+
+PROMPT_CHUNK_SUMMARY =  """[INST]Ton rôle est de résumer en language naturel les commandes python réalisées dans cette partie d'un notebook:
+    {codes}
+    
+    Utilise simplement les lignes de code données. Limite toi à quelques phrases. 
+    [/INST] 
+
+    Réponse:"""
+
+PROMPT_SUMMARY_REDUCE =  """[INST]Voici les résumés des parties successives d'un notebook python:
+    {summaries}
+    
+    Ton rôle est de les combiner en un seul résumé, dans l'ordre du notebook, sans ajouter d'information.
+    Limite toi à un paragraphe. 
+    [/INST] 
+
+    Réponse:
+    Dans ce notebook,"""
+
+PROMPT_ROUTE_AND_GENERATE =  """[INST] Identifie l'action à réaliser en fonction de "QUERY", puis réalise-la directement s'il s'agit d'une création ou d'une mise à jour de la dernière cellule.
+    L'utilisateur doit explicitement demander une mise à jour pour utiliser update_last_cell, sinon, il faut toujours créer une nouvelle cellule.
+    L'utilisateur doit demander explicitement un markdown pour utiliser une cellule en relation avec les markdowns.
+    Si l'utilisateur précise une cellule avec une clé JupyCoder, utilises update_selected_cell, update_selected_markdown, delete_selected_cell ou explain_selected_cell.
+    Si l'utilisateur, précise qu'il fait référence à la dernière cellule, prends les fonctions correspondantes: update_last_cell, update_last_markdown, delete_last_cell ou explain_last_cell.
+
+    Voici les fonctions disponibles et le contenu attendu pour chacune :
+    - create_code_cell : Créer une cellule de code. Le contenu est uniquement les lignes de code python qui réalisent la requête, avec des commentaires si besoin.
+    - create_markdown : Créer une cellule markdown. Le contenu est le texte markdown, bref, limité à un paragraphe.
+    - update_last_cell : Mise à jour de la dernière cellule du carnet. Le contenu est le code complet de la dernière cellule mis à jour.
+    - update_last_markdown : Mise à jour de la dernière cellule markdown. Le contenu est le markdown complet mis à jour, limité à un paragraphe.
+    - update_selected_cell, update_selected_markdown, delete_last_cell, delete_selected_cell, explain_last_cell, explain_selected_cell, summary_all : Le contenu est vide.
+
+    Voici les imports et les cellules de code du notebook les plus utiles pour cette requête, si besoin, sers en toi pour améliorer le code :
+    {history}
+
+    Voici la dernière cellule du carnet :
+    {last_cell}
+
+    Réponds uniquement avec un objet JSON de la forme {{"action": "nom de la fonction", "content": "contenu"}}, sans autre texte ni explication.
+    "QUERY": 
+    {query}
+    [/INST] 
+
+    JSON:"""
+
+# The actions of the single-call mode for which the response carries the content of the cell.
+CONTENT_ACTIONS = ["create_code_cell", "create_markdown", "update_last_cell", "update_last_markdown"]
+
+# The number of new requests sent when the generated code is not valid Python, even after repair.
+CODE_RETRIES = 1
+
+# The cells from this number of lines are updated with search/replace edits (chain_code_patch) rather than 
+# regenerated as a whole: for a small cell, the edits are hardly shorter than the cell.
+PATCH_MIN_LINES = 15
+
+# The prompt templates are built once, at import.
+PROMPT_TEMPLATES = {
+    "router": PromptTemplate(input_variables=["query"], template=PROMPT_ROUTER),
+    "code_generation": PromptTemplate(input_variables=["query", "history"], template=PROMPT_CODE_GENERATION),
+    "code_update": PromptTemplate(input_variables=["query", "code"], template=PROMPT_CODE_UPDATE),
+    "code_patch": PromptTemplate(input_variables=["query", "code"], template=PROMPT_CODE_PATCH),
+    "markdown_generation": PromptTemplate(input_variables=["query"], template=PROMPT_MARKDOWN_GENERATION),
+    "markdown_update": PromptTemplate(input_variables=["query", "markdown"], template=PROMPT_MARKDOWN_UPDATE),
+    "code_explanation": PromptTemplate(input_variables=["code"], template=PROMPT_CODE_EXPLANATION),
+    "summary": PromptTemplate(input_variables=["codes"], template=PROMPT_SUMMARY),
+    "chunk_summary": PromptTemplate(input_variables=["codes"], template=PROMPT_CHUNK_SUMMARY),
+    "summary_reduce": PromptTemplate(input_variables=["summaries"], template=PROMPT_SUMMARY_REDUCE),
+    "route_and_generate": PromptTemplate(input_variables=["query", "history", "last_cell"], template=PROMPT_ROUTE_AND_GENERATE),
+}
+
+
+
+class GenerationProfile(NamedTuple):
+    """
+    The generation parameters of a prompt. The stop sequences end the generation on the server when the backend 
+    supports it (HuggingFaceEndpoint), HuggingFaceHub only cuts the text on the client side. The rendered prompt
+    is trimmed to max_input_tokens (see TRIM_ORDER).
+    """
+    max_new_tokens: int
+    temperature: float
+    stop: tuple[str, ...] = ()
+    max_input_tokens: int = 2000
+
+    def llm_kwargs(self) -> dict:
+        """
+        The generation parameters sent with each request, merged by the LLM with its own model_kwargs.
+
+        Returns:
+            dict: The parameters.
+        """
+        return {"max_new_tokens": self.max_new_tokens, "temperature": self.temperature}
+
+
+# The text-generation-inference servers accept at most four stop sequences. They only match at the beginning of
+# an unindented line, where the explanations start, and not in the comments and strings of the code.
+CODE_STOP = ("\nExplanation:", "\nNotes:", "\nThis code", "\nCe code")
+
+# The router only answers the name of a function, the markdowns and explanations are limited to a paragraph.
+# The input budgets leave room for the fixed part of each prompt (about 500 tokens for the router prompts) and for
+# the summary chunks of notebook_summary.CHUNK_TOKENS.
+GENERATION_PROFILES = {
+    "router": GenerationProfile(max_new_tokens=20, temperature=0.01, max_input_tokens=1000),
+    "code_generation": GenerationProfile(max_new_tokens=500, temperature=0.1, stop=CODE_STOP, max_input_tokens=1500),
+    "code_update": GenerationProfile(max_new_tokens=500, temperature=0.1, stop=CODE_STOP, max_input_tokens=2500),
+    "code_patch": GenerationProfile(max_new_tokens=400, temperature=0.1, max_input_tokens=2500),
+    "markdown_generation": GenerationProfile(max_new_tokens=250, temperature=0.1, max_input_tokens=600),
+    "markdown_update": GenerationProfile(max_new_tokens=250, temperature=0.1, max_input_tokens=1500),
+    "code_explanation": GenerationProfile(max_new_tokens=300, temperature=0.1, max_input_tokens=2500),
+    "summary": GenerationProfile(max_new_tokens=300, temperature=0.1, max_input_tokens=2000),
+    "chunk_summary": GenerationProfile(max_new_tokens=150, temperature=0.1, max_input_tokens=2000),
+    "summary_reduce": GenerationProfile(max_new_tokens=300, temperature=0.1, max_input_tokens=2000),
+    "route_and_generate": GenerationProfile(max_new_tokens=600, temperature=0.1, max_input_tokens=2000),
+}
+
+# The variables of each prompt trimmed when it exceeds its input budget, the first ones first: the context
+# (history, last cell) goes before the content to process, the query of the user last. The code of an update is
+# never trimmed: the regenerated cell would lose its middle.
+TRIM_ORDER = {
+    "router": ("query",),
+    "code_generation": ("history", "query"),
+    "code_update": ("query",),
+    "code_patch": ("query",),
+    "markdown_generation": ("query",),
+    "markdown_update": ("markdown", "query"),
+    "code_explanation": ("code",),
+    "summary": ("codes",),
+    "chunk_summary": ("codes",),
+    "summary_reduce": ("summaries",),
+    "route_and_generate": ("history", "last_cell", "query"),
+}
+
+MAX_REGISTERED_LLMS = 4
+
+
+class ChainRegistry():
+    """
+    A registry of the LLMChains, which builds each chain once per LLM instance and then reuses it.
+    The most recently used LLM instances are kept, up to a maximum.
+    """
+
+    def __init__(self, 
+                 max_llms: int = MAX_REGISTERED_LLMS) -> None:
+        self.max_llms = max_llms
+        # id(llm) -> (llm, {chain name: LLMChain}); the LLM is kept referenced so that its id cannot be reused.
+        self._chains = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, 
+            llm: Any, 
+            name: str) -> LLMChain:
+        """
+        Retrieve the chain of a prompt for an LLM, building it on first use.
+
+        Args:
+            llm (Any): The large language model object for the LangChain's LLMChain function.
+            name (str): The name of the prompt, a key of PROMPT_TEMPLATES.
+
+        Returns:
+            LLMChain: The chain.
+        """
+        with self._lock:
+            entry = self._chains.get(id(llm))
+            if entry is None or entry[0] is not llm:
+                entry = (llm, {})
+                self._chains[id(llm)] = entry
+                while len(self._chains) > self.max_llms:
+                    self._chains.popitem(last=False)
+            self._chains.move_to_end(id(llm))
+            chains = entry[1]
+            if name not in chains:
+                with METRICS.timer(f"chain.build.{name}"):
+                    chains[name] = LLMChain(prompt=PROMPT_TEMPLATES[name], llm=llm, 
+                                            llm_kwargs=GENERATION_PROFILES[name].llm_kwargs())
+            return chains[name]
+
+    def clear(self) -> None:
+        """
+        Forget every chain, so that they are rebuilt with the current generation profiles.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._chains.clear()
+
+
+CHAIN_REGISTRY = ChainRegistry()
+
+
+def set_generation_profile(name: str, 
+                           **params: Any) -> GenerationProfile:
+    """
+    Change the generation parameters of a prompt, e.g. set_generation_profile("code_generation", max_new_tokens=800).
+
+    Args:
+        name (str): The name of the prompt, a key of GENERATION_PROFILES.
+        **params (Any): The new values of max_new_tokens, temperature, stop or max_input_tokens.
+
+    Returns:
+        GenerationProfile: The new profile.
+    """
+    if "stop" in params:
+        params["stop"] = tuple(params["stop"])
+    GENERATION_PROFILES[name] = GENERATION_PROFILES[name]._replace(**params)
+    CHAIN_REGISTRY.clear()
+    return GENERATION_PROFILES[name]
+
+
+def static_prefixes() -> dict[str, str]:
+    """
+    The fixed beginning of each prompt, up to its first variable, identical for every request. The local backends
+    keep the state of the model after it (local_llm.PrefixCache), so that only the rest of the prompt is evaluated.
+
+    Returns:
+        dict: The prefix of each prompt, by name.
+    """
+    prefixes = {}
+    for name, template in PROMPT_TEMPLATES.items():
+        prompt = template.format(**{variable: "\x00" for variable in template.input_variables})
+        prefixes[name] = prompt[:prompt.index("\x00")]
+    return prefixes
+
+def _stop_sequences(name: str,
+                    prompt: str) -> list[str]:
+    """
+    The stop sequences of a prompt which do not already appear in the rendered prompt: the HuggingFace Inference API 
+    returns the prompt with the generated text, which would be cut otherwise.
+
+    Args:
+        name (str): The name of the prompt, a key of GENERATION_PROFILES.
+        prompt (str): The rendered prompt.
+
+    Returns:
+        list: The stop sequences to send.
+    """
+    return [stop for stop in GENERATION_PROFILES[name].stop if stop not in prompt]
+
+def _fit_prompt(name: str,
+                chain: LLMChain,
+                inputs: dict) -> tuple[dict, str]:
+    """
+    Trim the variable parts of a prompt to its input budget, which also leaves room for the generated tokens 
+    in the context window of the model.
+
+    Args:
+        name (str): The name of the prompt, a key of GENERATION_PROFILES.
+        chain (LLMChain): The registered chain of the prompt.
+        inputs (dict): The values of the prompt variables.
+
+    Returns:
+        tuple: The values of the variables, trimmed if needed, and the rendered prompt.
+    """
+    profile = GENERATION_PROFILES[name]
+    max_tokens = min(profile.max_input_tokens, token_budget.CONTEXT_TOKENS - profile.max_new_tokens)
+    fitted, prompt, tokens = token_budget.fit_inputs(chain.prompt, inputs, max_tokens, TRIM_ORDER.get(name, ()))
+    if fitted is not inputs:
+        METRICS.increment(f"chain.trimmed.{name}")
+    if tokens > max_tokens:
+        METRICS.increment(f"chain.over_budget.{name}")
+    return fitted, prompt
+
+def _record_generation(name: str,
+                       prompt: str,
+                       text: str) -> None:
+    """
+    Record the number of prompt and generated tokens of a request in the metrics, per prompt: the samples of
+    chain.prompt_tokens.<name> and chain.generated_tokens.<name>, and the totals of tokens.prompt.<name> 
+    and tokens.completion.<name>.
+
+    Args:
+        name (str): The name of the prompt.
+        prompt (str): The rendered prompt.
+        text (str): The text returned by the LLM, with or without the prompt.
+
+    Returns:
+        None
+    """
+    generated = text[len(prompt):] if text.startswith(prompt) else text
+    prompt_tokens = token_budget.count_tokens(prompt)
+    generated_tokens = token_budget.count_tokens(generated)
+    METRICS.observe(f"chain.prompt_tokens.{name}", prompt_tokens)
+    METRICS.observe(f"chain.generated_tokens.{name}", generated_tokens)
+    METRICS.increment(f"tokens.prompt.{name}", prompt_tokens)
+    METRICS.increment(f"tokens.completion.{name}", generated_tokens)
+
+
+def _cacheable(llm: Any) -> bool:
+    """
+    Whether the response of the last call of the LLM can be stored in the LLM response cache: not when the resilience
+    layer (resilient_llm.ResilientLLM) served it with its secondary backend, the cache keys being those of the
+    primary model.
+
+    Args:
+        llm (Any): The large language model object.
+
+    Returns:
+        bool: Whether the response can be cached.
+    """
+    served_by_secondary = getattr(llm, "served_by_secondary", None)
+    if served_by_secondary is not None and served_by_secondary():
+        METRICS.increment("llm_cache.fallback_skipped")
+        return False
+    return True
+
+def _invoke(llm: Any, 
+            name: str, 
+            inputs: dict,
+            use_cache: bool = True) -> dict:
+    """
+    Invoke the registered chain of a prompt, serving the response from the LLM response cache when possible.
+    The prompt is first trimmed to its input budget.
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        name (str): The name of the prompt, a key of PROMPT_TEMPLATES.
+        inputs (dict): The values of the prompt variables.
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+
+    Returns:
+        dict: The chain output, with the generated text under "text".
+    """
+    chain = CHAIN_REGISTRY.get(llm, name)
+    inputs, prompt = _fit_prompt(name, chain, inputs)
+    stop = _stop_sequences(name, prompt)
+    if use_cache:
+        key = LLM_CACHE.key(prompt, llm, {**chain.llm_kwargs, "stop": stop})
+        text = LLM_CACHE.get(key)
+        if text is not None:
+            return {**inputs, chain.output_key: text}
+    with METRICS.timer(f"chain.invoke.{name}"):
+        answer = chain.invoke({**inputs, "stop": stop or None})
+    _record_generation(name, prompt, answer[chain.output_key])
+    if use_cache and _cacheable(llm):
+        LLM_CACHE.put(key, answer[chain.output_key])
+    return answer
+
+def _stream(llm: Any,
+            name: str,
+            inputs: dict,
+            on_token: Callable[[str], None],
+            cut_off: Optional[Callable[[str, int], Optional[int]]] = None,
+            use_cache: bool = True) -> dict:
+    """
+    Stream the generation of the registered chain of a prompt, calling on_token with the text generated so far 
+    after each token. The generation is stopped as soon as cut_off finds the end of the useful part of the text, 
+    and the text is cut there. A cached response is served at once. The prompt is first trimmed to its input budget.
+
+    Args:
+        llm (Any): The large language model object, streamed if its LangChain class implements streaming 
+            (e.g. HuggingFaceEndpoint), otherwise generated at once.
+        name (str): The name of the prompt, a key of PROMPT_TEMPLATES.
+        inputs (dict): The values of the prompt variables.
+        on_token (Callable): The function receiving the text generated so far.
+        cut_off (Optional[Callable]): The function finding where the useful part of the generated text ends, given
+            the text and the length already checked (e.g. response_extraction.find_cut_off), or None.
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+
+    Returns:
+        dict: The chain output, with the prompt followed by the generated text under "text", as the HuggingFace 
+            Inference API returns it.
+    """
+    chain = CHAIN_REGISTRY.get(llm, name)
+    inputs, prompt = _fit_prompt(name, chain, inputs)
+    stop = _stop_sequences(name, prompt)
+    if use_cache:
+        key = LLM_CACHE.key(prompt, llm, {**chain.llm_kwargs, "stop": stop})
+        text = LLM_CACHE.get(key)
+        if text is not None:
+            generated = text[len(prompt):] if text.startswith(prompt) else text
+            cut = cut_off(generated) if cut_off else None
+            on_token(generated[:cut])
+            return {**inputs, chain.output_key: text}
+
+    generated = ""
+    start = time.perf_counter()
+    with METRICS.timer(f"chain.stream.{name}"):
+        stream = llm.stream(prompt, stop=stop or None, **chain.llm_kwargs)
+        try:
+            for chunk in stream:
+                if not generated:
+                    METRICS.observe(f"chain.stream.{name}.first_token", time.perf_counter() - start)
+                checked = len(generated)
+                generated += chunk
+                cut = cut_off(generated, checked) if cut_off else None
+                if cut is not None:
+                    generated = generated[:cut]
+                    METRICS.increment(f"chain.stream.{name}.early_stop")
+                    on_token(generated)
+                    break
+                on_token(generated)
+        finally:
+            # Closing the stream drops the connection, which stops the generation on the server.
+            stream.close()
+    text = prompt + generated
+    _record_generation(name, prompt, text)
+    if use_cache and _cacheable(llm):
+        LLM_CACHE.put(key, text)
+    return {**inputs, chain.output_key: text}
+
+def _generate_code(llm: Any,
+                   name: str,
+                   inputs: dict,
+                   marker: str,
+                   use_cache: bool = True,
+                   on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Invoke (or stream) a code prompt and extract the code of the response with response_extraction.extract_code. 
+    If the code is still not valid Python after repair, a new request is sent, up to CODE_RETRIES times, 
+    and the last extraction is kept.
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        name (str): The name of the prompt, a key of PROMPT_TEMPLATES.
+        inputs (dict): The values of the prompt variables.
+        marker (str): The end of the prompt, after which the generated text starts.
+        use_cache (bool): Whether the first response can be served from (and stored in) the LLM response cache.
+        on_token (Optional[Callable]): If given, the first request is streamed and the function receives the text 
+            generated so far.
+
+    Returns:
+        str: The python code lines
+    """
+    for attempt in range(CODE_RETRIES + 1):
+        if on_token is not None and attempt == 0:
+            answer = _stream(llm, name, inputs, on_token, find_cut_off, use_cache)
+        else:
+            answer = _invoke(llm, name, inputs, use_cache and attempt == 0)
+        text = answer["text"]
+        extracted = extract_code(text.split(marker, 1)[1] if marker in text else text)
+        if extracted.valid:
+            METRICS.increment(f"extraction.{name}.repaired" if extracted.repaired else f"extraction.{name}.valid")
+            break
+        METRICS.increment(f"extraction.{name}.invalid")
+    return extracted.code
+
+def chain_router(llm: Any, 
+                 query:str,
+                 use_cache: bool = True) -> str:
+    """
+    Retrieve the LLMChain to query the LLM to select the adequate function to realize the user's query and invoke it.
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        query (str): The users' query
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+
+    Returns:
+        str: The action or function corresponding to the query.
+    """
+    answer = _invoke(llm, "router", {"query": query}, use_cache)
 
     return answer["text"].split("choisir:")[1].strip().replace('\_', '_')
 
 
-def chain_code_generation(llm: Any, 
-                          query:str,
-                    history: str) -> str:
+def _parse_route_and_generate(text: str) -> Optional[tuple[str, Optional[str]]]:
     """
-    Create the LLMChain to generate python code lines based on the user's query and invoke it.
+    Parse and validate the JSON answer of the single-call prompt.
+
+    Args:
+        text (str): The generated text.
+
+    Returns:
+        Optional[tuple]: The action and the content of the cell (None for the actions without content), 
+            or None if the answer is malformed.
+    """
+    # The prompt, returned before the answer by HuggingFaceHub, ends with the marker; the query, the history or
+    # the last cell before it can hold the marker or braces as well.
+    start = text.find("{", text.rfind("JSON:") + 1)
+    if start < 0:
+        return None
+    try:
+        data, _ = json.JSONDecoder().raw_decode(text, start)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("action"), str):
+        return None
+    action = data["action"].strip().replace('\\_', '_')
+    if action not in ACTIONS:
+        return None
+    if action not in CONTENT_ACTIONS:
+        return action, None
+    content = data.get("content")
+    if not isinstance(content, str) or not content.strip():
+        return None
+    if action in ("create_code_cell", "update_last_cell"):
+        return action, extract_code(content).code
+    return action, content.strip()
+
+def chain_route_and_generate(llm: Any,
+                             query: str,
+                             history: str,
+                             last_cell: str,
+                             use_cache: bool = True) -> Optional[tuple[str, Optional[str]]]:
+    """
+    Retrieve the LLMChain to select the adequate function and, for the creations and the updates of the last cell,
+    generate the content of the cell in the same request, then invoke it. The answer is a JSON object 
+    {"action": ..., "content": ...}, which is parsed and validated.
 
     Args:
         llm (Any): The large language model object for the LangChain's LLMChain function.
         query (str): The users' query
-        history (str): Previous code cells to add context to the new code cell.
+        history (str): The imports and the previous code cells most relevant to the query, to add context to a new code cell.
+        last_cell (str): The content of the last cell, to update it.
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
 
     Returns:
-        str: The python code lines
+        Optional[tuple]: The action and the content of the cell (None for the actions without content), 
+            or None if the answer is malformed and the query must be routed by chain_router.
     """
+    answer = _invoke(llm, "route_and_generate", {"query": query, "history": history, "last_cell": last_cell}, use_cache)
+    result = _parse_route_and_generate(answer["text"])
+    METRICS.increment("route_and_generate.valid" if result is not None else "route_and_generate.malformed")
+    return result
 
-    prompt_coder =  """[INST]Génères uniquement les lignes de code python pour réaliser la requête suivante : {query}. 
-    Voici l'historique des dernières commandes, si besoin, sers en toi pour améliorer le code: 
-    {history}
 
-    Ajoutes du texte supplémentaire comme commentaire si besoin. 
-    Si tu crées une fonction, ajoutes un docstring et penses à retourner la variable d'intérêt. 
+def chain_code_generation(llm: Any, 
+                          query:str,
+                    history: str,
+                    use_cache: bool = True,
+                    on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Retrieve the LLMChain to generate python code lines based on the user's query and invoke it.
 
-    Limite ta réponse à des lignes de code. N'ajoutes pas d'explication.
-    [/INST] 
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        query (str): The users' query
+        history (str): The imports and the previous code cells most relevant to the query, to add context to the new code cell.
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+        on_token (Optional[Callable]): If given, the generation is streamed and stopped at the first cut-off marker; 
+            the function receives the text generated so far.
 
-    Le code python est:"""
-    prompt_coder_templ = PromptTemplate(input_variables=["query", "history"], template=prompt_coder)
-    chain_coder = LLMChain(prompt=prompt_coder_templ, llm=llm)
-    answer = chain_coder.invoke({"query": query, "history": history})
-    response = answer["text"].split("est:")[1].strip()
-    if 'Explanation' in response:
-        response = response.split("Explanation:")[0].strip()
-    if 'Notes' in response:
-        response = response.split("Notes:")[0].strip()
-    if 'Ce code' in response:
-        response = response.split("Ce code")[0].strip()
-    if 'Le code' in response:
-        response = response.split("Le code")[0].strip()
-    if 'Ici' in response:
-        response = response.split("Ici")[0].strip()
-    if 'This line' in response:
-        response = response.split("This line")[0].strip()
-    if 'This code' in response:
-        response = response.split("This code")[0].strip()
-    if 'Explication' in response:
-        response = response.split("Explication")[0].strip()
-    if 'Notez'  in response:
-        response = response.split("Explication")[0].strip()
-    if 'Comments:'  in response:
-        response = response.split("Comments:")[0].strip()
-
-    return response
+    Returns:
+        str: The python code lines
+    """
+    return _generate_code(llm, "code_generation", {"query": query, "history": history}, "est:", use_cache, on_token)
 
 def chain_code_update(llm: Any, 
                 query: str, 
-                code:str) -> str:
+                code:str,
+                use_cache: bool = True) -> str:
     """
-    Create the LLMChain to update the selected code cell and invoke it.
+    Retrieve the LLMChain to update the selected code cell and invoke it.
 
     Args:
         llm (Any): The large language model object for the LangChain's LLMChain function.
         query (str): The users' query
         code (str): The code lines to update
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
 
     Returns:
         str: The  updated python code lines
     """        
-    prompt_explanation =  """[INST]Update the code to respect the following query : {query}.
-    Do not add additional text or explanation. Add commentaries if necessary.
-    Do not explain the arguments of the code and do not explain the change lines. Do not use a list.
-    
-    {code}
-    
-    Limit yourself to the code lines. 
-    [/INST] 
+    return _generate_code(llm, "code_update", {"query": query, "code": code}, "Code:", use_cache)
 
-    Updated Code:"""
-    prompt_explanation_templ = PromptTemplate(input_variables=["query", "code"], template=prompt_explanation)
-    chain_explanation = LLMChain(prompt=prompt_explanation_templ, llm=llm)
-    answer = chain_explanation.invoke({"query": query, "code": code})
-    response = answer["text"].split("Code:")[1].strip()
-    if 'Explanation' in response:
-        response = response.split("Explanation:")[0].strip()
-    if 'Notes' in response:
-        response = response.split("Notes:")[0].strip()
-    if 'Ce code' in response:
-        response = response.split("Ce code")[0].strip()
-    if 'Le code' in response:
-        response = response.split("Le code")[0].strip()
-    if 'Ici' in response:
-        response = response.split("Ici")[0].strip()
-    if 'This line' in response:
-        response = response.split("This line")[0].strip()
-    if 'This code' in response:
-        response = response.split("This code")[0].strip()
-    if 'Explication' in response:
-        response = response.split("Explication")[0].strip()
-    if 'Notez'  in response:
-        response = response.split("Explication")[0].strip()
-    if 'Comments:'  in response:
-        response = response.split("Comments:")[0].strip()
-
-    return response
+def chain_code_patch(llm: Any, 
+                     query: str, 
+                     code: str,
+                     use_cache: bool = True) -> Optional[str]:
+    """
+    Retrieve the LLMChain to update a code cell with search/replace edits rather than the whole updated code, 
+    invoke it, then apply and verify the edits locally (code_patch.patch_code).
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        query (str): The users' query
+        code (str): The code lines to update
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+
+    Returns:
+        Optional[str]: The updated python code lines, or None if the edits are malformed, do not apply 
+            or break the code.
+    """
+    answer = _invoke(llm, "code_patch", {"query": query, "code": code}, use_cache)
+    text = answer["text"].rsplit("[/INST]", 1)[-1]
+    patched = code_patch.patch_code(code, text.split("Edits:", 1)[1] if "Edits:" in text else text)
+    METRICS.increment("code_patch.applied" if patched is not None else "code_patch.rejected")
+    return patched
+
+def chain_code_edit(llm: Any, 
+                    query: str, 
+                    code: str,
+                    use_cache: bool = True,
+                    patch: bool = True) -> str:
+    """
+    Update a code cell: with search/replace edits for a cell of at least PATCH_MIN_LINES lines, falling back to 
+    the regeneration of the whole cell (chain_code_update) when the edits cannot be applied.
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        query (str): The users' query
+        code (str): The code lines to update
+        use_cache (bool): Whether the responses can be served from (and stored in) the LLM response cache.
+        patch (bool): Whether the edits are tried first.
+
+    Returns:
+        str: The  updated python code lines
+    """
+    if patch and code.count("\n") + 1 >= PATCH_MIN_LINES:
+        patched = chain_code_patch(llm, query, code, use_cache)
+        if patched is not None:
+            return patched
+    return chain_code_update(llm, query, code, use_cache)
 
 
 def chain_markdown_generation(llm: Any,
-                        query:str) -> str:
+                        query:str,
+                        use_cache: bool = True,
+                        on_token: Optional[Callable[[str], None]] = None) -> str:
     """
-    Create the LLMChain to generate markdown content based on the user's query and invoke it.
+    Retrieve the LLMChain to generate markdown content based on the user's query and invoke it.
 
 
     Args:
         llm (Any): The large language model object for the LangChain's LLMChain function.
         query (str): The users' query
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+        on_token (Optional[Callable]): If given, the generation is streamed; the function receives the text generated so far.
 
     Returns:
         str: The markdown content
     """      
-    prompt_markdown =  """[INST]Ta tâche est de créer un document markdown.
-    {query}.
-    Sois bref. Limites toi à un paragraphe. N'ajoutes pas d'onglet Explication.
-    [/INST] 
-
-    Markdown:"""
-    prompt_markdown_templ = PromptTemplate(input_variables=["query"], template=prompt_markdown)
-    chain_markdown = LLMChain(prompt=prompt_markdown_templ, llm=llm)
-    answer = chain_markdown.invoke({"query": query})
+    if on_token is not None:
+        answer = _stream(llm, "markdown_generation", {"query": query}, on_token, use_cache=use_cache)
+    else:
+        answer = _invoke(llm, "markdown_generation", {"query": query}, use_cache)
 
     return answer["text"].split("Markdown:")[1].strip()
 
 def chain_markdown_update(llm, 
                         text: str,
-                        query:str) -> str:
+                        query:str,
+                        use_cache: bool = True) -> str:
     """
-    Create the LLMChain to update the selected markdown cell and invoke it.
+    Retrieve the LLMChain to update the selected markdown cell and invoke it.
 
     Args:
         llm (Any): The large language model object for the LangChain's LLMChain function.
         text (str): The markdown content to update
         query (str): The users' query
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
 
     Returns:
         str: The markdown content updated
     """   
 
-    prompt_markdown_upd =  """[INST]{query}.
-    
-    Markdown: 
-    {markdown}
-
-    Sois bref. Limites toi à un paragraphe.
-    [/INST] 
-
-    Markdown modifié:"""
-    prompt_markdown__updtempl = PromptTemplate(input_variables=["query", "markdown"], template=prompt_markdown_upd)
-    chain_markdown = LLMChain(prompt=prompt_markdown__updtempl, llm=llm)
-    answer = chain_markdown.invoke({"query": query, "markdown":text})
+    answer = _invoke(llm, "markdown_update", {"query": query, "markdown":text}, use_cache)
 
     return answer["text"].split("modifié:")[1].strip()
 
 def chain_code_explanation(llm, 
-                        code:str) -> str:
+                        code:str,
+                        use_cache: bool = True,
+                        on_token: Optional[Callable[[str], None]] = None) -> str:
     """
-    Create the LLMChain to explain the selected code cell.
+    Retrieve the LLMChain to explain the selected code cell.
 
     Args:
         llm (Any): The large language model object for the LangChain's LLMChain function.
         code (str): The code cell to explain
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+        on_token (Optional[Callable]): If given, the generation is streamed; the function receives the text generated so far.
 
     Returns:
         str: The code cell explanation
     """       
-    prompt_explanation =  """[INST]Tu dois expliquer en quelques lignes le code suivant:
-    {code}
-    
-    [/INST] 
-
-    Explication:"""
-    prompt_explanation_templ = PromptTemplate(input_variables=["query"], template=prompt_explanation)
-    chain_explanation = LLMChain(prompt=prompt_explanation_templ, llm=llm)
-    answer = chain_explanation.invoke({"code": code})
+    if on_token is not None:
+        answer = _stream(llm, "code_explanation", {"code": code}, on_token, use_cache=use_cache)
+    else:
+        answer = _invoke(llm, "code_explanation", {"code": code}, use_cache)
 
     return answer["text"].split("Explication:")[1].strip()
 
 def chain_summary(llm: Any, 
-            list_codes: list[str]) -> str:
+            list_codes: list[str],
+            use_cache: bool = True) -> str:
     """
-    Create the LLMChain to explain all the code cells of the notebook.
+    Retrieve the LLMChain to explain all the code cells of the notebook.
 
     Args:
         llm (Any): The large language model object for the LangChain's LLMChain function.
         code (str): The code cells of the notebook
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
 
     Returns:
         str: The notebook summary
 
     """   
-    prompt_summary =  """[INST]Ton rôle est de résumer  en language naturel les commandes python réalisée dans ce notebook:
-    {codes}
-    
-    Utilise simplement les lignes de code données. S'il n'y a pas de code, expliques que le notebook est vide.
-    Limite toi à un paragraphe. 
-    [/INST] 
+    answer = _invoke(llm, "summary", {"codes": list_codes}, use_cache)
 
-    Réponse:
-    Dans ce notebook,"""
-    prompt_summary_templ = PromptTemplate(input_variables=["codes"], template=prompt_summary)
-    chain_summary = LLMChain(prompt=prompt_summary_templ, llm=llm)
-    answer = chain_summary.invoke({"codes": list_codes})
+    return answer["text"].split("Réponse:")[1].strip()
+
+def chain_chunk_summary(llm: Any, 
+                        codes: str,
+                        use_cache: bool = True) -> str:
+    """
+    Retrieve the LLMChain to summarize the code cells of a part of the notebook (map step of the summary).
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        codes (str): The code cells of the part of the notebook
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+
+    Returns:
+        str: The summary of the part
+    """   
+    answer = _invoke(llm, "chunk_summary", {"codes": codes}, use_cache)
+
+    return answer["text"].split("Réponse:")[1].strip()
+
+def chain_summary_reduce(llm: Any, 
+                         summaries: str,
+                         use_cache: bool = True) -> str:
+    """
+    Retrieve the LLMChain to combine the summaries of the successive parts of the notebook (reduce step of the summary).
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        summaries (str): The summaries of the parts, in the order of the notebook
+        use_cache (bool): Whether the response can be served from (and stored in) the LLM response cache.
+
+    Returns:
+        str: The notebook summary
+    """   
+    answer = _invoke(llm, "summary_reduce", {"summaries": summaries}, use_cache)
 
-    return answer["text"].split("Réponse:")[1].strip()       
\ No newline at end of file
+    return answer["text"].split("Réponse:")[1].strip()
@@ -0,0 +1,116 @@
+import re
+from typing import Optional
+
+# Local Module
+from response_extraction import is_valid_code
+
+# An edit of the model: the lines to find in the cell, then their new version.
+_BLOCK = re.compile(r"^[ \t]*<{5,9}[ \t]*SEARCH[ \t]*\n(.*?)^[ \t]*={5,9}[ \t]*\n(.*?)^[ \t]*>{5,9}[ \t]*REPLACE[ \t]*$",
+                    re.MULTILINE | re.DOTALL)
+
+
+def parse_blocks(text: str) -> list[tuple[str, str]]:
+    """
+    Find the search/replace blocks of a response of the LLM, the text around them being ignored.
+
+    Args:
+        text (str): The generated text.
+
+    Returns:
+        list: The searched lines and their replacement of each block, in order.
+    """
+    return [(search.rstrip("\n"), replace.rstrip("\n")) for search, replace in _BLOCK.findall(text)]
+
+
+def _indent(line: str) -> str:
+    """
+    The leading whitespace of a line.
+
+    Args:
+        line (str): The line.
+
+    Returns:
+        str: The indentation.
+    """
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _find(lines: list[str],
+          searched: list[str]) -> Optional[tuple[int, str, str]]:
+    """
+    Find the single occurrence of consecutive lines in a cell, exactly or else up to the indentation and the trailing
+    whitespace (the model often shifts the code it copies).
+
+    Args:
+        lines (list): The lines of the cell.
+        searched (list): The lines to find.
+
+    Returns:
+        Optional[tuple]: The position of the first line, and the indentations of the searched and of the found first
+            line, or None if the lines are missing or ambiguous.
+    """
+    size = len(searched)
+    windows = range(len(lines) - size + 1)
+    exact = [start for start in windows if lines[start:start + size] == searched]
+    if len(exact) == 1:
+        return exact[0], "", ""
+    if exact:
+        return None
+    stripped = [line.strip() for line in searched]
+    loose = [start for start in windows if [line.strip() for line in lines[start:start + size]] == stripped]
+    if len(loose) != 1:
+        return None
+    return loose[0], _indent(searched[0]), _indent(lines[loose[0]])
+
+
+def apply_blocks(code: str,
+                 blocks: list[tuple[str, str]]) -> Optional[str]:
+    """
+    Apply search/replace blocks to the code of a cell, in order. A block with an empty search part appends its lines
+    at the end of the cell. A replacement found up to the indentation is re-indented like the cell.
+
+    Args:
+        code (str): The code of the cell.
+        blocks (list): The searched lines and their replacement of each block.
+
+    Returns:
+        Optional[str]: The patched code, or None if a block does not apply (missing or ambiguous lines).
+    """
+    lines = code.split("\n")
+    for search, replace in blocks:
+        replacement = replace.split("\n") if replace.strip() else []
+        if not search.strip():
+            lines = (lines if code.strip() else []) + replacement
+            continue
+        found = _find(lines, search.strip("\n").split("\n"))
+        if found is None:
+            return None
+        start, searched_indent, found_indent = found
+        size = len(search.strip("\n").split("\n"))
+        lines[start:start + size] = [found_indent + line[len(searched_indent):] if line.startswith(searched_indent) else line
+                                     for line in replacement]
+    return "\n".join(lines)
+
+
+def patch_code(code: str,
+               text: str) -> Optional[str]:
+    """
+    Apply the edits of a response of the LLM to the code of a cell and verify the result: at least one block,
+    every block applied, a change, and valid Python if the cell was.
+
+    Args:
+        code (str): The code of the cell.
+        text (str): The generated text.
+
+    Returns:
+        Optional[str]: The patched code, or None if the cell must be regenerated as a whole.
+    """
+    blocks = parse_blocks(text)
+    if not blocks:
+        return None
+    patched = apply_blocks(code, blocks)
+    if patched is None or patched.strip() == code.strip():
+        return None
+    if is_valid_code(code) and not is_valid_code(patched):
+        return None
+    return patched.strip()
@@ -0,0 +1,220 @@
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+# Local Module
+from metrics import METRICS
+from notebook_modification import JUPYCODER_KEYS
+
+ACTIONS = ["create_code_cell", "create_markdown",
+           "update_last_cell", "update_last_markdown", "update_selected_cell", "update_selected_markdown",
+           "delete_last_cell", "delete_selected_cell",
+           "explain_last_cell", "explain_selected_cell",
+           "summary_all"]
+
+# The requests of the help panel of the Assistant page (jupy_app.display_history) and a few common variants.
+ROUTER_EXAMPLES = {
+    "create_code_cell": ["Crée une cellule qui charge le fichier csv",
+                         "Crée une cellule pour afficher les premières lignes du dataframe",
+                         "Ajoute une cellule qui trace un histogramme",
+                         "Génère le code pour entraîner une régression linéaire",
+                         "Écris une fonction qui calcule la moyenne"],
+    "create_markdown": ["Crée un markdown qui présente le jeu de données",
+                        "Ajoute un markdown avec un titre",
+                        "Écris un markdown pour introduire l'analyse"],
+    "update_last_cell": ["Modifie la dernière cellule pour utiliser seaborn",
+                         "Mets à jour la dernière cellule",
+                         "Corrige la dernière cellule"],
+    "update_last_markdown": ["Modifie le dernier markdown pour le raccourcir",
+                             "Mets à jour la dernière cellule markdown"],
+    "update_selected_cell": ["Modifie la cellule avec la clé Jupycoder pour ajouter un titre",
+                             "Mets à jour la cellule qui a la clé Jupycoder",
+                             "Corrige le code avec la clé Jupycoder"],
+    "update_selected_markdown": ["Modifie le markdown avec la clé Jupycoder",
+                                 "Mets à jour le markdown qui a la clé Jupycoder"],
+    "delete_last_cell": ["Supprime la dernière cellule",
+                         "Efface la dernière cellule"],
+    "delete_selected_cell": ["Supprime la cellule avec la clé Jupycoder",
+                             "Supprime les cellules qui ont la clé Jupycoder"],
+    "explain_last_cell": ["Explique la dernière cellule",
+                          "Expliquer la dernière cellule de code"],
+    "explain_selected_cell": ["Explique la cellule avec la clé Jupycoder",
+                              "Explique le code qui a la clé Jupycoder"],
+    "summary_all": ["Résume le notebook",
+                    "Fais un résumé du notebook",
+                    "Résume tout le code du notebook"],
+}
+
+_POLITE = r"(?:(?:peux[- ]tu|pourrais[- ]tu|merci de|s'il te plait|stp|jupycoder)[ ,]*)*"
+_CREATE = r"(?:cree|creer|ajoute|ajouter|genere|generer|ecris|ecrire|fais|faire)"
+_UPDATE = r"(?:modifie|modifier|mets? a jour|mettre a jour|corrige|corriger|change|changer|ameliore|ameliorer)"
+_DELETE = r"(?:supprime|supprimer|efface|effacer|retire|retirer|enleve|enlever)"
+_EXPLAIN = r"(?:explique|expliquer|commente|commenter)"
+_SUMMARY = r"(?:resume|resumer|fais un resume|faire un resume|synthetise|synthetiser)"
+# The key must be named ("clé JupyCoder") or written (JUPYCODER_KEYS, replaced by its name before normalization):
+# a "clé" alone is usually a key of the user's data.
+_KEY = r"\bcles? (?:de )?jupycoder\b"
+_MARKDOWN = r"(?:le |la |les |un |une )?(?:nouveau |nouvelle |dernier |derniere )?(?:markdown|cellules? (?:de )?(?:markdown|texte)|texte(?: markdown)?)"
+_LAST_MARKDOWN = (r"\b(?:dernier (?:markdown|texte)|derniere cellule (?:de )?(?:markdown|texte)"
+                  r"|(?:markdown|texte) de la derniere cellule)\b")
+_LAST = r"\bderniere cellule\b"
+
+# Ordered rules: the leading verb of the query gives the kind of action, its object gives the target. The last cell
+# is checked before the keys, whose name can appear in the request itself ("la clé 'age' n'existe pas"). A request
+# on the last cell which mentions a markdown otherwise ("change la dernière cellule en markdown") is left to the LLM
+# router (action None). A query matching no rule is left to the TF-IDF model or to the LLM router.
+_RULES = [(re.compile(pattern), action) for pattern, action in [
+    (rf"^{_POLITE}{_UPDATE}\b.*{_LAST_MARKDOWN}", "update_last_markdown"),
+    (rf"^{_POLITE}(?:{_UPDATE}|{_DELETE}|{_EXPLAIN})\b(?=.*{_LAST}).*\b(?:markdown|texte)\b", None),
+    (rf"^{_POLITE}{_UPDATE}\b.*{_LAST}", "update_last_cell"),
+    (rf"^{_POLITE}{_DELETE}\b.*{_LAST}", "delete_last_cell"),
+    (rf"^{_POLITE}{_EXPLAIN}\b.*{_LAST}", "explain_last_cell"),
+    (rf"^{_POLITE}{_UPDATE}\b {_MARKDOWN}\b.*{_KEY}", "update_selected_markdown"),
+    (rf"^{_POLITE}{_UPDATE}\b.*{_KEY}", "update_selected_cell"),
+    (rf"^{_POLITE}{_DELETE}\b.*{_KEY}", "delete_selected_cell"),
+    (rf"^{_POLITE}{_EXPLAIN}\b.*{_KEY}", "explain_selected_cell"),
+    (rf"^{_POLITE}{_SUMMARY}\b.*\b(?:notebook|carnet)\b", "summary_all"),
+    (rf"^{_POLITE}{_CREATE}\b {_MARKDOWN}\b", "create_markdown"),
+    (rf"^{_POLITE}{_CREATE}\b (?:un |une )?(?:nouvelle )?cellule\b", "create_code_cell"),
+]]
+
+_KEYS_PATTERN = re.compile("|".join(re.escape(key) for key in JUPYCODER_KEYS.values()))
+
+MIN_SIMILARITY = 0.75
+MIN_MARGIN = 0.15
+
+
+def normalize(query: str) -> str:
+    """
+    Normalize a query for the local routing: lower case, without accents, punctuation or repeated spaces.
+
+    Args:
+        query (str): The users' query.
+
+    Returns:
+        str: The normalized query.
+    """
+    text = unicodedata.normalize('NFKD', query.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w'\- ]+", ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def ngrams(text: str) -> dict[str, int]:
+    """
+    Count the character 3- to 5-grams of the words of a normalized text.
+
+    Args:
+        text (str): The normalized text.
+
+    Returns:
+        dict: The count of each n-gram.
+    """
+    counts = defaultdict(int)
+    for word in text.split():
+        word = f" {word} "
+        for size in (3, 4, 5):
+            for start in range(len(word) - size + 1):
+                counts[word[start:start+size]] += 1
+    return counts
+
+
+class FastRouter():
+    """
+    A deterministic local router which handles the obvious queries without calling the LLM: keyword/regex rules
+    first, then a TF-IDF model on character n-grams, trained on example requests, which only answers above a
+    similarity threshold and with a margin over the other actions. The other queries are left to the LLM router.
+    """
+
+    def __init__(self,
+                 examples: dict[str, list[str]] = ROUTER_EXAMPLES,
+                 min_similarity: float = MIN_SIMILARITY,
+                 min_margin: float = MIN_MARGIN) -> None:
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        documents = [(action, ngrams(normalize(example))) for action, texts in examples.items() for example in texts]
+        document_frequency = defaultdict(int)
+        for _, counts in documents:
+            for gram in counts:
+                document_frequency[gram] += 1
+        self._idf = {gram: math.log((1 + len(documents)) / (1 + frequency)) + 1
+                     for gram, frequency in document_frequency.items()}
+        self._actions = []
+        # Inverted index: n-gram -> [(example number, normalized weight)]
+        self._index = defaultdict(list)
+        for number, (action, counts) in enumerate(documents):
+            vector = {gram: count * self._idf[gram] for gram, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+            for gram, weight in vector.items():
+                self._index[gram].append((number, weight / norm))
+            self._actions.append(action)
+
+    def _classify(self, text: str) -> tuple[Optional[str], float, float]:
+        """
+        Score a normalized query against the examples with the TF-IDF model.
+
+        Args:
+            text (str): The normalized query.
+
+        Returns:
+            tuple: The best action, its cosine similarity and its margin over the best other action.
+        """
+        counts = ngrams(text)
+        vector = {gram: count * self._idf[gram] for gram, count in counts.items() if gram in self._idf}
+        norm = math.sqrt(sum(count * count * self._idf.get(gram, 1.0) ** 2 for gram, count in counts.items())) or 1.0
+        scores = defaultdict(float)
+        for gram, weight in vector.items():
+            for number, example_weight in self._index[gram]:
+                scores[number] += weight * example_weight / norm
+        best = {}
+        for number, score in scores.items():
+            action = self._actions[number]
+            best[action] = max(best.get(action, 0.0), score)
+        if not best:
+            return None, 0.0, 0.0
+        ranking = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        runner_up = ranking[1][1] if len(ranking) > 1 else 0.0
+        return ranking[0][0], ranking[0][1], ranking[0][1] - runner_up
+
+    def route(self, query: str) -> Optional[str]:
+        """
+        Route a query locally if the action is obvious.
+
+        Args:
+            query (str): The users' query.
+
+        Returns:
+            Optional[str]: The action, or None when the query must be routed by the LLM.
+        """
+        with METRICS.timer("router.fast_path.duration"):
+            text = normalize(_KEYS_PATTERN.sub(" clé JupyCoder ", query))
+            for pattern, action in _RULES:
+                if pattern.search(text):
+                    if action is None:
+                        break
+                    METRICS.increment("router.fast_path.rule")
+                    return action
+            else:
+                action, similarity, margin = self._classify(text)
+                if action is not None and similarity >= self.min_similarity and margin >= self.min_margin:
+                    METRICS.increment("router.fast_path.tfidf")
+                    return action
+        METRICS.increment("router.llm")
+        return None
+
+
+def fast_path_rate() -> float:
+    """
+    The share of the queries routed without calling the LLM since the start of the process.
+
+    Returns:
+        float: The rate, between 0 and 1.
+    """
+    fast = METRICS.counter("router.fast_path.rule") + METRICS.counter("router.fast_path.tfidf")
+    total = fast + METRICS.counter("router.llm")
+    return fast / total if total else 0.0
+
+
+FAST_ROUTER = FastRouter()
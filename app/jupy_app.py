@@ -1,6 +1,13 @@
 import speech_recognition as sr
 import pyperclip
 import streamlit as st
+from langchain_community.llms import HuggingFaceEndpoint, HuggingFaceHub
+from typing import Any
+
+# Local module
+import local_llm
+import resilient_llm
+import token_budget
 
 
 def transcribe_speech() -> str:
@@ -29,6 +36,57 @@ def transcribe_speech() -> str:
         st.write("Erreur lors de la requête à l'API Google : ", e)
         return ""
 
+@st.cache_resource(max_entries=4)
+def load_llm(token: str, 
+             streaming: bool = False,
+             hedging: bool = False,
+             fallback_model: str = "") -> Any:
+    """
+    Build the HuggingFace Inference API client for a token. The client is cached across the Streamlit reruns,
+    so its HTTP connection and the chains built on it are reused. It is wrapped in a resilience layer (deadlines,
+    retries, circuit breaker), whose secondary backend is the local model, if any.
+
+    Args:
+        token (str): The HuggingFace Inference API token.
+        streaming (bool): Whether the client must be able to stream the generated tokens (HuggingFaceEndpoint).
+            It returns the prompt followed by the generated text as well, like HuggingFaceHub.
+        hedging (bool): Whether to send a duplicate request when the first one is slower than usual.
+        fallback_model (str): The path to a local GGUF model used while the API is unavailable, if any.
+
+    Returns:
+        Any: The large language model object.
+    """
+    token_budget.load_tokenizer(token)
+    if streaming:
+        client = HuggingFaceEndpoint(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1",
+                                     huggingfacehub_api_token=token,
+                                     temperature=0.1,
+                                     max_new_tokens=500,
+                                     return_full_text=True,
+                                     timeout=resilient_llm.ATTEMPT_TIMEOUT)
+    else:
+        client = HuggingFaceHub(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1", 
+                                huggingfacehub_api_token=token,
+                                model_kwargs={"temperature": 0.1, "max_new_tokens": 500})
+        # Without a timeout, the client waits indefinitely for a model answering 503 (loading).
+        client.client.timeout = resilient_llm.ATTEMPT_TIMEOUT
+    secondary = load_local_llm(fallback_model) if fallback_model else None
+    return resilient_llm.ResilientLLM(primary=client, secondary=secondary, hedging=hedging)
+
+@st.cache_resource(max_entries=1, show_spinner="Chargement du modèle local...")
+def load_local_llm(model_path: str) -> Any:
+    """
+    Load a local GGUF model with llama.cpp, on the CPU and without network. The model stays loaded across
+    the Streamlit reruns and the sessions (local_llm keeps a single model per process).
+
+    Args:
+        model_path (str): The path to the GGUF file.
+
+    Returns:
+        Any: The large language model object.
+    """
+    return local_llm.load_local_llm(model_path)
+
 def save_to_history(request: str) -> None:
     """
     Save a request to the session history.
@@ -60,12 +118,15 @@ def display_history(agent):
     with col1:
         with st.container():
             st.markdown('<br></br>', unsafe_allow_html=True)
-            col_d, col_b = st.columns([4, 1])
+            col_d, col_b, col_n = st.columns([4, 1, 1])
             with col_d:
-                st.markdown("Pour retourner en arrière dans le notebook, cliquez sur le bouton:")
+                st.markdown("Pour retourner en arrière dans le notebook (ou annuler ce retour), cliquez sur le bouton:")
             with col_b:
                 if st.button("⚠️ Précédent"):
                     agent.last_version()
+            with col_n:
+                if st.button("↪️ Suivant"):
+                    agent.next_version()
             st.markdown('<br></br>', unsafe_allow_html=True)
         with st.container(border = False):
             st.markdown("---")  # Add a horizontal line for separation
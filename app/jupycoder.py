@@ -1,11 +1,19 @@
-import nbformat
-import os
-from typing import Any
+from concurrent.futures import Future
+import functools
+from typing import Any, Callable, Optional
 import re
 
 # Local Module
+import cell_retrieval
 import chain_inferences
+import fast_router
+import llm_executor
+from metrics import METRICS
 import notebook_modification
+import notebook_summary
+import prompt_compaction
+import semantic_cache
+import token_budget
 
 class JupyCoder():
     """  
@@ -15,24 +23,42 @@ class JupyCoder():
 
     def __init__(self, 
                  path: str,
-                 llm: Any) -> None:
+                 llm: Any,
+                 max_workers: int = llm_executor.DEFAULT_MAX_WORKERS,
+                 request_timeout: Optional[float] = llm_executor.DEFAULT_TIMEOUT,
+                 fast_routing: bool = True,
+                 single_call: bool = False,
+                 speculative: bool = False,
+                 compact_prompts: bool = True,
+                 strict_compaction: bool = False,
+                 patch_updates: bool = True,
+                 semantic_caching: bool = False) -> None:
         self.llm =  llm
         self.path = path
+        # Parallelism and per-request timeout of the LLM requests sent for several marked cells at once.
+        self.max_workers = max_workers
+        self.request_timeout = request_timeout
+        # Whether the LLM responses of the current query can be served from the response cache.
+        self.use_cache = True
+        # The function receiving the text streamed by the LLM for the current query, if any.
+        self.on_token = None
+        # Whether the obvious queries are routed locally (fast_router) before calling the LLM router.
+        self.fast_routing = fast_routing
+        # Whether the LLM routes the query and generates the content of the cell in a single request.
+        self.single_call = single_call
+        # Whether the code generation is started speculatively while the LLM router is running.
+        self.speculative = speculative
+        # Whether the cells sent as context are compacted (prompt_compaction), and whether only the rewrites which
+        # keep the code equivalent are allowed.
+        self.compact_prompts = compact_prompts
+        self.strict_compaction = strict_compaction
+        # Whether the large code cells are updated with search/replace edits rather than regenerated.
+        self.patch_updates = patch_updates
+        # Whether the cells generated for the near-duplicate queries are reused (semantic_cache), and whether 
+        # the content of the current query was. Off by default, until its precision is measured on real queries.
+        self.semantic_caching = semantic_caching
+        self._semantic_hit = False
 
-    @staticmethod
-    def _cleaning_code_inference(query:str) -> str:
-        """
-        Cleaning specific to code inference text.
-
-        Args:
-            query (str): The text to clean.
-
-        Returns:
-            str: The cleaned text.
-        """
-        text = query.replace('\_', '_').replace('`',"").replace("python", "").replace('\#', '#')
-        return text
-    
     @staticmethod
     def _global_cleaning_cell(query:str) -> str:
         """
@@ -53,260 +79,475 @@ class JupyCoder():
 
         return clean_cell
 
+    def _map_llm(self, 
+                 chain: Any, 
+                 calls: list[tuple]) -> list[Optional[str]]:
+        """
+        Send independent LLM requests (one per marked cell) concurrently, with the parallelism and timeout of the agent.
+
+        Args:
+            chain (Any): The chain_inferences function to call.
+            calls (list): The arguments of each call.
+
+        Returns:
+            list: The answer of each call in the same order, None for the failed ones.
+        """
+        return llm_executor.map_concurrently(functools.partial(chain, use_cache=self.use_cache), calls, 
+                                             max_workers=self.max_workers, 
+                                             timeout=self.request_timeout)
+
+    def _history(self,
+                 session: notebook_modification.NotebookSession,
+                 query: str) -> list[str]:
+        """
+        Select the previous code cells most relevant to a query, within the token budget of the context, 
+        compacted if enabled.
+
+        Args:
+            session (NotebookSession): The editing session on the notebook.
+            query (str): The query to generate code for.
+
+        Returns:
+            list: The import lines of the notebook and the selected code cells, in order.
+        """
+        if not self.compact_prompts:
+            return cell_retrieval.CELL_RETRIEVER.context(self.path, session.get_all_cell(), query)
+        compact = functools.partial(prompt_compaction.compact_code, strict=self.strict_compaction)
+        history = cell_retrieval.CELL_RETRIEVER.context(self.path, session.get_all_cell(), query, compact=compact)
+        return prompt_compaction.compact_cells(history, self.strict_compaction)
+
+    def _semantic_lookup(self,
+                         query: str,
+                         action: Optional[str]) -> Optional[semantic_cache.SemanticHit]:
+        """
+        Look for the cell generated for a near-duplicate query in the same context (generation_contexts).
+
+        Args:
+            query (str): The query to process.
+            action (Optional[str]): The action of the query if it is already routed.
+
+        Returns:
+            Optional[SemanticHit]: The action and the content of the cell, or None.
+        """
+        if not (self.semantic_caching and self.use_cache):
+            return None
+        actions = semantic_cache.CACHED_ACTIONS if action is None else (action,)
+        if not set(actions) & set(semantic_cache.CACHED_ACTIONS):
+            return None
+        codes = notebook_modification.NotebookSession(self.path).get_all_cell()
+        return semantic_cache.SEMANTIC_CACHE.get(query, semantic_cache.context_key(self.llm, codes), self.path, actions)
+
+    def _remember(self,
+                  action: str,
+                  query: str,
+                  session: notebook_modification.NotebookSession,
+                  content: str) -> None:
+        """
+        Keep a generated cell in the semantic cache, before it is added to the notebook.
+
+        Args:
+            action (str): The action of the query.
+            query (str): The query.
+            session (NotebookSession): The editing session on the notebook.
+            content (str): The generated content of the cell.
+
+        Returns:
+            None
+        """
+        if self.semantic_caching and not self._semantic_hit and content.strip():
+            contexts = semantic_cache.generation_contexts(self.llm, session.get_all_cell(), action, content)
+            semantic_cache.SEMANTIC_CACHE.put(query, contexts, action, content, self.path)
+
     def _get_create_code_cell(self,
                               llm: Any,
                               query:str, 
-                              path: str):
+                              session: notebook_modification.NotebookSession,
+                              content: Optional[str] = None):
         """
         Generate code content based on a query and add it into the Jupyter notebook.
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
             query (str): The query to generate code for.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
+            content (Optional[str]): The code already generated by the single-call mode, the speculative generation 
+                or the semantic cache, if any.
 
         Returns:
             None
         """
-        list_codes = notebook_modification.get_all_cell(path)
-        history = list_codes[-5:]
-        code= chain_inferences.chain_code_generation(llm,query, history)
-        code = self._cleaning_code_inference(code)
-        clean_code = self._global_cleaning_cell(code)
-        clean_code = clean_code.split("This code")[0].strip()
-        notebook_modification.create_code_cell(path, clean_code)
+        if content is None:
+            history = self._history(session, query)
+            code= chain_inferences.chain_code_generation(llm,query, history, use_cache=self.use_cache, on_token=self.on_token)
+        else:
+            code = content
+        self._remember("create_code_cell", query, session, code)
+        session.create_code_cell(code)
     
     def _get_create_markdown(self,
                               llm: Any,
                               query:str, 
-                              path: str):
+                              session: notebook_modification.NotebookSession,
+                              content: Optional[str] = None):
         """
         Generate markdown content based on a query and add it into the Jupyter notebook.
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
             query (str): The query to generate markdown for.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
+            content (Optional[str]): The markdown already generated by the single-call mode or the semantic cache, if any.
 
         Returns:
             None
         """
-        text = chain_inferences.chain_markdown_generation(llm,query)
+        if content is None:
+            text = chain_inferences.chain_markdown_generation(llm,query, use_cache=self.use_cache, on_token=self.on_token)
+        else:
+            text = content
+        self._remember("create_markdown", query, session, text)
         clean_text = self._global_cleaning_cell(text)
-        notebook_modification.create_markdown(path, clean_text)
+        session.create_markdown(clean_text)
 
     def _get_update_last_code_cell(self,
                               llm: Any,
                               query:str, 
-                              path: str):
+                              session: notebook_modification.NotebookSession,
+                              content: Optional[str] = None):
         """
         Update the content of the last code cell based on the query. 
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
             query (str): The query to generate code for.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
+            content (Optional[str]): The updated code already generated by the single-call mode, if any.
 
         Returns:
             None
         """
-        code = notebook_modification.get_last_cell(path) 
-        upd_code = chain_inferences.chain_code_update(llm,query, code)
-        clean_code = self._cleaning_code_inference(upd_code)
-        clean_code = self._global_cleaning_cell(clean_code)
-        notebook_modification.update_last_cell(path, clean_code.strip())    
+        if content is None:
+            code = session.get_last_cell() 
+            upd_code = chain_inferences.chain_code_edit(llm,query, code, use_cache=self.use_cache, patch=self.patch_updates)
+        else:
+            upd_code = content
+        session.update_last_cell(upd_code)
 
     def _get_update_last_markdown(self,
                               llm: Any,
                               query:str, 
-                              path: str):
+                              session: notebook_modification.NotebookSession,
+                              content: Optional[str] = None):
         """
         Update the content of the last markdown cell based on the query. 
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
             query (str): The query to generate markdown for.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
+            content (Optional[str]): The updated markdown already generated by the single-call mode, if any.
 
         Returns:
             None
         """
-        text = notebook_modification.get_last_cell(path)
-        upd_markdown = chain_inferences.chain_markdown_update(llm,text, query)
+        if content is None:
+            text = session.get_last_cell()
+            upd_markdown = chain_inferences.chain_markdown_update(llm,text, query, use_cache=self.use_cache)
+        else:
+            upd_markdown = content
         clean_text = self._global_cleaning_cell(upd_markdown)
-        notebook_modification.update_last_markdown(path, clean_text)
+        session.update_last_markdown(clean_text)
     
     def _get_update_selected_code_cell(self,
                               llm: Any,
                               query:str, 
-                              path: str):
+                              session: notebook_modification.NotebookSession):
         """
-        Update the content of the selected code cell (marked by a JupyCoder key) based on the query. 
+        Update the content of every selected code cell (marked by a JupyCoder key) based on the query. 
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
             query (str): The query to generate code for.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
 
         Returns:
             None
         """
-        ind, code = notebook_modification.get_cell_to_update(path)
-        code = code.replace('## A MODIFIER ##', '')
-        upd_code = chain_inferences.chain_code_update(llm,query, code)
-        code = self._cleaning_code_inference(upd_code)
-        clean_code = self._global_cleaning_cell(code)
-        notebook_modification.update_cell(path, clean_code.strip(), ind)
+        marked = session.get_marked_cells("update")
+        updates = self._map_llm(functools.partial(chain_inferences.chain_code_edit, patch=self.patch_updates), 
+                                [(llm, query, code) for _, code in marked])
+        for (ind, _), upd_code in zip(marked, updates):
+            if upd_code is None:
+                continue
+            session.update_cell(upd_code, [ind])
 
     def _get_update_selected_markdown(self,
                               llm: Any,
                               query:str, 
-                              path: str):
+                              session: notebook_modification.NotebookSession):
         """
-        Update the content of the selected markdown cell (marked by a JupyCoder key) based on the query. 
+        Update the content of every selected markdown cell (marked by a JupyCoder key) based on the query. 
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
             query (str): The query to generate code for.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
 
         Returns:
             None
         """
-        ind, text = notebook_modification.get_cell_to_update(path)
-        text= text.replace('## A MODIFIER ##', '')
-        upd_markdown = chain_inferences.chain_markdown_update(llm,text, query)
-        clean_text = self._global_cleaning_cell(upd_markdown)
-        notebook_modification.update_cell(path, clean_text, ind)
+        marked = session.get_marked_cells("update")
+        updates = self._map_llm(chain_inferences.chain_markdown_update, [(llm, text, query) for _, text in marked])
+        for (ind, _), upd_markdown in zip(marked, updates):
+            if upd_markdown is None:
+                continue
+            clean_text = self._global_cleaning_cell(upd_markdown)
+            session.update_cell(clean_text, [ind])
     
     def _get_explain_last_cell(self,
                               llm: Any,
-                              path: str):
+                              session: notebook_modification.NotebookSession):
         """
         Explain the content of the last code cell and add it into a markdown cell. 
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
 
         Returns:
             None
         """
-        code = notebook_modification.get_last_cell(path)
-        explication = chain_inferences.chain_code_explanation(llm,code)
+        code = session.get_last_cell()
+        explication = chain_inferences.chain_code_explanation(llm,code, use_cache=self.use_cache, on_token=self.on_token)
         clean_text = self._global_cleaning_cell(explication)
-        notebook_modification.create_markdown(path, clean_text)
+        session.create_markdown(clean_text)
 
     def _get_explain_selected_cell(self,
                               llm: Any,
-                              path: str):
+                              session: notebook_modification.NotebookSession):
         """
-        Explain the content of a marked code cell (marked by a Jupycoder key) 
-        and add it into a markdown cell just after the code cell. 
+        Explain the content of every marked code cell (marked by a Jupycoder key) 
+        and add each explanation into a markdown cell just after its code cell. 
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
 
         Returns:
             None
         """
-        ind, code = notebook_modification.get_cell_to_explain(path)
-        code = code.replace('## A EXPLIQUER ##', '')
-        explication = chain_inferences.chain_code_explanation(llm,code)
-        pattern =r' {2,}'
-        clean_text = re.sub(pattern, '', explication)
-        notebook_modification.update_cell(path, code.strip(), ind)
-        notebook_modification.create_explicate_markdown(path, ind, clean_text)
+        marked = session.get_marked_cells("explain")
+        explications = self._map_llm(chain_inferences.chain_code_explanation, [(llm, code) for _, code in marked])
+        # From the last marked cell to the first one, so that the inserted markdowns do not shift the next indices.
+        for (ind, code), explication in reversed(list(zip(marked, explications))):
+            if explication is None:
+                continue
+            pattern =r' {2,}'
+            clean_text = re.sub(pattern, '', explication)
+            session.update_cell(code.strip(), [ind])
+            session.create_explicate_markdown([ind], clean_text)
 
     def _get_summary_all(self,
                               llm: Any,
-                              path: str):
+                              session: notebook_modification.NotebookSession):
         """
         Create a summary of all the code within the notebook and add into a markdown cell at the end of the notebook.
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
-            path (str): The path to the notebook.
+            session (NotebookSession): The editing session on the notebook.
 
         Returns:
             None
         """
-        list_codes = notebook_modification.get_all_cell(path)
-        if len(list_codes) > 0 :
-            combined_code = '\n'.join(cell for cell in list_codes)
-        else: 
-            combined_code = 'Pas de code dans ce notebook.'
-        resume = chain_inferences.chain_summary(llm,combined_code)
+        list_codes = session.get_all_cell()
+        if self.compact_prompts:
+            list_codes = prompt_compaction.compact_cells(list_codes, self.strict_compaction)
+        resume = notebook_summary.summarize_notebook(llm, list_codes, self.path, use_cache=self.use_cache,
+                                                     max_workers=self.max_workers, 
+                                                     timeout=self.request_timeout)
         pattern =r' {2,}'
         clean_text = re.sub(pattern, '', resume)
-        notebook_modification.create_markdown(path, clean_text)
+        session.create_markdown(clean_text)
+
+    def _route_and_generate(self,
+                            llm: Any,
+                            query: str) -> Optional[tuple[str, Optional[str]]]:
+        """
+        Route the query and generate the content of the cell with a single LLM request (single-call mode).
+
+        Args:
+            llm (Any): The large language model object for the LangChain's LLMChain function.
+            query (str): The query to process.
+
+        Returns:
+            Optional[tuple]: The action and the generated content, or None if the answer of the LLM is malformed.
+        """
+        session = notebook_modification.NotebookSession(self.path)
+        records = session.records()
+        history = self._history(session, query)
+        last_cell = records[-1].source if records else ''
+        return chain_inferences.chain_route_and_generate(llm, query, history, last_cell, use_cache=self.use_cache)
+
+    def _speculate(self,
+                   llm: Any,
+                   query: str) -> tuple[Future, int]:
+        """
+        Start the code generation of the query in the background, before knowing the routed action, 
+        since most queries end in create_code_cell.
+
+        Args:
+            llm (Any): The large language model object for the LangChain's LLMChain function.
+            query (str): The query to generate code for.
+
+        Returns:
+            tuple: The pending generated code and the estimated number of tokens of its prompt.
+        """
+        history = self._history(notebook_modification.NotebookSession(self.path), query)
+        future = llm_executor.submit(chain_inferences.chain_code_generation, llm, query, history, use_cache=self.use_cache)
+        prompt = chain_inferences.PROMPT_TEMPLATES["code_generation"].format(query=query, history=history)
+        return future, token_budget.count_tokens(prompt)
+
+    def _resolve_speculation(self,
+                             speculation: tuple[Future, int],
+                             router_action: str) -> Optional[str]:
+        """
+        Keep the speculative code generation if the query was routed to create_code_cell, cancel it otherwise.
+        The hits, misses and the tokens of the discarded generations are counted in the metrics.
+
+        Args:
+            speculation (tuple): The pending generated code and the tokens of its prompt, from _speculate.
+            router_action (str): The action chosen by the router.
+
+        Returns:
+            Optional[str]: The generated code, or None if the speculation is discarded or failed.
+        """
+        future, prompt_tokens = speculation
+        if "create_code_cell" in router_action:
+            try:
+                code = future.result(timeout=self.request_timeout)
+            except Exception:
+                # The code is then generated again by the action.
+                METRICS.increment("speculative.failed")
+                return None
+            METRICS.increment("speculative.hit")
+            return code
+        METRICS.increment("speculative.miss")
+        if future.cancel():
+            return None
+
+        def count_wasted(done: Future) -> None:
+            if done.exception() is None:
+                METRICS.increment("speculative.wasted_tokens", prompt_tokens + token_budget.count_tokens(done.result()))
+
+        future.add_done_callback(count_wasted)
+        return None
 
     def tools(self,
               llm: Any,
               router_action: str, 
                query:str,
-              path: str):
+              path: str,
+              content: Optional[str] = None):
         """
         Perform various notebook modification actions (adding, updating, deleting, explaining) based on the router output.
+        The notebook is parsed once for the action and written back once, at the end of the action.
 
         Args:
             llm (Any): The large language model object for the LangChain's LLMChain function.
             router_action (str): The action to perform, the answer of the Router LLMChain.
             query (str): The query or content for the action.
-            path (str): The path to the notebook.
+            path (str): The path to the Jupyter notebook file, edited in one NotebookSession for the action.
+            content (Optional[str]): The content of the cell already generated by the single-call mode, if any.
 
         Returns:
             None
         """        
         path = path.replace('\\', '/')
 
-        if "create_code_cell" in router_action:
-            self._get_create_code_cell(llm,query, path)
-        elif "create_markdown" in router_action:
-            self._get_create_markdown(llm,query, path)
-        elif "update_last_cell" in router_action:
-            self._get_update_last_code_cell(llm,query, path)
-        elif "update_last_markdown" in router_action:
-            self._get_update_last_markdown(llm,query, path)
-        elif "update_selected_cell" in router_action:
-            self._get_update_selected_code_cell(llm,query, path)
-        elif "update_selected_markdown" in router_action:    
-            self._get_update_selected_markdown(llm,query, path)
-        elif  "delete_last_cell" in router_action:
-            notebook_modification.delete_last_cell(path)
-        elif "delete_selected_cell" in router_action:
-            notebook_modification.delete_cell(path, notebook_modification.get_cell_to_delete(path))
-        elif "explain_last_cell" in router_action:
-            self._get_explain_last_cell(llm,path)
-        elif "explain_selected_cell" in router_action:
-            self._get_explain_selected_cell(llm,path)
-        elif "summary_all" in router_action:
-            self._get_summary_all(llm,path)
-
-    def __call__(self, query:str) -> None:
-        """
-        Infer the intention of the user's query based on a dictionnary of possible functions. Then, 
-        it realizes the action wanted by the user and dynamically update the notebook.
+        with notebook_modification.NotebookSession(path) as session:
+            if "create_code_cell" in router_action:
+                self._get_create_code_cell(llm,query, session, content)
+            elif "create_markdown" in router_action:
+                self._get_create_markdown(llm,query, session, content)
+            elif "update_last_cell" in router_action:
+                self._get_update_last_code_cell(llm,query, session, content)
+            elif "update_last_markdown" in router_action:
+                self._get_update_last_markdown(llm,query, session, content)
+            elif "update_selected_cell" in router_action:
+                self._get_update_selected_code_cell(llm,query, session)
+            elif "update_selected_markdown" in router_action:    
+                self._get_update_selected_markdown(llm,query, session)
+            elif  "delete_last_cell" in router_action:
+                session.delete_last_cell()
+            elif "delete_selected_cell" in router_action:
+                session.delete_marked_cells()
+            elif "explain_last_cell" in router_action:
+                self._get_explain_last_cell(llm,session)
+            elif "explain_selected_cell" in router_action:
+                self._get_explain_selected_cell(llm,session)
+            elif "summary_all" in router_action:
+                self._get_summary_all(llm,session)
+
+    def __call__(self, 
+                 query:str, 
+                 use_cache: bool = True,
+                 on_token: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Infer the intention of the user's query based on a dictionnary of possible functions. The obvious queries
+        are routed locally, the others by the LLM; a near-duplicate of a previous query reuses its cell. Then, it realizes the action wanted by the user and dynamically update the notebook.
 
         Args:
             query (str): The query to process.
+            use_cache (bool): Whether the LLM responses can be served from the response cache. 
+                Set to False to force new inferences.
+            on_token (Optional[Callable]): If given, the code generation, markdown generation and explanation of the 
+                last cell are streamed, and the function receives the text generated so far. The cell is still 
+                written once, at the end.
 
         Returns:
             None
         """
-        action = chain_inferences.chain_router(self.llm, query)
-        self.tools( self.llm, action,query, self.path)
+        self.use_cache = use_cache
+        self.on_token = on_token
+        semantic_cache.SEMANTIC_CACHE.forget_last(self.path)
+        with METRICS.timer("query.duration"):
+            action = fast_router.FAST_ROUTER.route(query) if self.fast_routing else None
+            content = None
+            hit = self._semantic_lookup(query, action)
+            self._semantic_hit = hit is not None
+            if hit is not None:
+                action, content = hit.action, hit.content
+            if action is None and self.single_call:
+                result = self._route_and_generate(self.llm, query)
+                if result is not None:
+                    action, content = result
+            if action is None:
+                speculation = self._speculate(self.llm, query) if self.speculative else None
+                action = chain_inferences.chain_router(self.llm, query, use_cache=self.use_cache)
+                if speculation is not None:
+                    content = self._resolve_speculation(speculation, action)
+            self.tools( self.llm, action,query, self.path, content)
     
     def last_version(self) -> None:
         """
-        Retrieve the last version of the notebook from backup and save the last version as current version.
+        Retrieve the previous version of the notebook from the snapshot store and save it as current version.
+        Can be called several times to step further back. Undoing a cell served or stored by the semantic cache
+        removes it from the cache.
+
+        Returns:
+            None
+        """
+        semantic_cache.SEMANTIC_CACHE.reject_last(self.path)
+        with notebook_modification.NotebookSession(self.path) as session:
+            session.undo()
+
+    def next_version(self) -> None:
+        """
+        Retrieve the version of the notebook undone by the last call to last_version and save it as current version.
 
         Returns:
             None
         """
-        notebook_name = os.path.basename(self.path)
-        backup_path = os.path.join("backup", notebook_name)
-        with open(backup_path, 'r', encoding='utf-8') as f:
-            nb = nbformat.read(f, as_version=4)
-        notebook_modification.save_notebook(self.path, nb)
\ No newline at end of file
+        with notebook_modification.NotebookSession(self.path) as session:
+            session.redo()
\ No newline at end of file
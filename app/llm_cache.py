@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+# Local Module
+from metrics import METRICS
+
+CACHE_DIR = ".jupycoder_cache"
+MAX_CACHED_RESPONSES = 5000
+RESPONSE_TTL = 7 * 24 * 3600
+
+
+def model_signature(llm: Any) -> dict:
+    """
+    Describe the model and generation parameters of an LLM, as part of a cache key.
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+
+    Returns:
+        dict: The identifying parameters of the LLM (model id, task, generation kwargs, ...).
+    """
+    try:
+        params = dict(llm._identifying_params)
+    except Exception:
+        params = {}
+    params["_type"] = type(llm).__name__
+    return params
+
+
+class LLMResponseCache():
+    """
+    A persistent cache of LLM responses stored in SQLite, keyed by the rendered prompt, the model id and the
+    generation parameters. The entries expire after a time-to-live and the least recently used ones are
+    evicted beyond a maximum number of entries. Hits and misses are counted in the metrics.
+    """
+
+    def __init__(self,
+                 path: str = os.path.join(CACHE_DIR, "llm_responses.sqlite"),
+                 max_entries: int = MAX_CACHED_RESPONSES,
+                 ttl: Optional[float] = RESPONSE_TTL) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the database on first use.
+
+        Returns:
+            sqlite3.Connection: The connection, shared by the threads under the lock.
+        """
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                            key TEXT PRIMARY KEY,
+                                            response TEXT NOT NULL,
+                                            created REAL NOT NULL,
+                                            accessed REAL NOT NULL)""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def key(prompt: str,
+            llm: Any,
+            generation_kwargs: Optional[dict] = None) -> str:
+        """
+        Build the cache key of a request.
+
+        Args:
+            prompt (str): The rendered prompt.
+            llm (Any): The large language model object.
+            generation_kwargs (Optional[dict]): The generation parameters passed with the request.
+
+        Returns:
+            str: The key.
+        """
+        payload = json.dumps({"prompt": prompt,
+                              "model": model_signature(llm),
+                              "kwargs": generation_kwargs or {}},
+                             sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self,
+            key: str) -> Optional[str]:
+        """
+        Retrieve a cached response which has not expired.
+
+        Args:
+            key (str): The key of the request.
+
+        Returns:
+            Optional[str]: The response, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                connection.commit()
+                row = None
+            if row is not None:
+                connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                connection.commit()
+        METRICS.increment("llm_cache.hit" if row is not None else "llm_cache.miss")
+        return row[0] if row is not None else None
+
+    def put(self,
+            key: str,
+            response: str) -> None:
+        """
+        Store a response, then evict the expired and least recently used entries.
+
+        Args:
+            key (str): The key of the request.
+            response (str): The response of the LLM.
+
+        Returns:
+            None
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                               (key, response, now, now))
+            if self.ttl is not None:
+                connection.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            connection.execute("""DELETE FROM responses WHERE key IN (
+                                      SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)""",
+                               (self.max_entries,))
+            connection.commit()
+
+    def clear(self) -> None:
+        """
+        Remove every cached response.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+
+LLM_CACHE = LLMResponseCache()
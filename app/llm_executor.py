@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+# Local Module
+from metrics import METRICS
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_TIMEOUT = 120.0
+
+# The requests started in the background (speculative generations), shared by the agents of the process.
+_BACKGROUND = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="jupycoder-background")
+
+
+def submit(func: Callable[..., Any], 
+           *args: Any, 
+           **kwargs: Any) -> Future:
+    """
+    Start an LLM request in the background, e.g. a speculative generation sent while the router is running.
+
+    Args:
+        func (Callable): The function sending the request.
+        *args (Any): Its positional arguments.
+        **kwargs (Any): Its keyword arguments.
+
+    Returns:
+        Future: The pending result. A request which has not started yet can be cancelled, a running one is left to finish.
+    """
+    return _BACKGROUND.submit(func, *args, **kwargs)
+
+
+def failed_requests() -> int:
+    """
+    The number of requests of map_concurrently which failed or ran out of time since the start of the process, 
+    counted in the metrics (llm_executor.failed and llm_executor.timeout).
+
+    Returns:
+        int: The number of abandoned requests.
+    """
+    return METRICS.counter("llm_executor.failed") + METRICS.counter("llm_executor.timeout")
+
+
+def map_concurrently(func: Callable[..., Any],
+                     calls: list[tuple],
+                     max_workers: int = DEFAULT_MAX_WORKERS,
+                     timeout: Optional[float] = DEFAULT_TIMEOUT) -> list[Optional[Any]]:
+    """
+    Run independent LLM requests concurrently, with a bounded number of requests in flight.
+    A request which fails or runs longer than the timeout is abandoned and gives None, the others are kept;
+    it is counted in the metrics (see failed_requests).
+
+    Args:
+        func (Callable): The function sending one request, e.g. chain_inferences.chain_code_update.
+        calls (list): The positional arguments of each request.
+        max_workers (int): The maximum number of concurrent requests.
+        timeout (Optional[float]): The maximum duration of a request in seconds, from its start. None to wait indefinitely.
+
+    Returns:
+        list: The result of each request, in the order of the calls.
+    """
+    results = [None] * len(calls)
+    if not calls:
+        return results
+    started = {}
+
+    def run(ind: int, args: tuple) -> Any:
+        started[ind] = time.monotonic()
+        return func(*args)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls))))
+    try:
+        futures = {executor.submit(run, ind, args): ind for ind, args in enumerate(calls)}
+        pending = set(futures)
+        while pending:
+            deadlines = [started[futures[future]] + timeout for future in pending
+                         if timeout is not None and futures[future] in started]
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+                except Exception:
+                    METRICS.increment("llm_executor.failed")
+            now = time.monotonic()
+            for future in list(pending):
+                ind = futures[future]
+                if timeout is not None and ind in started and now - started[ind] >= timeout:
+                    METRICS.increment("llm_executor.timeout")
+                    pending.discard(future)
+    finally:
+        # The abandoned requests cannot be interrupted, they are left to finish in the background.
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+from langchain_community.llms import LlamaCpp
+from langchain_core.outputs import GenerationChunk
+
+# Local Module
+import chain_inferences
+from metrics import METRICS
+
+# The environment variable with the path of the GGUF file used when no path is given, e.g. a 4-bit quantization
+# of Mistral-7B-Instruct, which shares the prompt format ([INST] ... [/INST]) and the tokenizer of the Mixtral
+# model of the HuggingFace Inference API.
+MODEL_PATH_VARIABLE = "JUPYCODER_LOCAL_MODEL"
+# The context window allocated for the model: the largest input budget of chain_inferences plus its generation.
+LOCAL_CONTEXT_TOKENS = 4096
+# The prompt prefixes shorter than this are evaluated again rather than restored: loading a saved state of the model
+# costs more than evaluating a few tokens.
+MIN_PREFIX_TOKENS = 64
+# The memory allocated to the saved states of the prompt prefixes.
+PREFIX_CACHE_BYTES = 1024 ** 3
+# The names of the generation parameters of the text-generation-inference servers in llama.cpp.
+_PARAMETER_NAMES = {"max_new_tokens": "max_tokens", "repetition_penalty": "repeat_penalty"}
+
+# A llama.cpp model holds a single evaluation context: the requests of the threads of JupyCoder (speculative
+# generation, concurrent summaries) are run one after the other.
+_inference_lock = threading.RLock()
+# The model loaded in the process, kept between the requests and the Streamlit reruns: (parameters, model).
+_loaded = {}
+_loading_lock = threading.Lock()
+
+
+class PrefixCache():
+    """
+    The states of a llama.cpp model (its KV cache) after the fixed beginning of each prompt template, evaluated once
+    at load time. Before a request, the state of the longest prefix of the prompt is restored, so that llama.cpp
+    only evaluates the variable end of the prompt. It is not restored when the model already holds these tokens,
+    e.g. after a request with the same template.
+    """
+
+    def __init__(self,
+                 max_bytes: int = PREFIX_CACHE_BYTES,
+                 min_tokens: int = MIN_PREFIX_TOKENS) -> None:
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.size = 0
+        # Prefix -> (tokens, state of the model after them)
+        self._states = {}
+
+    def precompute(self,
+                   client: Any,
+                   prefixes: list[str]) -> int:
+        """
+        Evaluate the prefixes with the model and save its state after each of them, within the memory budget.
+
+        Args:
+            client (Any): The llama_cpp.Llama model.
+            prefixes (list): The fixed beginnings of the prompts.
+
+        Returns:
+            int: The number of saved states.
+        """
+        for prefix in prefixes:
+            tokens = client.tokenize(prefix.encode('utf-8'), special=True)
+            if len(tokens) < self.min_tokens or prefix in self._states:
+                continue
+            client.reset()
+            client.eval(tokens)
+            state = client.save_state()
+            if self.size + state.llama_state_size > self.max_bytes:
+                METRICS.increment("local_llm.prefix.skipped")
+                continue
+            self._states[prefix] = (tokens, state)
+            self.size += state.llama_state_size
+        client.reset()
+        return len(self._states)
+
+    def restore(self,
+                client: Any,
+                prompt: str) -> bool:
+        """
+        Load the state of the model after the longest saved prefix of a prompt, unless the model already holds it.
+
+        Args:
+            client (Any): The llama_cpp.Llama model.
+            prompt (str): The rendered prompt of the request.
+
+        Returns:
+            bool: Whether the prefix of the prompt is in the model state (restored or already there).
+        """
+        prefixes = [prefix for prefix in self._states if prompt.startswith(prefix)]
+        if not prefixes:
+            METRICS.increment("local_llm.prefix.miss")
+            return False
+        tokens, state = self._states[max(prefixes, key=len)]
+        # The last token of the prefix can be merged with the beginning of the variable part in the prompt.
+        if client.input_ids[:client.n_tokens].tolist()[:len(tokens) - 1] == tokens[:-1]:
+            METRICS.increment("local_llm.prefix.resident")
+            return True
+        with METRICS.timer("local_llm.prefix.restore"):
+            client.load_state(state)
+        METRICS.increment("local_llm.prefix.hit")
+        return True
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def clear(self) -> None:
+        """
+        Remove every saved state.
+
+        Returns:
+            None
+        """
+        self._states.clear()
+        self.size = 0
+
+
+class LocalLlamaCpp(LlamaCpp):
+    """
+    A llama.cpp model on the CPU, used by the chains like the HuggingFace Inference API clients: the generation
+    parameters of the GenerationProfiles are translated (max_new_tokens -> max_tokens) and the prompt is returned
+    before the generated text, as HuggingFaceHub does, for the markers searched by the chains. With a PrefixCache,
+    the fixed beginning of the prompt is restored instead of being evaluated.
+    """
+    prefix_cache: Optional[Any] = None
+
+    @staticmethod
+    def _translate(kwargs: dict) -> dict:
+        """
+        Rename the generation parameters of a request for llama.cpp.
+
+        Args:
+            kwargs (dict): The generation parameters of the request.
+
+        Returns:
+            dict: The parameters with the names of llama.cpp.
+        """
+        return {_PARAMETER_NAMES.get(name, name): value for name, value in kwargs.items()}
+
+    def _call(self,
+              prompt: str,
+              stop: Optional[list[str]] = None,
+              run_manager: Any = None,
+              **kwargs: Any) -> str:
+        with _inference_lock:
+            if self.prefix_cache is not None:
+                self.prefix_cache.restore(self.client, prompt)
+            return prompt + super()._call(prompt, stop, run_manager, **self._translate(kwargs))
+
+    def _stream(self,
+                prompt: str,
+                stop: Optional[list[str]] = None,
+                run_manager: Any = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        # The lock is held until the stream is exhausted or closed (chain_inferences._stream closes it).
+        with _inference_lock:
+            if self.prefix_cache is not None:
+                self.prefix_cache.restore(self.client, prompt)
+            yield from super()._stream(prompt, stop, run_manager, **self._translate(kwargs))
+
+
+def load_local_llm(model_path: Optional[str] = None,
+                   n_ctx: int = LOCAL_CONTEXT_TOKENS,
+                   n_threads: Optional[int] = None,
+                   warm_up: bool = True,
+                   prefix_caching: bool = True) -> LocalLlamaCpp:
+    """
+    Load a GGUF model with llama.cpp, once per process: the same parameters return the loaded model, other parameters
+    replace it (a single model is kept in memory). A first one-token generation maps the weights in memory, so that
+    the first request of the user does not pay for it. The states after the fixed prompt prefixes are then saved.
+
+    Args:
+        model_path (Optional[str]): The path to the GGUF file, by default the JUPYCODER_LOCAL_MODEL variable.
+        n_ctx (int): The context window of the model, in tokens.
+        n_threads (Optional[int]): The number of CPU threads, by default the choice of llama.cpp.
+        warm_up (bool): Whether to run a first generation at load time.
+        prefix_caching (bool): Whether to save the state of the model after the fixed beginning of each prompt
+            of chain_inferences, restored before the requests.
+
+    Returns:
+        LocalLlamaCpp: The large language model object.
+    """
+    model_path = model_path or os.environ.get(MODEL_PATH_VARIABLE, "")
+    if not os.path.isfile(model_path):
+        raise FileNotFoundError(f"Modèle local introuvable : '{model_path}'. Indiquez le chemin d'un fichier GGUF.")
+    parameters = (os.path.abspath(model_path), n_ctx, n_threads, prefix_caching)
+    with _loading_lock:
+        if parameters in _loaded:
+            METRICS.increment("local_llm.reused")
+            return _loaded[parameters]
+        _loaded.clear()
+        start = time.perf_counter()
+        llm = LocalLlamaCpp(model_path=parameters[0],
+                            n_ctx=n_ctx,
+                            n_threads=n_threads,
+                            temperature=0.1,
+                            max_tokens=500,
+                            verbose=False)
+        METRICS.observe("local_llm.load", time.perf_counter() - start)
+        if warm_up:
+            with METRICS.timer("local_llm.warm_up"):
+                llm.invoke("[INST] Bonjour [/INST]", max_new_tokens=1)
+        if prefix_caching:
+            with _inference_lock, METRICS.timer("local_llm.prefix.precompute"):
+                llm.prefix_cache = PrefixCache()
+                llm.prefix_cache.precompute(llm.client, list(chain_inferences.static_prefixes().values()))
+        _loaded[parameters] = llm
+        return llm
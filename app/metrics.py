@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Iterator
+
+MAX_SAMPLES = 1000
+
+
+class Metrics():
+    """
+    A process-wide store of counters and timing samples, to measure the cost of each step of JupyCoder.
+    Only the most recent samples of each timing are kept.
+    """
+
+    def __init__(self,
+                 max_samples: int = MAX_SAMPLES) -> None:
+        self.max_samples = max_samples
+        self._counters = defaultdict(int)
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._lock = threading.Lock()
+
+    def increment(self,
+                  name: str,
+                  value: int = 1) -> None:
+        """
+        Increment a counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (int): The increment.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self,
+                name: str,
+                value: float) -> None:
+        """
+        Record a sample of a measure (a duration in seconds, a number of tokens, ...).
+
+        Args:
+            name (str): The name of the measure.
+            value (float): The sample.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._samples[name].append(value)
+
+    @contextmanager
+    def timer(self,
+              name: str) -> Iterator[None]:
+        """
+        Record the duration of a block, in seconds.
+
+        Args:
+            name (str): The name of the measure.
+
+        Returns:
+            Iterator[None]: The context manager.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def counter(self,
+                name: str) -> int:
+        """
+        Read a counter.
+
+        Args:
+            name (str): The name of the counter.
+
+        Returns:
+            int: The value of the counter.
+        """
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def samples(self,
+                name: str) -> list[float]:
+        """
+        Read the recorded samples of a measure.
+
+        Args:
+            name (str): The name of the measure.
+
+        Returns:
+            list: The samples, from the oldest to the most recent.
+        """
+        with self._lock:
+            return list(self._samples.get(name, ()))
+
+    def summary(self) -> dict:
+        """
+        Summarize the counters and the measures (count, mean, median, 95th percentile and total).
+
+        Returns:
+            dict: The counters under "counters" and the statistics of each measure under "measures".
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            samples = {name: sorted(values) for name, values in self._samples.items() if values}
+        measures = {}
+        for name, values in samples.items():
+            measures[name] = {"count": len(values),
+                              "mean": sum(values) / len(values),
+                              "p50": values[len(values) // 2],
+                              "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                              "total": sum(values)}
+        return {"counters": counters, "measures": measures}
+
+    def reset(self) -> None:
+        """
+        Clear every counter and measure.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._counters.clear()
+            self._samples.clear()
+
+
+METRICS = Metrics()
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+MAX_CACHED_NOTEBOOKS = 4
+
+
+class NotebookCache():
+    """
+    A process-wide LRU cache of parsed notebooks, shared across the actions and the Streamlit reruns.
+    An entry is only served while the file on disk keeps the modification time and size (and, optionally,
+    the content hash) it had when the entry was stored.
+    """
+
+    def __init__(self,
+                 max_notebooks: int = MAX_CACHED_NOTEBOOKS,
+                 verify_hash: bool = False) -> None:
+        self.max_notebooks = max_notebooks
+        self.verify_hash = verify_hash
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(nb_path: str) -> str:
+        """
+        Normalize a notebook path into a cache key.
+
+        Args:
+            nb_path (str): The path to the Jupyter notebook file.
+
+        Returns:
+            str: The cache key.
+        """
+        return os.path.normcase(os.path.abspath(nb_path))
+
+    @staticmethod
+    def _digest(nb_path: str) -> str:
+        """
+        Hash the content of a notebook file.
+
+        Args:
+            nb_path (str): The path to the Jupyter notebook file.
+
+        Returns:
+            str: The hexadecimal digest of the file.
+        """
+        digest = hashlib.sha1()
+        with open(nb_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _fingerprint(self, nb_path: str, stat: Optional[os.stat_result] = None) -> tuple:
+        """
+        Build the fingerprint used to validate an entry against the file on disk.
+
+        Args:
+            nb_path (str): The path to the Jupyter notebook file.
+            stat (Optional[os.stat_result]): The status of the file, if already known.
+
+        Returns:
+            tuple: The modification time, size and (optional) content hash of the file.
+        """
+        stat = stat if stat is not None else os.stat(nb_path)
+        digest = self._digest(nb_path) if self.verify_hash else None
+        return (stat.st_mtime_ns, stat.st_size, digest)
+
+    def get(self, nb_path: str) -> Optional[Any]:
+        """
+        Retrieve the parsed notebook if it is cached and still up to date with the file on disk.
+
+        Args:
+            nb_path (str): The path to the Jupyter notebook file.
+
+        Returns:
+            Optional[Any]: The Jupyter notebook object, or None if it has to be parsed again.
+        """
+        key = self._key(nb_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            fingerprint = self._fingerprint(nb_path)
+        except OSError:
+            self.invalidate(nb_path)
+            return None
+        if fingerprint != entry[0]:
+            self.invalidate(nb_path)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, nb_path: str, nb: Any, stat: Optional[os.stat_result] = None) -> None:
+        """
+        Store a parsed notebook, after it has been read from or written to the disk.
+
+        Args:
+            nb_path (str): The path to the Jupyter notebook file.
+            nb (Any): The Jupyter notebook object.
+            stat (Optional[os.stat_result]): The status of the file taken before reading it, if any.
+
+        Returns:
+            None
+        """
+        fingerprint = self._fingerprint(nb_path, stat)
+        key = self._key(nb_path)
+        with self._lock:
+            self._entries[key] = (fingerprint, nb)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_notebooks:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, nb_path: str) -> None:
+        """
+        Drop the cached notebook, e.g. when its in-memory copy was modified without being saved.
+
+        Args:
+            nb_path (str): The path to the Jupyter notebook file.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.pop(self._key(nb_path), None)
+
+
+NOTEBOOK_CACHE = NotebookCache()
+CELL_RECORD_CACHE = NotebookCache()
@@ -1,8 +1,21 @@
 from nbformat.v4 import new_notebook, new_code_cell, new_markdown_cell
 import nbformat
 import os
-import shutil
-from typing import Any
+import re
+from typing import Any, Optional
+
+# Local Module
+from notebook_cache import CELL_RECORD_CACHE, NOTEBOOK_CACHE
+from notebook_reader import CellRecord, NotebookLayout, read_notebook_layout
+from notebook_writer import PlannedCell, splice_cells
+from snapshot_store import SnapshotStore
+
+# The JupyCoder keys the user writes in a cell to select it for an action.
+JUPYCODER_KEYS = {"update": '## A MODIFIER ##', 
+                  "delete": '## A SUPPRIMER ##', 
+                  "explain": '## A EXPLIQUER ##'}
+_JUPYCODER_KEYS_PATTERN = re.compile('|'.join(re.escape(key) for key in JUPYCODER_KEYS.values()))
+_KEY_KINDS = {key: kind for kind, key in JUPYCODER_KEYS.items()}
 
 def create_notebook(nb_path:str)-> None:
     """
@@ -20,7 +33,8 @@ def create_notebook(nb_path:str)-> None:
 
 def load_notebook(nb_path: str)-> Any:
     """
-    Load a Jupyter notebook from a file and create a backup copy of the original file.
+    Load a Jupyter notebook from a file. The file is only parsed if the process-wide notebook cache does not 
+    hold an up-to-date copy of it; the returned object is shared with the cache and must be saved after being modified.
 
     Args:
         nb_path (str): The path to the Jupyter notebook file.
@@ -28,17 +42,38 @@ def load_notebook(nb_path: str)-> Any:
     Returns:
         Any: The loaded Jupyter notebook object.
     """
+    nb = NOTEBOOK_CACHE.get(nb_path)
+    if nb is not None:
+        return nb
 
+    stat = os.stat(nb_path)
     with open(nb_path, 'r', encoding='utf-8') as f:
         nb = nbformat.read(f, as_version=4)
-    if not os.path.exists('backup'):
-        os.makedirs('backup')
-    notebook_name = os.path.basename(nb_path)
-    backup_path = os.path.join("backup", notebook_name)
-    shutil.copyfile(nb_path, backup_path)
+    NOTEBOOK_CACHE.put(nb_path, nb, stat)
 
     return nb
 
+def load_notebook_layout(nb_path: str) -> NotebookLayout:
+    """
+    Load the cell records (index, type, source, id) of a Jupyter notebook with their byte offsets in the file, 
+    without parsing the outputs. Like load_notebook, the layout is cached until the file changes on disk.
+
+    Args:
+        nb_path (str): The path to the Jupyter notebook file.
+
+    Returns:
+        NotebookLayout: The layout of the notebook file.
+    """
+    layout = CELL_RECORD_CACHE.get(nb_path)
+    if layout is not None:
+        return layout
+
+    stat = os.stat(nb_path)
+    layout = read_notebook_layout(nb_path)
+    CELL_RECORD_CACHE.put(nb_path, layout, stat)
+
+    return layout
+
 def save_notebook(nb_path: str, 
                     nb: Any) -> None:    
     """
@@ -53,8 +88,520 @@ def save_notebook(nb_path: str,
     """
     with open(nb_path, 'w', encoding='utf-8') as f:
         nbformat.write(nb, f)
-        
-    
+    NOTEBOOK_CACHE.put(nb_path, nb)
+
+
+class NotebookSession():
+    """
+    An editing session on a Jupyter notebook. The reads and modifications of an action are applied in memory 
+    and the file is written back once, when the session is flushed. The cell modifications (insertion, new source, 
+    deletion) are planned on the layout of the file and spliced into it, so the notebook is neither parsed nor 
+    re-serialized as a whole; the parsed notebook is only needed to restore a previous version.
+    The state of the notebook before the first modification is recorded once in the snapshot store, so that 
+    the action can be undone.
+    """
+
+    def __init__(self, 
+                 nb_path: str,
+                 snapshots: Optional[SnapshotStore] = None) -> None:
+        self.nb_path = nb_path
+        self.snapshots = snapshots if snapshots is not None else SnapshotStore(nb_path)
+        self._nb = None
+        self._layout = None
+        self._layout_stat = None
+        self._plan = None
+        self._full_write = False
+        self._dirty = False
+        self._pending_snapshot = None
+        self._markers = None
+
+    def __enter__(self) -> "NotebookSession":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+        else:
+            self._discard()
+
+    def _discard(self) -> None:
+        """
+        Give up the modifications of a failed action, which were never written.
+
+        Returns:
+            None
+        """
+        if self._dirty:
+            # The shared cached notebook holds the modifications.
+            NOTEBOOK_CACHE.invalidate(self.nb_path)
+        if self._pending_snapshot is not None:
+            # The cells captured for the snapshot of the action are referenced by no snapshot.
+            self._pending_snapshot = None
+            self.snapshots.collect_garbage()
+
+    @property
+    def nb(self) -> Any:
+        """
+        The parsed notebook, loaded from the disk on first access only. The modifications already planned in the 
+        session are applied to it.
+
+        Returns:
+            Any: The Jupyter notebook object.
+        """
+        if self._nb is None:
+            nb = load_notebook(self.nb_path)
+            if self._plan is not None:
+                nb.cells = [self._planned_to_cell(nb, planned) for planned in self._plan]
+            self._nb = nb
+        return self._nb
+
+    @staticmethod
+    def _planned_to_cell(nb: Any, planned: PlannedCell) -> Any:
+        """
+        Build the notebook cell corresponding to a planned cell.
+
+        Args:
+            nb (Any): The Jupyter notebook object, as read from the file.
+            planned (PlannedCell): The planned cell.
+
+        Returns:
+            Any: The notebook cell.
+        """
+        if planned.cell is not None:
+            return planned.cell
+        cell = nb.cells[planned.record.index]
+        if planned.source is not None:
+            cell.source = planned.source
+        return cell
+
+    def _start_plan(self) -> Optional[list]:
+        """
+        Start planning the modifications on the layout of the file, unless the notebook will be written as a whole.
+
+        Returns:
+            Optional[list]: The planned cells, or None if the notebook will be written as a whole.
+        """
+        if self._plan is None and not self._full_write:
+            self._layout_stat = os.stat(self.nb_path)
+            self._layout = load_notebook_layout(self.nb_path)
+            self._plan = [PlannedCell(record=record) for record in self._layout.records]
+        return self._plan
+
+    def records(self) -> list[CellRecord]:
+        """
+        The lightweight records (index, type, source, id) of the cells, for the reads which do not need the outputs.
+        They reflect the modifications already made in the session.
+
+        Returns:
+            list: A list of CellRecord, in the order of the notebook.
+        """
+        if self._plan is not None:
+            return [CellRecord(ind, planned.cell.cell_type, planned.cell.source, planned.cell.get('id'))
+                    if planned.cell is not None else
+                    planned.record._replace(index=ind, source=planned.record.source if planned.source is None else planned.source)
+                    for ind, planned in enumerate(self._plan)]
+        nb = self._nb if self._nb is not None else NOTEBOOK_CACHE.get(self.nb_path)
+        if nb is None:
+            return load_notebook_layout(self.nb_path).records
+        return [CellRecord(ind, cell.cell_type, cell.source, cell.get('id')) for ind, cell in enumerate(nb.cells)]
+
+    def flush(self) -> None:
+        """
+        Write the pending modifications back to the notebook file, if any.
+
+        Returns:
+            None
+        """
+        if self._dirty:
+            if self._plan is not None:
+                # Checked before the snapshot is recorded: an action which is not written must not be undoable.
+                stat = os.stat(self.nb_path)
+                if (stat.st_mtime_ns, stat.st_size) != (self._layout_stat.st_mtime_ns, self._layout_stat.st_size):
+                    self._discard()
+                    raise RuntimeError("Le notebook a été modifié pendant l'action, les modifications n'ont pas été enregistrées.")
+            if self._pending_snapshot is not None:
+                self.snapshots.push(self._pending_snapshot)
+            if self._plan is None:
+                save_notebook(self.nb_path, self._nb)
+            else:
+                layout = splice_cells(self.nb_path, self._layout, self._plan)
+                # The caches are refreshed with the written notebook, so that the next action neither reads
+                # the layout again nor parses the file.
+                stat = os.stat(self.nb_path)
+                CELL_RECORD_CACHE.put(self.nb_path, layout, stat)
+                if self._nb is not None:
+                    NOTEBOOK_CACHE.put(self.nb_path, self._nb, stat)
+                else:
+                    NOTEBOOK_CACHE.invalidate(self.nb_path)
+            self._dirty = False
+        self._pending_snapshot = None
+        self._layout = self._layout_stat = self._plan = None
+        self._full_write = False
+
+    def _capture(self) -> None:
+        """
+        Capture the state of the notebook before its first modification in the session.
+
+        Returns:
+            None
+        """
+        if self._pending_snapshot is not None or self._dirty:
+            return
+        nb = self._nb if self._nb is not None else NOTEBOOK_CACHE.get(self.nb_path)
+        if nb is not None:
+            self._pending_snapshot = self.snapshots.capture(nb)
+            return
+        layout = load_notebook_layout(self.nb_path)
+        with open(self.nb_path, 'rb') as f:
+            data = f.read()
+        header = {"nbformat": layout.nbformat, "nbformat_minor": layout.nbformat_minor, "metadata": layout.metadata}
+        contents = [data[record.start:record.end].decode('utf-8') for record in layout.records]
+        self._pending_snapshot = self.snapshots.capture_raw(header, contents)
+
+    def _insert_cell(self, 
+                     ind: int, 
+                     cell: Any) -> None:
+        """
+        Insert a new cell at an index.
+
+        Args:
+            ind (int): The index of the new cell.
+            cell (Any): The notebook cell.
+
+        Returns:
+            None
+        """
+        self._capture()
+        plan = self._start_plan()
+        if plan is not None:
+            plan.insert(ind, PlannedCell(cell=cell))
+        if self._nb is not None:
+            self._nb.cells.insert(ind, cell)
+        self._markers = None
+        self._dirty = True
+
+    def _set_source(self, 
+                    ind: int, 
+                    content: str) -> None:
+        """
+        Replace the source of the cell at an index.
+
+        Args:
+            ind (int): The index of the cell.
+            content (str): The new source of the cell.
+
+        Returns:
+            None
+        """
+        self._capture()
+        plan = self._start_plan()
+        if plan is not None:
+            planned = plan[ind]
+            if planned.cell is not None:
+                planned.cell.source = content
+            else:
+                plan[ind] = planned._replace(source=content)
+        if self._nb is not None:
+            self._nb.cells[ind].source = content
+        self._markers = None
+        self._dirty = True
+
+    def _delete_cell(self, 
+                     ind: int) -> None:
+        """
+        Delete the cell at an index.
+
+        Args:
+            ind (int): The index of the cell.
+
+        Returns:
+            None
+        """
+        self._capture()
+        plan = self._start_plan()
+        if plan is not None:
+            del plan[ind]
+        if self._nb is not None:
+            del self._nb.cells[ind]
+        self._markers = None
+        self._dirty = True
+
+    def undo(self) -> bool:
+        """
+        Restore the version of the notebook preceding the last action.
+
+        Returns:
+            bool: True if a previous version was restored.
+        """
+        if not self.snapshots.can_undo():
+            return False
+        manifest = self.snapshots.undo(self.snapshots.capture(self.nb))
+        return self._restore(manifest)
+
+    def redo(self) -> bool:
+        """
+        Restore the version of the notebook undone by the last undo.
+
+        Returns:
+            bool: True if a version was restored.
+        """
+        if not self.snapshots.can_redo():
+            return False
+        manifest = self.snapshots.redo(self.snapshots.capture(self.nb))
+        return self._restore(manifest)
+
+    def _restore(self, manifest: Optional[dict]) -> bool:
+        """
+        Replace the notebook by the state described by a manifest, without recording a new snapshot.
+        The notebook is then written as a whole.
+
+        Args:
+            manifest (Optional[dict]): The manifest of the state to restore.
+
+        Returns:
+            bool: True if a state was restored.
+        """
+        if manifest is None:
+            return False
+        self._nb = self.snapshots.restore(manifest)
+        self._plan = None
+        self._full_write = True
+        self._pending_snapshot = None
+        self._markers = None
+        self._dirty = True
+        return True
+
+    def create_code_cell(self, 
+                         content: str) -> None:
+        """
+        Append a new code cell to the notebook.
+
+        Args:
+            content (str): The content of the code cell.
+
+        Returns:
+            None
+        """
+        self._insert_cell(len(self.records()), new_code_cell(content))
+
+    def create_markdown(self, 
+                        content: str) -> None:
+        """
+        Append a new markdown cell to the notebook.
+
+        Args:
+            content (str): The content of the markdown cell.
+
+        Returns:
+            None
+        """
+        self._insert_cell(len(self.records()), new_markdown_cell(content))
+
+    def create_explicate_markdown(self,
+                                  ind: int, 
+                                  content: str) -> None:
+        """
+        Insert a new markdown cell just after the cell at the specified index.
+
+        Args:
+            ind (int): The index of the cell after which the markdown cell will be inserted.
+            content (str): The content of the markdown cell.
+
+        Returns:
+            None
+        """
+        ind = ind[0]
+        self._insert_cell(ind+1, new_markdown_cell(content))
+
+    def update_last_cell(self, 
+                         content: str) -> None:
+        """
+        Update the content of the last cell.
+
+        Args:
+            content (str): The new content for the last cell.
+
+        Returns:
+            None
+        """
+        self._set_source(len(self.records())-1, content)
+
+    def update_cell(self, 
+                    content: str, 
+                    cell_id: int) -> None:
+        """
+        Update the content of a specific cell (at a specific id).
+
+        Args:
+            content (str): The new content for the cell.
+            cell_id (int): The index of the cell to update.
+
+        Returns:
+            None
+        """
+        if cell_id[0] < len(self.records()):
+            self._set_source(cell_id[0], content)
+        else:
+            print("L'index de cellule spécifié est invalide.")
+
+    def update_markdown(self, 
+                        content: str, 
+                        cell_id: int) -> None:
+        """
+        Update the content of a specific markdown cell (at a specific id).
+
+        Args:
+            content (str): The new content for the cell.
+            cell_id (int): The index of the cell to update.
+
+        Returns:
+            None
+        """
+        records = self.records()
+        if cell_id > 0 and cell_id <= len(records):
+            if records[cell_id-1].cell_type == "markdown":
+                self._set_source(cell_id-1, content)
+            else:
+                print(f"Modification impossible car la cellule {cell_id} est une cellule de code.")
+        else:
+            print("L'index de cellule spécifié est invalide.")
+
+    def update_last_markdown(self, 
+                             content: str) -> None:
+        """
+        Update the content of the last markdown cell.
+
+        Args:
+            content (str): The new content for the last markdown cell.
+
+        Returns:
+            None
+        """
+        records = self.records()
+        cell_id = len(records)-1
+        if records[cell_id].cell_type == "markdown":
+            self._set_source(cell_id, content)
+        else:
+            print(f"Modification impossible car la cellule {cell_id} est une cellule de code.")
+
+    def delete_last_cell(self) -> None:
+        """
+        Delete the last cell.
+
+        Returns:
+            None
+        """
+        self._delete_cell(len(self.records())-1)
+
+    def delete_cell(self, 
+                    cell_id: int) -> None:
+        """
+        Delete a specific cell.
+
+        Args:
+            cell_id (int): The index of the cell to delete.
+
+        Returns:
+            None
+        """
+        if cell_id[0] > 0 and cell_id[0] <= len(self.records()):
+            self._delete_cell(cell_id[0])
+        else:
+            print("L'index de cellule spécifié est invalide.")
+
+    def marker_index(self) -> dict[str, list[int]]:
+        """
+        Index the cells marked by a JupyCoder key, in a single pass over the sources. The index is kept 
+        until the next modification of the session.
+
+        Returns:
+            dict: The indices of the marked cells, in the order of the notebook, for each kind of key 
+                ("update", "delete", "explain").
+        """
+        if self._markers is None:
+            markers = {kind: [] for kind in JUPYCODER_KEYS}
+            for record in self.records():
+                for kind in {_KEY_KINDS[key] for key in _JUPYCODER_KEYS_PATTERN.findall(record.source)}:
+                    markers[kind].append(record.index)
+            for indices in markers.values():
+                indices.sort()
+            self._markers = markers
+        return self._markers
+
+    def get_marked_cells(self, 
+                         kind: str) -> list[tuple[int, str]]:
+        """
+        Retrieve the index and content of every cell marked by a JupyCoder key, with the key removed from the content.
+
+        Args:
+            kind (str): The kind of key ("update", "delete" or "explain").
+
+        Returns:
+            list: A list of (index, content) tuples, in the order of the notebook.
+        """
+        records = self.records()
+        return [(ind, records[ind].source.replace(JUPYCODER_KEYS[kind], ''))
+                for ind in self.marker_index()[kind]]
+
+    def delete_marked_cells(self) -> None:
+        """
+        Delete every cell marked for deletion by a JupyCoder key.
+
+        Returns:
+            None
+        """
+        for ind in reversed(self.marker_index()["delete"]):
+            self._delete_cell(ind)
+
+    def get_last_cell(self) -> str:
+        """
+        Retrieve the content of the last cell.
+
+        Returns:
+            str: The content of the last cell.
+        """
+        records = self.records()
+        return records[len(records)-1].source
+
+    def get_cell_to_update(self) -> tuple[int, str]:
+        """
+        Retrieve the index and content of a cell marked for update with a JupyCoder key.
+
+        Returns:
+            tuple: A tuple containing the index and content of the cell marked for update.
+        """
+        ind_update = self.marker_index()["update"]
+        return ind_update, self.records()[ind_update[0]].source
+
+    def get_cell_to_delete(self) -> int:
+        """
+        Retrieve the indices of cells marked by a JupyCoder key for deletion.
+
+        Returns:
+            int: An integer containing the index of the cell marked for deletion.
+        """
+        return self.marker_index()["delete"]
+
+    def get_cell_to_explain(self) -> tuple[int, str]:
+        """
+        Retrieve the index and content of a cell marked for explanation by a JupyCoder key.
+
+        Returns:
+            tuple: A tuple containing the index and content of the cell marked for explanation.
+        """
+        ind_explain = self.marker_index()["explain"]
+        return ind_explain, self.records()[ind_explain[0]].source
+
+    def get_all_cell(self) -> list[str]:
+        """
+        Retrieve the content of all code cells.
+
+        Returns:
+            list: A list containing the content of all code cells.
+        """
+        return [record.source for record in self.records() if record.cell_type == 'code']
+
+
 def create_code_cell(nb_path: str, 
                         content: str) -> None:
     """
@@ -67,11 +614,9 @@ def create_code_cell(nb_path: str,
     Returns:
         None
     """
-    nb = load_notebook(nb_path)   
-    new_cell = new_code_cell(content)
-    nb.cells.append(new_cell)
-    save_notebook(nb_path, nb)
-    
+    with NotebookSession(nb_path) as session:
+        session.create_code_cell(content)
+
 def create_markdown(nb_path: str, 
                         content: str) -> None:
     """
@@ -84,10 +629,8 @@ def create_markdown(nb_path: str,
     Returns:
         None
     """
-    nb = load_notebook(nb_path)
-    new_cell = new_markdown_cell(content)
-    nb.cells.append(new_cell)
-    save_notebook(nb_path, nb)
+    with NotebookSession(nb_path) as session:
+        session.create_markdown(content)
 
 def create_explicate_markdown(nb_path: str,
                     ind: int, 
@@ -103,11 +646,8 @@ def create_explicate_markdown(nb_path: str,
     Returns:
         None
     """
-    ind = ind[0]
-    nb = load_notebook(nb_path)
-    new_cell = new_markdown_cell(content)
-    nb.cells.insert(ind+1,new_cell)
-    save_notebook(nb_path, nb)
+    with NotebookSession(nb_path) as session:
+        session.create_explicate_markdown(ind, content)
 
 def update_last_cell(nb_path: str, 
                         content: str) -> None:
@@ -121,11 +661,8 @@ def update_last_cell(nb_path: str,
     Returns:
         None
     """
-    nb = load_notebook(nb_path)
-    cell_id = len(nb.cells)-1
-    cell = nb.cells[cell_id]
-    cell.source = content
-    save_notebook(nb_path, nb)
+    with NotebookSession(nb_path) as session:
+        session.update_last_cell(content)
 
 def update_cell(nb_path: str, 
                 content: str, 
@@ -141,13 +678,8 @@ def update_cell(nb_path: str,
     Returns:
         None
     """
-    nb = load_notebook(nb_path)
-    if cell_id[0] < len(nb.cells):
-        cell = nb.cells[cell_id[0]]
-        cell.source = content
-        save_notebook(nb_path, nb)
-    else:
-        print("L'index de cellule spécifié est invalide.")
+    with NotebookSession(nb_path) as session:
+        session.update_cell(content, cell_id)
 
 def update_markdown(nb_path: str, 
                 content: str, 
@@ -163,16 +695,8 @@ def update_markdown(nb_path: str,
     Returns:
         None
     """
-    nb = load_notebook(nb_path)
-    if cell_id > 0 and cell_id <= len(nb.cells):
-        cell = nb.cells[cell_id-1]
-        if cell.cell_type == "markdown":
-            cell.source = content
-        else:
-            print(f"Modification impossible car la cellule {cell_id} est une cellule de code.")
-        save_notebook(nb_path, nb)
-    else:
-        print("L'index de cellule spécifié est invalide.")
+    with NotebookSession(nb_path) as session:
+        session.update_markdown(content, cell_id)
 
 def update_last_markdown(nb_path: str, 
                         content: str) -> None:
@@ -186,14 +710,8 @@ def update_last_markdown(nb_path: str,
     Returns:
         None
     """
-    nb = load_notebook(nb_path)
-    cell_id = len(nb.cells)-1
-    cell = nb.cells[cell_id]
-    if cell.cell_type == "markdown":
-        cell.source = content
-    else:
-        print(f"Modification impossible car la cellule {cell_id} est une cellule de code.")
-    save_notebook(nb_path, nb)
+    with NotebookSession(nb_path) as session:
+        session.update_last_markdown(content)
 
 def delete_last_cell(nb_path: str) -> None:
     """
@@ -205,10 +723,8 @@ def delete_last_cell(nb_path: str) -> None:
     Returns:
         None
     """
-    nb = load_notebook(nb_path)
-    cell_id = len(nb.cells)-1
-    del nb.cells[cell_id]
-    save_notebook(nb_path, nb)
+    with NotebookSession(nb_path) as session:
+        session.delete_last_cell()
 
 def delete_cell(nb_path: str, cell_id: int)-> None:
     """
@@ -221,12 +737,8 @@ def delete_cell(nb_path: str, cell_id: int)-> None:
     Returns:
         None
     """
-    nb = load_notebook(nb_path)    
-    if cell_id[0] > 0 and cell_id[0] <= len(nb.cells):
-        del nb.cells[cell_id[0]]
-        save_notebook(nb_path, nb)
-    else:
-        print("L'index de cellule spécifié est invalide.")
+    with NotebookSession(nb_path) as session:
+        session.delete_cell(cell_id)
 
 def get_last_cell(nb_path: str)-> str:
     """
@@ -238,9 +750,7 @@ def get_last_cell(nb_path: str)-> str:
     Returns:
         str: The content of the last cell.
     """
-    nb = load_notebook(nb_path)
-    last_cell = nb.cells[len(nb.cells)-1]
-    return last_cell.source
+    return NotebookSession(nb_path).get_last_cell()
 
 def get_cell_to_update(nb_path: str)-> tuple[int, str]:
     """
@@ -252,12 +762,7 @@ def get_cell_to_update(nb_path: str)-> tuple[int, str]:
     Returns:
         tuple: A tuple containing the index and content of the cell marked for update.
     """
-    nb = load_notebook(nb_path)
-    all_codes = [cell["source"] for cell in nb.cells]
-    ind_update = [ind for ind, cell in enumerate(all_codes)  if '## A MODIFIER ##' in cell]
-    code = all_codes[ind_update[0]]
-
-    return ind_update,code 
+    return NotebookSession(nb_path).get_cell_to_update()
 
 def get_cell_to_delete(nb_path: str)-> int:
     """
@@ -269,11 +774,7 @@ def get_cell_to_delete(nb_path: str)-> int:
     Returns:
         int: An integer containing the index of the cell marked for deletion.
     """
-    nb = load_notebook(nb_path)
-    all_codes = [cell["source"] for cell in nb.cells]
-    ind_delete = [ind for ind, cell in enumerate(all_codes)  if '## A SUPPRIMER ##' in cell]
-
-    return ind_delete
+    return NotebookSession(nb_path).get_cell_to_delete()
 
 def get_cell_to_explain(nb_path: str)-> tuple[int, str]:
     """
@@ -285,12 +786,8 @@ def get_cell_to_explain(nb_path: str)-> tuple[int, str]:
     Returns:
         tuple: A tuple containing the index and content of the cell marked for explanation.
     """
-    nb = load_notebook(nb_path)
-    all_codes = [cell["source"] for cell in nb.cells]
-    ind_update = [ind for ind, cell in enumerate(all_codes)  if '## A EXPLIQUER ##' in cell]
-    code = all_codes[ind_update[0]]
-    return ind_update, code 
-    
+    return NotebookSession(nb_path).get_cell_to_explain()
+
 def get_all_cell(nb_path: str)-> list[str]:
     """
     Retrieve the content of all code cells in a Jupyter notebook.
@@ -301,6 +798,4 @@ def get_all_cell(nb_path: str)-> list[str]:
     Returns:
         list: A list containing the content of all code cells.
     """
-    nb = load_notebook(nb_path)
-    all_codes = [cell["source"] for cell in nb.cells if cell.get('cell_type') == 'code']
-    return all_codes
\ No newline at end of file
+    return NotebookSession(nb_path).get_all_cell()
\ No newline at end of file
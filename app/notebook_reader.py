@@ -0,0 +1,277 @@
+import json
+import mmap
+import re
+from typing import NamedTuple, Optional
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_STRUCTURE = re.compile(rb'["{}\[\]]')
+_SCALAR = re.compile(rb'[^,}\]\s]+')
+
+# Only these keys of a cell are decoded, the outputs and attachments are skipped without being materialized.
+_CELL_KEYS = ("cell_type", "source", "id")
+
+
+class CellRecord(NamedTuple):
+    """
+    A lightweight view of a notebook cell, without its outputs, attachments and metadata. The byte offsets of
+    the cell object and of its source value in the file are kept for the splice writer.
+    """
+    index: int
+    cell_type: str
+    source: str
+    id: Optional[str]
+    start: Optional[int] = None
+    end: Optional[int] = None
+    source_start: Optional[int] = None
+    source_end: Optional[int] = None
+
+
+class NotebookLayout(NamedTuple):
+    """
+    The cell records of a notebook file with the byte offsets of its "cells" array and its top-level fields.
+    """
+    records: list
+    cells_open: int
+    cells_close: int
+    metadata: dict
+    nbformat: int
+    nbformat_minor: int
+
+
+def _skip_whitespace(data: bytes, pos: int) -> int:
+    """
+    Move past the whitespace at a position.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The current position.
+
+    Returns:
+        int: The position of the next non-whitespace byte.
+    """
+    return _WHITESPACE.match(data, pos).end()
+
+
+def _expect(data: bytes, pos: int, char: bytes) -> int:
+    """
+    Check the structural character at a position (after whitespace) and move past it.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The current position.
+        char (bytes): The expected character.
+
+    Returns:
+        int: The position following the character.
+    """
+    pos = _skip_whitespace(data, pos)
+    if data[pos:pos+1] != char:
+        raise ValueError(f"Notebook JSON invalide : {char.decode()} attendu à la position {pos}.")
+    return pos + 1
+
+
+def _skip_string(data: bytes, pos: int) -> int:
+    """
+    Move past a JSON string. The closing quote is searched with bytes.find, which is much faster than a regex
+    on the long base64 or HTML strings of the outputs.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The position of the opening quote.
+
+    Returns:
+        int: The position following the closing quote.
+    """
+    pos += 1
+    while True:
+        quote = data.find(b'"', pos)
+        if quote == -1:
+            raise ValueError("Notebook JSON invalide : chaîne non terminée.")
+        backslash = data.find(b'\\', pos, quote)
+        if backslash == -1:
+            return quote + 1
+        pos = backslash + 2
+
+
+def _skip_value(data: bytes, pos: int) -> int:
+    """
+    Move past a JSON value without decoding it, so large base64 images or HTML outputs are never copied.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The position of the value.
+
+    Returns:
+        int: The position following the value.
+    """
+    pos = _skip_whitespace(data, pos)
+    first = data[pos:pos+1]
+    if first == b'"':
+        return _skip_string(data, pos)
+    if first not in (b'{', b'['):
+        return _SCALAR.match(data, pos).end()
+    depth = 0
+    while True:
+        match = _STRUCTURE.search(data, pos)
+        if match is None:
+            raise ValueError("Notebook JSON invalide : valeur non terminée.")
+        char = match.group()
+        if char == b'"':
+            pos = _skip_string(data, match.start())
+            continue
+        pos = match.end()
+        depth += 1 if char in (b'{', b'[') else -1
+        if depth == 0:
+            return pos
+
+
+def _decode_value(data: bytes, pos: int) -> tuple:
+    """
+    Decode the JSON value at a position.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The position of the value.
+
+    Returns:
+        tuple: The decoded value and the position following it.
+    """
+    start = _skip_whitespace(data, pos)
+    end = _skip_value(data, start)
+    return json.loads(data[start:end]), end
+
+
+def _iter_object(data: bytes, pos: int):
+    """
+    Iterate over the members of a JSON object, yielding each key with the position of its value.
+    The caller moves past the value and sends back the position following it.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The position of the object.
+
+    Yields:
+        tuple: The key and the position of its value.
+    """
+    pos = _expect(data, pos, b'{')
+    pos = _skip_whitespace(data, pos)
+    if data[pos:pos+1] == b'}':
+        return pos + 1
+    while True:
+        key, pos = _decode_value(data, pos)
+        pos = _expect(data, pos, b':')
+        pos = yield key, pos
+        pos = _skip_whitespace(data, pos)
+        if data[pos:pos+1] == b'}':
+            return pos + 1
+        pos = _expect(data, pos, b',')
+
+
+def _read_cell(data: bytes, pos: int, index: int) -> tuple:
+    """
+    Read the type, source and id of a cell, skipping every other member.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The position of the cell object.
+        index (int): The index of the cell in the notebook.
+
+    Returns:
+        tuple: The cell record and the position following the cell.
+    """
+    values = {}
+    source_start = source_end = None
+    start = _skip_whitespace(data, pos)
+    members = _iter_object(data, start)
+    try:
+        key, pos = next(members)
+        while True:
+            if key in _CELL_KEYS:
+                value_start = _skip_whitespace(data, pos)
+                values[key], pos = _decode_value(data, value_start)
+                if key == "source":
+                    source_start, source_end = value_start, pos
+            else:
+                pos = _skip_value(data, pos)
+            key, pos = members.send(pos)
+    except StopIteration as stop:
+        pos = stop.value
+    source = values.get("source", "")
+    if isinstance(source, list):
+        source = "".join(source)
+    record = CellRecord(index, values.get("cell_type"), source, values.get("id"),
+                        start, pos, source_start, source_end)
+    return record, pos
+
+
+def _read_cells(data: bytes, pos: int) -> tuple:
+    """
+    Read the records of the cells of the "cells" array.
+
+    Args:
+        data (bytes): The JSON document.
+        pos (int): The position of the array.
+
+    Returns:
+        tuple: The list of cell records, the positions of the opening and closing brackets of the array and 
+            the position following the array.
+    """
+    records = []
+    cells_open = _skip_whitespace(data, pos)
+    pos = _expect(data, cells_open, b'[')
+    pos = _skip_whitespace(data, pos)
+    while data[pos:pos+1] != b']':
+        if records:
+            pos = _skip_whitespace(data, _expect(data, pos, b','))
+        record, pos = _read_cell(data, pos, len(records))
+        records.append(record)
+        pos = _skip_whitespace(data, pos)
+    return records, cells_open, pos, pos + 1
+
+
+def read_notebook_layout(nb_path: str) -> NotebookLayout:
+    """
+    Read the cell records of a Jupyter notebook along with the byte offsets needed to splice cells into the file.
+    The file is memory-mapped and scanned without building the outputs, attachments or cell metadata, and without 
+    nbformat validation, which makes it much faster and lighter than nbformat.read on notebooks with heavy outputs.
+
+    Args:
+        nb_path (str): The path to the Jupyter notebook file.
+
+    Returns:
+        NotebookLayout: The layout of the notebook file.
+    """
+    with open(nb_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            fields = {"cells": ([], None, None), "metadata": {}, "nbformat": 4, "nbformat_minor": 0}
+            members = _iter_object(data, 0)
+            try:
+                key, pos = next(members)
+                while True:
+                    if key == "cells":
+                        records, cells_open, cells_close, pos = _read_cells(data, pos)
+                        fields["cells"] = (records, cells_open, cells_close)
+                    elif key in fields:
+                        fields[key], pos = _decode_value(data, pos)
+                    else:
+                        pos = _skip_value(data, pos)
+                    key, pos = members.send(pos)
+            except StopIteration:
+                pass
+    records, cells_open, cells_close = fields["cells"]
+    return NotebookLayout(records, cells_open, cells_close, 
+                          fields["metadata"], fields["nbformat"], fields["nbformat_minor"])
+
+
+def read_cell_records(nb_path: str) -> list[CellRecord]:
+    """
+    Read the index, type, source and id of every cell of a Jupyter notebook, without materializing the outputs
+    and attachments.
+
+    Args:
+        nb_path (str): The path to the Jupyter notebook file.
+
+    Returns:
+        list: A list of CellRecord, in the order of the notebook.
+    """
+    return read_notebook_layout(nb_path).records
@@ -0,0 +1,373 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+# Local Module
+import chain_inferences
+from llm_cache import CACHE_DIR, model_signature
+import llm_executor
+from metrics import METRICS
+import token_budget
+
+# The token budget of the code sent in one summary request. A notebook within the budget is summarized in a single
+# request; a larger one is split into chunks summarized concurrently, so that the latency depends on the largest
+# chunk rather than on the size of the notebook.
+CHUNK_TOKENS = 1500
+# A chunk also ends after a cell whose hash is a multiple of this modulus (about one cell in four): the boundaries
+# depend on the content of the cells, so that editing a cell only changes its own chunk and the summaries of the
+# other chunks can be reused.
+BOUNDARY_MODULUS = 4
+MAX_CACHED_SUMMARIES = 2000
+
+
+class SummaryStats(NamedTuple):
+    """
+    The reuse of the cached chunk summaries by the last summary of a notebook.
+    """
+    chunks: int
+    reused_chunks: int
+    cells: int
+    reused_cells: int
+    evicted: int
+
+    @property
+    def reuse_ratio(self) -> float:
+        """
+        The share of the cells whose summary was reused, between 0 and 1.
+        """
+        return self.reused_cells / self.cells if self.cells else 0.0
+
+
+class SummaryCache():
+    """
+    A persistent cache of the summaries of the chunks of the notebooks, stored in SQLite and keyed by the hashes of
+    the cells of each chunk and by the model. After each summary of a notebook, the summaries of its chunks which no
+    longer exist (deleted or modified cells) are evicted; the least recently used entries are evicted beyond a maximum.
+    """
+
+    def __init__(self,
+                 path: str = os.path.join(CACHE_DIR, "summaries.sqlite"),
+                 max_entries: int = MAX_CACHED_SUMMARIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        # Absolute path of the notebook -> SummaryStats of its last summary.
+        self.last_stats = {}
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the database on first use.
+
+        Returns:
+            sqlite3.Connection: The connection, shared by the threads under the lock.
+        """
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS summaries (
+                                            notebook TEXT NOT NULL,
+                                            key TEXT NOT NULL,
+                                            summary TEXT NOT NULL,
+                                            accessed REAL NOT NULL,
+                                            PRIMARY KEY (notebook, key))""")
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def key(cell_hashes: list[str],
+            llm: Any) -> str:
+        """
+        Build the cache key of a chunk.
+
+        Args:
+            cell_hashes (list): The hashes of the cells (or parts of cells) of the chunk.
+            llm (Any): The large language model object.
+
+        Returns:
+            str: The key.
+        """
+        payload = json.dumps({"cells": cell_hashes,
+                              "model": model_signature(llm),
+                              "profile": chain_inferences.GENERATION_PROFILES["chunk_summary"]._asdict()},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_many(self,
+                 notebook: str,
+                 keys: list[str]) -> dict[str, str]:
+        """
+        Retrieve the cached summaries of chunks of a notebook.
+
+        Args:
+            notebook (str): The absolute path of the notebook.
+            keys (list): The keys of the chunks.
+
+        Returns:
+            dict: The summary of each cached chunk, by key.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            found = {}
+            for key in set(keys):
+                row = connection.execute("SELECT summary FROM summaries WHERE notebook = ? AND key = ?", 
+                                         (notebook, key)).fetchone()
+                if row is not None:
+                    found[key] = row[0]
+            connection.executemany("UPDATE summaries SET accessed = ? WHERE notebook = ? AND key = ?", 
+                                   [(now, notebook, key) for key in found])
+            connection.commit()
+        return found
+
+    def put_many(self,
+                 notebook: str,
+                 summaries: dict[str, str]) -> None:
+        """
+        Store the summaries of chunks of a notebook, then evict the least recently used entries.
+
+        Args:
+            notebook (str): The absolute path of the notebook.
+            summaries (dict): The summary of each chunk, by key.
+
+        Returns:
+            None
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO summaries (notebook, key, summary, accessed) VALUES (?, ?, ?, ?)",
+                                   [(notebook, key, summary, now) for key, summary in summaries.items()])
+            connection.execute("""DELETE FROM summaries WHERE rowid IN (
+                                      SELECT rowid FROM summaries ORDER BY accessed DESC LIMIT -1 OFFSET ?)""",
+                               (self.max_entries,))
+            connection.commit()
+
+    def retain(self,
+               notebook: str,
+               keys: list[str]) -> int:
+        """
+        Evict the summaries of the chunks of a notebook which are not among its current chunks.
+
+        Args:
+            notebook (str): The absolute path of the notebook.
+            keys (list): The keys of the current chunks.
+
+        Returns:
+            int: The number of evicted summaries.
+        """
+        with self._lock:
+            connection = self._connect()
+            stored = [row[0] for row in connection.execute("SELECT key FROM summaries WHERE notebook = ?", (notebook,))]
+            stale = set(stored) - set(keys)
+            connection.executemany("DELETE FROM summaries WHERE notebook = ? AND key = ?", 
+                                   [(notebook, key) for key in stale])
+            connection.commit()
+        return len(stale)
+
+    def clear(self) -> None:
+        """
+        Remove every cached summary.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM summaries")
+            connection.commit()
+        self.last_stats.clear()
+
+
+SUMMARY_CACHE = SummaryCache()
+
+
+def _cell_hash(text: str) -> str:
+    """
+    Hash the source of a cell (or of a part of a cell).
+
+    Args:
+        text (str): The source.
+
+    Returns:
+        str: The hexadecimal SHA-1 of the source.
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _split_cell(cell: str,
+                max_tokens: int) -> list[str]:
+    """
+    Split a cell larger than the budget into parts of whole lines (a single line larger than the budget is kept whole).
+
+    Args:
+        cell (str): The code of the cell.
+        max_tokens (int): The token budget of a part.
+
+    Returns:
+        list: The parts of the cell.
+    """
+    parts, current, tokens = [], [], 0
+    for line in cell.split("\n"):
+        line_tokens = token_budget.count_tokens(line) + 1
+        if current and tokens + line_tokens > max_tokens:
+            parts.append("\n".join(current))
+            current, tokens = [], 0
+        current.append(line)
+        tokens += line_tokens
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+
+def _group(texts: list[str],
+           max_tokens: int,
+           content_defined: bool = False) -> list[list[str]]:
+    """
+    Group consecutive texts (code cells or summaries) into chunks within a token budget, in order. A text larger than
+    the budget is split into parts of whole lines.
+
+    Args:
+        texts (list): The texts.
+        max_tokens (int): The token budget of a chunk.
+        content_defined (bool): Whether a chunk also ends after a text whose hash is a multiple of BOUNDARY_MODULUS.
+
+    Returns:
+        list: The texts (or parts of texts) of each chunk.
+    """
+    chunks, current, tokens = [], [], 0
+    for text in texts:
+        for part in _split_cell(text, max_tokens) if token_budget.count_tokens(text) > max_tokens else [text]:
+            part_tokens = token_budget.count_tokens(part) + 1
+            if current and tokens + part_tokens > max_tokens:
+                chunks.append(current)
+                current, tokens = [], 0
+            current.append(part)
+            tokens += part_tokens
+            if content_defined and int(_cell_hash(part)[:8], 16) % BOUNDARY_MODULUS == 0:
+                chunks.append(current)
+                current, tokens = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_texts(texts: list[str],
+                max_tokens: int = CHUNK_TOKENS) -> list[str]:
+    """
+    Group consecutive texts (code cells or summaries) into chunks within a token budget, in order.
+
+    Args:
+        texts (list): The texts.
+        max_tokens (int): The token budget of a chunk.
+
+    Returns:
+        list: The chunks, the texts of a chunk being separated by a blank line.
+    """
+    return ["\n\n".join(chunk) for chunk in _group(texts, max_tokens)]
+
+
+def _summarize_chunks(llm: Any,
+                      codes: list[str],
+                      nb_path: Optional[str],
+                      use_cache: bool,
+                      max_tokens: int,
+                      max_workers: int,
+                      timeout: Optional[float]) -> list[Optional[str]]:
+    """
+    Summarize the chunks of the code cells of a notebook (map step). The chunk boundaries depend on the content of 
+    the cells, and the summaries of the chunks are kept in SUMMARY_CACHE: only the new or modified chunks are sent 
+    to the LLM, the others are reused.
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        codes (list): The code cells of the notebook.
+        nb_path (Optional[str]): The path to the notebook, None to bypass the summary cache.
+        use_cache (bool): Whether the summaries can be served from the caches.
+        max_tokens (int): The token budget of a chunk.
+        max_workers (int): The maximum number of concurrent requests.
+        timeout (Optional[float]): The maximum duration of a request in seconds.
+
+    Returns:
+        list: The summary of each chunk, in order, None for the failed ones.
+    """
+    chunks = _group(codes, max_tokens, content_defined=True)
+    texts = ["\n\n".join(chunk) for chunk in chunks]
+    keys = [SummaryCache.key([_cell_hash(part) for part in chunk], llm) for chunk in chunks]
+    notebook = os.path.abspath(nb_path) if nb_path is not None else None
+    cached = SUMMARY_CACHE.get_many(notebook, keys) if notebook is not None and use_cache else {}
+
+    missing = [ind for ind, key in enumerate(keys) if key not in cached]
+    summaries = llm_executor.map_concurrently(functools.partial(chain_inferences.chain_chunk_summary, use_cache=use_cache),
+                                              [(llm, texts[ind]) for ind in missing], 
+                                              max_workers=max_workers, timeout=timeout)
+    new = {keys[ind]: summary for ind, summary in zip(missing, summaries) if summary}
+    if notebook is not None:
+        SUMMARY_CACHE.put_many(notebook, new)
+        evicted = SUMMARY_CACHE.retain(notebook, keys)
+        reused = [ind for ind, key in enumerate(keys) if key in cached]
+        stats = SummaryStats(chunks=len(chunks), reused_chunks=len(reused), 
+                             cells=sum(len(chunk) for chunk in chunks), 
+                             reused_cells=sum(len(chunks[ind]) for ind in reused),
+                             evicted=evicted)
+        SUMMARY_CACHE.last_stats[notebook] = stats
+        METRICS.increment("summary_cache.hit", stats.reused_chunks)
+        METRICS.increment("summary_cache.miss", stats.chunks - stats.reused_chunks)
+        METRICS.observe("summary_cache.reuse_ratio", stats.reuse_ratio)
+    return [cached.get(key, new.get(key)) for key in keys]
+
+
+def summarize_notebook(llm: Any,
+                       codes: list[str],
+                       nb_path: Optional[str] = None,
+                       use_cache: bool = True,
+                       max_tokens: int = CHUNK_TOKENS,
+                       max_workers: int = llm_executor.DEFAULT_MAX_WORKERS,
+                       timeout: Optional[float] = llm_executor.DEFAULT_TIMEOUT) -> str:
+    """
+    Summarize the code cells of a notebook. A notebook within the token budget is summarized with a single request
+    (chain_summary). Otherwise the cells are split into chunks within the budget, which are summarized concurrently
+    (map), then the summaries of the chunks are combined into the final paragraph (reduce); if they exceed the budget
+    themselves, they are first combined by groups. The summaries of the chunks are cached per notebook, so that 
+    after an edit only the new or modified chunks are summarized again.
+
+    Args:
+        llm (Any): The large language model object for the LangChain's LLMChain function.
+        codes (list): The code cells of the notebook.
+        nb_path (Optional[str]): The path to the notebook, which owns the cached chunk summaries. 
+            None to bypass the summary cache.
+        use_cache (bool): Whether the responses can be served from the LLM response cache and the summary cache.
+        max_tokens (int): The token budget of the code (or summaries) sent in one request.
+        max_workers (int): The maximum number of concurrent requests.
+        timeout (Optional[float]): The maximum duration of a request in seconds.
+
+    Returns:
+        str: The notebook summary.
+    """
+    if not codes:
+        return chain_inferences.chain_summary(llm, 'Pas de code dans ce notebook.', use_cache=use_cache)
+    chunks = chunk_texts(codes, max_tokens)
+    if len(chunks) == 1:
+        return chain_inferences.chain_summary(llm, chunks[0], use_cache=use_cache)
+
+    summaries = _summarize_chunks(llm, codes, nb_path, use_cache, max_tokens, max_workers, timeout)
+    groups = chunk_texts([summary for summary in summaries if summary], max_tokens)
+    if not groups:
+        raise RuntimeError("Aucune partie du notebook n'a pu être résumée.")
+    while len(groups) > 1:
+        combined = llm_executor.map_concurrently(functools.partial(chain_inferences.chain_summary_reduce, use_cache=use_cache),
+                                                 [(llm, group) for group in groups], 
+                                                 max_workers=max_workers, timeout=timeout)
+        combined = chunk_texts([summary for summary in combined if summary], max_tokens)
+        if not combined or len(combined) >= len(groups):
+            # The intermediate summaries do not shrink any more: combine them as they are.
+            break
+        groups = combined
+    return chain_inferences.chain_summary_reduce(llm, "\n\n".join(groups), use_cache=use_cache)
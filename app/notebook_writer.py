@@ -0,0 +1,182 @@
+import json
+from typing import Any, NamedTuple, Optional
+
+# Local Module
+from notebook_reader import CellRecord, NotebookLayout
+
+# Same layout as nbformat.write: one space of indentation per level, the cells sit at depth 2
+# and their members at depth 3.
+_CELL_DEPTH = 2
+_MEMBER_DEPTH = 3
+_SEPARATOR = ",\n" + " " * _CELL_DEPTH
+# The key of the source of a cell serialized by _dumps_cell.
+_SOURCE_KEY = ("\n" + " " * _MEMBER_DEPTH + '"source": ').encode('utf-8')
+
+
+class PlannedCell(NamedTuple):
+    """
+    A cell of the notebook as it will be written by the splice writer: either an existing cell of the file,
+    possibly with a new source, or a new cell.
+    """
+    record: Optional[CellRecord] = None
+    source: Optional[str] = None
+    cell: Optional[Any] = None
+
+
+def _dumps(value: Any, depth: int) -> str:
+    """
+    Serialize a JSON value as nbformat.write does, for a value nested at a given depth of the notebook.
+
+    Args:
+        value (Any): The value to serialize.
+        depth (int): The nesting depth of the value in the notebook.
+
+    Returns:
+        str: The serialized value.
+    """
+    text = json.dumps(value, indent=1, sort_keys=True, separators=(",", ": "), ensure_ascii=False)
+    return text.replace("\n", "\n" + " " * depth)
+
+
+def _source_lines(source: Any) -> list:
+    """
+    Split a cell source into lines, as nbformat.write stores it.
+
+    Args:
+        source (Any): The source, a string or a list of lines.
+
+    Returns:
+        list: The lines of the source.
+    """
+    return source.splitlines(True) if isinstance(source, str) else source
+
+
+def _dumps_cell(cell: Any) -> str:
+    """
+    Serialize a new cell as nbformat.write does, with its source split into lines.
+
+    Args:
+        cell (Any): The cell object.
+
+    Returns:
+        str: The serialized cell.
+    """
+    cell = dict(cell)
+    if "source" in cell:
+        cell["source"] = _source_lines(cell["source"])
+    return _dumps(cell, _CELL_DEPTH)
+
+
+def _render(data: bytes, offset: int, planned: PlannedCell) -> bytes:
+    """
+    Render a planned cell. Existing cells are copied from the file, only their source value is re-serialized
+    if it changed.
+
+    Args:
+        data (bytes): The content of the file from the offset onward.
+        offset (int): The position of data in the file.
+        planned (PlannedCell): The planned cell.
+
+    Returns:
+        bytes: The JSON of the cell.
+    """
+    if planned.cell is not None:
+        return _dumps_cell(planned.cell).encode('utf-8')
+    record = planned.record
+    start, end = record.start - offset, record.end - offset
+    if planned.source is None:
+        return data[start:end]
+    source = _dumps(planned.source.splitlines(True), _MEMBER_DEPTH).encode('utf-8')
+    return data[start:record.source_start-offset] + source + data[record.source_end-offset:end]
+
+
+def _placed_record(planned: PlannedCell, piece: bytes, start: int, index: int) -> CellRecord:
+    """
+    Build the record of a planned cell once written at a position of the file, as read_notebook_layout would
+    read it back.
+
+    Args:
+        planned (PlannedCell): The planned cell.
+        piece (bytes): The JSON of the cell, from _render.
+        start (int): The position of the cell in the written file.
+        index (int): The index of the cell in the notebook.
+
+    Returns:
+        CellRecord: The record of the written cell.
+    """
+    end = start + len(piece)
+    if planned.cell is not None:
+        cell = planned.cell
+        source = cell.get("source", "")
+        source = source if isinstance(source, str) else "".join(source)
+        source_start = start + piece.index(_SOURCE_KEY) + len(_SOURCE_KEY)
+        source_end = source_start + len(_dumps(_source_lines(source), _MEMBER_DEPTH).encode('utf-8'))
+        return CellRecord(index, cell.get("cell_type"), source, cell.get("id"), start, end, source_start, source_end)
+    record = planned.record
+    source_start = record.source_start + start - record.start
+    if planned.source is None:
+        return record._replace(index=index, start=start, end=end, source_start=source_start,
+                               source_end=record.source_end + start - record.start)
+    return record._replace(index=index, source=planned.source, start=start, end=end, source_start=source_start,
+                           source_end=end - (record.end - record.source_end))
+
+
+def _is_unchanged(planned: PlannedCell, index: int) -> bool:
+    """
+    Check whether a planned cell is the unmodified cell at the same index in the file.
+
+    Args:
+        planned (PlannedCell): The planned cell.
+        index (int): The index of the planned cell.
+
+    Returns:
+        bool: True if the cell can be left untouched in the file.
+    """
+    return planned.cell is None and planned.source is None and planned.record.index == index
+
+
+def splice_cells(nb_path: str,
+                 layout: NotebookLayout,
+                 cells: list[PlannedCell]) -> NotebookLayout:
+    """
+    Write the planned cells into a notebook file without re-serializing the whole notebook. The leading cells which
+    did not change are left untouched on disk; the file is rewritten from the first changed cell only, copying the
+    bytes of the unchanged cells which follow it. Appending a cell therefore only rewrites the end of the file.
+
+    Args:
+        nb_path (str): The path to the Jupyter notebook file, as described by the layout.
+        layout (NotebookLayout): The layout of the file, from notebook_reader.read_notebook_layout.
+        cells (list): The planned cells, in the new order of the notebook.
+
+    Returns:
+        NotebookLayout: The layout of the written file, without reading it again.
+    """
+    records = layout.records
+    first = 0
+    while first < min(len(cells), len(records)) and _is_unchanged(cells[first], first):
+        first += 1
+    if first == len(cells) == len(records):
+        return layout
+
+    offset = records[first-1].end if first > 0 else layout.cells_open + 1
+    with open(nb_path, 'r+b') as f:
+        f.seek(offset)
+        rest = f.read()
+        pieces = [_render(rest, offset, planned) for planned in cells[first:]]
+        if pieces:
+            opening = (_SEPARATOR if first > 0 else "\n" + " " * _CELL_DEPTH).encode('utf-8')
+            region = opening + _SEPARATOR.encode('utf-8').join(pieces) + b"\n "
+        elif first > 0:
+            region = b"\n "
+        else:
+            region = b""
+        f.seek(offset)
+        f.write(region + rest[layout.cells_close-offset:])
+        f.truncate()
+
+    placed = list(records[:first])
+    start = offset + len(opening) if pieces else offset
+    for planned, piece in zip(cells[first:], pieces):
+        placed.append(_placed_record(planned, piece, start, len(placed)))
+        start += len(piece) + len(_SEPARATOR)
+    return layout._replace(records=placed, cells_close=offset + len(region))
@@ -1,9 +1,29 @@
+import os
 import streamlit as st
-from langchain_community.llms import HuggingFaceHub
 
 # Local modules
 from jupycoder import JupyCoder
 import jupy_app
+import llm_executor
+import local_llm
+import notebook_summary
+import resilient_llm
+import semantic_cache
+
+
+def warn_failed_requests(before: int) -> None:
+    """
+    Warn that requests of the last action failed or ran out of time, the cells concerned being left unchanged.
+
+    Args:
+        before (int): The number of failed requests before the action (llm_executor.failed_requests).
+
+    Returns:
+        None
+    """
+    failed = llm_executor.failed_requests() - before
+    if failed > 0:
+        st.warning(f"{failed} requête(s) au LLM ont échoué ou dépassé le délai : les cellules concernées n'ont pas été modifiées.")
 
 
 def main():
@@ -17,18 +37,48 @@ def main():
         st.session_state.token = ""
     st.sidebar.text_input("Insérer un token Hugging Face 🤗 :", key="token_input", on_change=jupy_app.submit_token, type = 'password')
     st.sidebar.button("Valider", on_click=jupy_app.submit_token)
+    local_model = st.sidebar.text_input("Ou chemin d'un modèle local GGUF :", value=os.environ.get(local_llm.MODEL_PATH_VARIABLE, ""),
+                                        help="Exécute le LLM sur le CPU avec llama.cpp, sans token ni connexion (pip install llama-cpp-python). Avec un token, il remplace le LLM distant quand celui-ci est indisponible.")
+
+    use_cache = not st.sidebar.checkbox("Ignorer le cache des réponses", help="Force de nouvelles inférences, même pour une requête déjà traitée.")
+    single_call = st.sidebar.checkbox("Requête unique", help="Choisit l'action et génère la cellule en une seule requête au LLM.")
+    streaming = st.sidebar.checkbox("Affichage en direct", help="Affiche la réponse du LLM au fil de sa génération.")
+    speculative = st.sidebar.checkbox("Génération anticipée", help="Génère le code pendant le choix de l'action, au prix de requêtes parfois inutiles.")
+    semantic_caching = st.sidebar.checkbox("Réutiliser les cellules des requêtes similaires", help="Réutilise la cellule générée pour une requête quasi identique, sans appeler le LLM. Une annulation retire la cellule du cache.")
+    hedging = st.sidebar.checkbox("Requêtes dupliquées", help="Renvoie une requête au LLM distant quand il répond plus lentement que d'habitude, la première réponse étant gardée.")
 
-    if len(st.session_state.token) > 2:
-        st.sidebar.write("✅ Token activé") 
+    remote = len(st.session_state.token) > 2
+    connected = remote or bool(local_model)
+    if connected:
+        if local_model:
+            try:
+                llm = jupy_app.load_local_llm(local_model)
+            except (ImportError, FileNotFoundError, ValueError) as error:
+                st.sidebar.error(f"Modèle local indisponible : {error}")
+                st.stop()
+            st.sidebar.write("✅ Modèle local activé" + (" (en secours)" if remote else ""))
+        if remote:
+            st.sidebar.write("✅ Token activé") 
         if 'path' in st.session_state:
-            llm =  HuggingFaceHub(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1", 
-                                    huggingfacehub_api_token=st.session_state.token,
-                                    model_kwargs={"temperature": 0.1, "max_new_tokens": 500})
+            if remote:
+                llm = jupy_app.load_llm(st.session_state.token, streaming=streaming, hedging=hedging, fallback_model=local_model)
             JupyAgent = JupyCoder(st.session_state.path, 
-                                    llm)
+                                    llm,
+                                    single_call=single_call,
+                                    speculative=speculative,
+                                    semantic_caching=semantic_caching)
+            stats = notebook_summary.SUMMARY_CACHE.last_stats.get(os.path.abspath(st.session_state.path))
+            if stats is not None:
+                st.sidebar.caption(f"Dernier résumé : {stats.reused_chunks}/{stats.chunks} parties réutilisées "
+                                   f"({stats.reuse_ratio:.0%} des cellules), {stats.evicted} supprimée(s) du cache.")
+            if remote and llm.breaker.state != "closed":
+                st.sidebar.warning(f"LLM distant indisponible, nouvel essai dans {llm.breaker.retry_in():.0f} s.")
+            precision = semantic_cache.SEMANTIC_CACHE.precision()
+            if precision is not None:
+                st.sidebar.caption(f"Cellules réutilisées pour des requêtes similaires : {precision:.0%} conservées.")
         
-    if (len(st.session_state.token) < 2) or ('path' not in st.session_state):
-        st.header("👈 Merci de vous connecter à un notebook en cliquant sur l'onglet 'Connexion avec notebook' et de faire valider votre Token HuggingFace avant de procéder.")
+    if not connected or ('path' not in st.session_state):
+        st.header("👈 Merci de vous connecter à un notebook en cliquant sur l'onglet 'Connexion avec notebook' et de faire valider votre Token HuggingFace (ou d'indiquer un modèle local) avant de procéder.")
     else:
         st.title("JupyCoder: Your LowCost GenAI MultiModal Jupyter Coding Assistant")
         st.markdown("---")
@@ -38,7 +88,14 @@ def main():
             st.subheader("Enregistrement voix")
             if st.button("🎙️ Enregistrer"):
                 text = jupy_app.transcribe_speech()
-                JupyAgent(text)
+                live = st.empty()
+                failed = llm_executor.failed_requests()
+                try:
+                    JupyAgent(text, use_cache=use_cache, on_token=live.text if streaming else None)
+                except resilient_llm.LLMUnavailableError as error:
+                    st.error(str(error))
+                warn_failed_requests(failed)
+                live.empty()
                 jupy_app.save_to_history(text)
 
         with col2:
@@ -59,9 +116,16 @@ def main():
                     jupy_app.save_to_history(st.session_state.my_text)
             
             if len(text_input) > 3 and button_clicked:
-                JupyAgent(text_input)
+                live = st.empty()
+                failed = llm_executor.failed_requests()
+                try:
+                    JupyAgent(text_input, use_cache=use_cache, on_token=live.text if streaming else None)
+                except resilient_llm.LLMUnavailableError as error:
+                    st.error(str(error))
+                warn_failed_requests(failed)
+                live.empty()
     
-    if (len(st.session_state.token) > 2) and ('path' in st.session_state):
+    if connected and ('path' in st.session_state):
         jupy_app.display_history(agent=JupyAgent)
 
 
@@ -0,0 +1,228 @@
+import ast
+import functools
+import io
+import re
+import tokenize
+from typing import Optional
+
+# Local Module
+from metrics import METRICS
+import token_budget
+
+# The string literals longer than this and the literal containers with more items are elided (non-strict mode).
+MAX_LITERAL_CHARS = 200
+MAX_LITERAL_ITEMS = 12
+# What remains of an elided literal: the first characters of a string, the first items of a container.
+KEPT_LITERAL_CHARS = 40
+KEPT_LITERAL_ITEMS = 3
+MAX_COMPACTED_CELLS = 4096
+
+# The notebook magics and shell commands are valid in a cell but not in Python.
+_MAGIC = re.compile(r"^[ \t]*[%!]")
+_MASK = re.compile(r"^([ \t]*)__jupycoder_magic_(\d+)__$", re.MULTILINE)
+# A top-level import, on a single line.
+_IMPORT = re.compile(r"^(?:import[ \t]+[\w., \t]+|from[ \t]+[\w.]+[ \t]+import[ \t]+[\w., \t*]+)$")
+_CONTAINERS = (ast.List, ast.Tuple, ast.Set, ast.Dict)
+
+
+def _char_column(line: str,
+                 byte_column: int) -> int:
+    """
+    Convert a column of the ast module (an offset in the UTF-8 bytes of the line) into an offset in characters.
+
+    Args:
+        line (str): The line.
+        byte_column (int): The offset in bytes.
+
+    Returns:
+        int: The offset in characters.
+    """
+    return len(line.encode('utf-8')[:byte_column].decode('utf-8', errors='ignore'))
+
+
+def _is_literal(node: ast.AST) -> bool:
+    """
+    Check that a node is made of constants only (e.g. a list of numbers or a dict of strings).
+
+    Args:
+        node (ast.AST): The node.
+
+    Returns:
+        bool: Whether the node is a literal.
+    """
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, ast.UnaryOp) and isinstance(node.operand, ast.Constant):
+        return True
+    if isinstance(node, ast.Dict):
+        return all(key is not None and _is_literal(key) for key in node.keys) and all(map(_is_literal, node.values))
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return all(map(_is_literal, node.elts))
+    return False
+
+
+def _docstring(node: ast.AST) -> Optional[ast.Expr]:
+    """
+    Find the docstring of a module, a function or a class.
+
+    Args:
+        node (ast.AST): The node.
+
+    Returns:
+        Optional[ast.Expr]: The statement of the docstring, if any.
+    """
+    if not isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) or not node.body:
+        return None
+    first = node.body[0]
+    if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+        return first
+    return None
+
+
+def _edits(tree: ast.Module,
+           lines: list[str],
+           strict: bool) -> list[tuple[int, int, int, int, str]]:
+    """
+    Find the docstrings and the large literals to replace (non-strict mode).
+
+    Args:
+        tree (ast.Module): The syntax tree of the cell.
+        lines (list): The lines of the cell.
+        strict (bool): Whether the code must stay equivalent, in which case nothing is replaced.
+
+    Returns:
+        list: The replacements (start line, start column, end line, end column, text), lines from 1 and columns
+            in characters.
+    """
+    if strict:
+        return []
+    edits = []
+
+    def replace(node: ast.AST, text: str) -> None:
+        edits.append((node.lineno, _char_column(lines[node.lineno - 1], node.col_offset),
+                      node.end_lineno, _char_column(lines[node.end_lineno - 1], node.end_col_offset), text))
+
+    def source(node: ast.AST) -> str:
+        return ast.get_source_segment("\n".join(lines), node) or "..."
+
+    def visit(node: ast.AST) -> None:
+        docstring = _docstring(node)
+        if docstring is not None:
+            # A body cannot be empty: a docstring alone is replaced by an ellipsis.
+            replace(docstring, "..." if len(node.body) == 1 else "")
+        for child in ast.iter_child_nodes(node):
+            if child is docstring:
+                continue
+            if isinstance(child, ast.Constant) and isinstance(child.value, str) and len(child.value) > MAX_LITERAL_CHARS:
+                replace(child, repr(child.value[:KEPT_LITERAL_CHARS] + "..."))
+            elif isinstance(child, _CONTAINERS) and _is_literal(child):
+                items = child.keys if isinstance(child, ast.Dict) else child.elts
+                if len(items) > MAX_LITERAL_ITEMS:
+                    if isinstance(child, ast.Dict):
+                        kept = [f"{source(key)}: {source(value)}"
+                                for key, value in zip(child.keys[:KEPT_LITERAL_ITEMS], child.values)]
+                        replace(child, "{" + ", ".join(kept + ["...: ..."]) + "}")
+                    else:
+                        kept = [source(item) for item in child.elts[:KEPT_LITERAL_ITEMS]]
+                        opening, closing = {ast.List: "[]", ast.Tuple: "()", ast.Set: "{}"}[type(child)]
+                        replace(child, opening + ", ".join(kept + ["..."]) + closing)
+            else:
+                visit(child)
+
+    visit(tree)
+    return edits
+
+
+def _strip(code: str) -> str:
+    """
+    Remove the comments, the blank lines and the trailing whitespace of valid code, without changing the strings.
+
+    Args:
+        code (str): The code, whose magics were replaced by valid statements.
+
+    Returns:
+        str: The stripped code.
+    """
+    lines = code.split("\n")
+    protected = set()
+    comments = {}
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type == tokenize.COMMENT:
+            comments[token.start[0]] = token.start[1]
+        elif token.type == tokenize.STRING and token.end[0] > token.start[0]:
+            # The lines inside a multi-line string are part of its value.
+            protected.update(range(token.start[0] + 1, token.end[0]))
+    kept = []
+    for number, line in enumerate(lines, 1):
+        if number in comments:
+            line = line[:comments[number]]
+        if number not in protected:
+            line = line.rstrip()
+            if not line:
+                continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+@functools.lru_cache(maxsize=MAX_COMPACTED_CELLS)
+def compact_code(source: str,
+                 strict: bool = False) -> str:
+    """
+    Rewrite the source of a code cell for a prompt: remove the comments, the blank lines and the trailing whitespace
+    and, unless strict, the docstrings and the middle of the large literals (long strings, lists or dicts of
+    constants). The strict mode keeps the code equivalent. A cell which is not valid Python is only stripped of its
+    comment lines and blank lines.
+
+    Args:
+        source (str): The source of the cell.
+        strict (bool): Whether only the rewrites which keep the code equivalent are allowed.
+
+    Returns:
+        str: The compacted source.
+    """
+    lines = source.split("\n")
+    # The magics are masked by names, valid Python which the compaction keeps, then restored.
+    masked = [line[:len(line) - len(line.lstrip())] + f"__jupycoder_magic_{number}__" if _MAGIC.match(line) else line
+              for number, line in enumerate(lines)]
+    try:
+        tree = ast.parse("\n".join(masked))
+        for start_line, start_column, end_line, end_column, text in sorted(_edits(tree, masked, strict), reverse=True):
+            masked[start_line - 1:end_line] = [masked[start_line - 1][:start_column] + text + masked[end_line - 1][end_column:]]
+        compacted = _strip("\n".join(masked))
+        ast.parse(compacted)
+    except (SyntaxError, ValueError, tokenize.TokenError):
+        METRICS.increment("compaction.unparsed")
+        return "\n".join(line.rstrip() for line in lines if line.strip() and not line.lstrip().startswith("#"))
+    return _MASK.sub(lambda match: match.group(1) + lines[int(match.group(2))].strip(), compacted)
+
+
+def compact_cells(sources: list[str],
+                  strict: bool = False) -> list[str]:
+    """
+    Compact the cells sent together in a prompt (see compact_code), then remove the imports already made by
+    a previous cell and the cells left empty. The ranks of a RankedList are kept.
+
+    Args:
+        sources (list): The sources of the cells, in notebook order.
+        strict (bool): Whether only the rewrites which keep the code equivalent are allowed.
+
+    Returns:
+        list: The compacted sources.
+    """
+    seen = set()
+    compacted = []
+    ranks = []
+    for source, rank in zip(sources, getattr(sources, "ranks", range(len(sources)))):
+        kept = []
+        for line in compact_code(source, strict).split("\n"):
+            if not line:
+                continue
+            if _IMPORT.match(line):
+                if line in seen:
+                    continue
+                seen.add(line)
+            kept.append(line)
+        if kept:
+            compacted.append("\n".join(kept))
+            ranks.append(rank)
+    return token_budget.RankedList(compacted, ranks) if isinstance(sources, token_budget.RankedList) else compacted
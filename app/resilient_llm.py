@@ -0,0 +1,422 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Iterator, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_core.pydantic_v1 import Field, PrivateAttr
+
+# Local Module
+from metrics import METRICS
+
+# The maximum duration of a call, retries included, and of each of its attempts, in seconds.
+DEFAULT_DEADLINE = 60.0
+ATTEMPT_TIMEOUT = 30.0
+# The retries of a failed attempt wait a random time between 0 and BACKOFF_BASE * 2 ** retry (at most BACKOFF_CAP).
+DEFAULT_RETRIES = 2
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+# A duplicate request is sent when the first one runs longer than this quantile of the latencies of the backend for
+# the same generation profile (max_new_tokens), once enough latencies are known.
+HEDGE_QUANTILE = 0.95
+MIN_HEDGE_SAMPLES = 20
+# The circuit opens after this number of consecutive failed calls and lets a trial call through after RECOVERY_TIME.
+FAILURE_THRESHOLD = 3
+RECOVERY_TIME = 30.0
+# The HTTP statuses of the transient errors: timeout, rate limit, server errors and model loading.
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+def _transport_errors() -> tuple:
+    """
+    The exception classes of the timeouts and connection errors, of Python and of the HTTP clients of the LLMs
+    (requests for HuggingFaceHub, httpx for some LangChain clients) when they are installed.
+
+    Returns:
+        tuple: The exception classes.
+    """
+    errors = [TimeoutError, ConnectionError]
+    try:
+        import requests
+        errors += [requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                   requests.exceptions.ChunkedEncodingError]
+    except ImportError:
+        pass
+    try:
+        import httpx
+        errors.append(httpx.TransportError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+# The errors of the transport of a request, which can succeed when it is sent again.
+TRANSIENT_ERRORS = _transport_errors()
+
+# The calls of a JupyCoder action which run at the same time: the speculative generation and the concurrent summaries.
+MAX_CONCURRENT_CALLS = 4
+# Whether the last call of each thread was served by the secondary backend.
+_last_call = threading.local()
+
+
+class LLMUnavailableError(RuntimeError):
+    """
+    The LLM did not answer within the deadline of the call, or its circuit is open and there is no secondary backend.
+    """
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed attempt can succeed when sent again: the timeouts, the connection errors and the transient HTTP
+    errors (RETRYABLE_STATUS), but not the errors of the request itself (e.g. a prompt too long, an invalid token)
+    nor the errors of the code (e.g. a ValueError while reading the answer).
+
+    Args:
+        error (Exception): The error of the attempt.
+
+    Returns:
+        bool: Whether the attempt can be retried.
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class CircuitBreaker():
+    """
+    A circuit breaker on the calls to a backend: after FAILURE_THRESHOLD consecutive failed calls the circuit opens
+    and the calls fail at once (or go to the secondary backend) instead of waiting for their deadline. After
+    RECOVERY_TIME, a single trial call is let through: its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self,
+                 failure_threshold: int = FAILURE_THRESHOLD,
+                 recovery_time: float = RECOVERY_TIME) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        The state of the circuit: "closed", "open" or "half_open" (a trial call is allowed or running).
+
+        Returns:
+            str: The state.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.recovery_time else "open"
+
+    def allow(self) -> bool:
+        """
+        Whether a call can be sent to the backend; in the half-open state, only the first call is allowed.
+
+        Returns:
+            bool: Whether the call is allowed.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.recovery_time or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def retry_in(self) -> float:
+        """
+        The time before the next trial call, in seconds.
+
+        Returns:
+            float: The remaining time, 0 if the circuit is closed.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.recovery_time - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        """
+        Close the circuit after a successful call.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._opened_at is not None:
+                METRICS.increment("llm.circuit.closed")
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_ignored(self) -> None:
+        """
+        End a call which failed for its own reasons (e.g. an invalid request), without counting it: a trial call
+        lets the next call through.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """
+        Count a failed call, and open the circuit at the threshold or after a failed trial call.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self._opened_at is None and self.failures >= self.failure_threshold):
+                METRICS.increment("llm.circuit.opened")
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class ResilientLLM(LLM):
+    """
+    A resilience layer around the client of an LLM, used by the chains like the client itself. Each call has
+    a deadline; a failed attempt is retried after a jittered exponential backoff; a duplicate request can be sent
+    when the first one is slower than the p95 of the backend for its generation profile (hedging), the first answer
+    being kept; a circuit breaker fails fast, or switches to the secondary backend, while the backend is down.
+    A streamed call is only retried until its first token. The deadline of a call can be given with the generation
+    parameters (deadline=...).
+    """
+    primary: Any
+    secondary: Optional[Any] = None
+    deadline: float = DEFAULT_DEADLINE
+    attempt_timeout: float = ATTEMPT_TIMEOUT
+    retries: int = DEFAULT_RETRIES
+    hedging: bool = False
+    # A fixed delay before the duplicate request; by default the p95 of the latencies of the profile.
+    hedge_delay: Optional[float] = None
+    breaker: Any = Field(default_factory=CircuitBreaker)
+    # The attempts run in these threads, so that a call can give up on an attempt which exceeds its deadline.
+    # An abandoned attempt cannot be interrupted: it holds its thread until the timeout of its HTTP client. Each call
+    # can leave retries + 1 attempts and their duplicate requests running, hence the size of the pool.
+    _attempts: Any = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._attempts = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS * 2 * (self.retries + 1),
+                                            thread_name_prefix="jupycoder-llm")
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient"
+
+    @property
+    def _identifying_params(self) -> dict:
+        # The cache keys of the primary model are kept: the answers of the secondary backend are not cached
+        # (served_by_secondary).
+        try:
+            return dict(self.primary._identifying_params)
+        except Exception:
+            return {}
+
+    def served_by_secondary(self) -> bool:
+        """
+        Whether the last call of the current thread was served by the secondary backend, whose answers must not be
+        stored under the cache keys of the primary model.
+
+        Returns:
+            bool: Whether the secondary backend answered.
+        """
+        return getattr(_last_call, "secondary", False)
+
+    @staticmethod
+    def _latency_series(kwargs: dict) -> str:
+        """
+        The name of the latency measure of the requests with the generation profile of a call: a short routing
+        answer and a code generation of 500 tokens do not have the same latency.
+
+        Args:
+            kwargs (dict): The generation parameters of the call.
+
+        Returns:
+            str: The name of the measure.
+        """
+        return f"llm.latency.{kwargs.get('max_new_tokens', 'default')}"
+
+    def _hedge_delay(self,
+                     kwargs: dict) -> Optional[float]:
+        """
+        The delay before a duplicate request: the fixed delay, or the HEDGE_QUANTILE of the recent latencies of the
+        requests with the same generation profile.
+
+        Args:
+            kwargs (dict): The generation parameters of the call.
+
+        Returns:
+            Optional[float]: The delay in seconds, or None without hedging or without enough latencies.
+        """
+        if not self.hedging:
+            return None
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        latencies = sorted(METRICS.samples(self._latency_series(kwargs)))
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * HEDGE_QUANTILE))]
+
+    def _attempt(self,
+                 prompt: str,
+                 stop: Optional[list[str]],
+                 timeout: float,
+                 kwargs: dict) -> str:
+        """
+        Send a request to the primary backend, and a duplicate one if it is slower than the hedge delay.
+
+        Args:
+            prompt (str): The prompt.
+            stop (Optional[list]): The stop sequences.
+            timeout (float): The maximum duration of the attempt, in seconds.
+            kwargs (dict): The generation parameters.
+
+        Returns:
+            str: The text of the first successful request.
+        """
+        start = time.monotonic()
+        original = self._attempts.submit(self.primary.invoke, prompt, stop=stop, **kwargs)
+        futures = [original]
+        delay = self._hedge_delay(kwargs)
+        error = None
+        while futures:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            hedge = delay is not None
+            done, _ = wait(futures, timeout=min(delay, remaining) if hedge else remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None:
+                    METRICS.observe(self._latency_series(kwargs), time.monotonic() - start)
+                    if future is not original:
+                        METRICS.increment("llm.hedge_won")
+                    return future.result()
+                error = future.exception()
+            if hedge and futures and not done:
+                METRICS.increment("llm.hedged")
+                futures.append(self._attempts.submit(self.primary.invoke, prompt, stop=stop, **kwargs))
+            delay = None
+        if error is not None and not futures:
+            raise error
+        METRICS.increment("llm.timeout")
+        raise TimeoutError(f"Pas de réponse du LLM en {timeout:.0f} s.")
+
+    def _fallback(self,
+                  error: Exception) -> Any:
+        """
+        The secondary backend of a call which the primary one cannot serve.
+
+        Args:
+            error (Exception): Why the primary backend cannot serve the call.
+
+        Returns:
+            Any: The secondary backend.
+        """
+        if self.secondary is None:
+            if isinstance(error, LLMUnavailableError):
+                raise error
+            raise LLMUnavailableError(f"Le LLM est indisponible : {error}") from error
+        METRICS.increment("llm.fallback")
+        _last_call.secondary = True
+        return self.secondary
+
+    def _open_circuit_error(self) -> LLMUnavailableError:
+        """
+        The error of a call refused by the open circuit.
+
+        Returns:
+            LLMUnavailableError: The error.
+        """
+        METRICS.increment("llm.circuit.rejected")
+        return LLMUnavailableError(f"Le LLM est indisponible après {self.breaker.failures} échecs consécutifs, "
+                                   f"nouvel essai dans {self.breaker.retry_in():.0f} s.")
+
+    def _call(self,
+              prompt: str,
+              stop: Optional[list[str]] = None,
+              run_manager: Any = None,
+              **kwargs: Any) -> str:
+        deadline = time.monotonic() + kwargs.pop("deadline", self.deadline)
+        _last_call.secondary = False
+        if not self.breaker.allow():
+            return self._fallback(self._open_circuit_error()).invoke(prompt, stop=stop, **kwargs)
+        for retry in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            try:
+                text = self._attempt(prompt, stop, min(self.attempt_timeout, remaining), kwargs)
+                self.breaker.record_success()
+                return text
+            except Exception as error:
+                if not is_retryable(error):
+                    self.breaker.record_ignored()
+                    raise
+                failure = error
+            METRICS.increment("llm.failed_attempt")
+            backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** retry))
+            if retry == self.retries or deadline - time.monotonic() <= backoff:
+                break
+            METRICS.increment("llm.retry")
+            time.sleep(backoff)
+        self.breaker.record_failure()
+        return self._fallback(failure).invoke(prompt, stop=stop, **kwargs)
+
+    def _stream(self,
+                prompt: str,
+                stop: Optional[list[str]] = None,
+                run_manager: Any = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        deadline = time.monotonic() + kwargs.pop("deadline", self.deadline)
+        _last_call.secondary = False
+        backend, stream, first = self.primary, None, None
+        if not self.breaker.allow():
+            backend = self._fallback(self._open_circuit_error())
+        else:
+            for retry in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                stream = self.primary.stream(prompt, stop=stop, **kwargs)
+                start = time.monotonic()
+                try:
+                    # The stream starts in a thread, for the attempt to be abandoned at its deadline.
+                    future = self._attempts.submit(next, stream, None)
+                    first = future.result(timeout=min(self.attempt_timeout, remaining))
+                    METRICS.observe("llm.first_token", time.monotonic() - start)
+                    self.breaker.record_success()
+                    break
+                except Exception as error:
+                    # The stream of an abandoned attempt cannot be closed while its thread reads it: it is closed
+                    # once its first token or its error arrives, which drops its connection.
+                    future.add_done_callback(lambda _, stream=stream: stream.close())
+                    if not is_retryable(error):
+                        self.breaker.record_ignored()
+                        raise
+                    failure, stream = error, None
+                METRICS.increment("llm.failed_attempt")
+                backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** retry))
+                if retry == self.retries or deadline - time.monotonic() <= backoff:
+                    break
+                METRICS.increment("llm.retry")
+                time.sleep(backoff)
+            if stream is None:
+                self.breaker.record_failure()
+                backend = self._fallback(failure)
+        if stream is None:
+            stream = backend.stream(prompt, stop=stop, **kwargs)
+        elif first is not None:
+            yield GenerationChunk(text=first)
+        try:
+            for chunk in stream:
+                yield GenerationChunk(text=chunk)
+        finally:
+            stream.close()
@@ -0,0 +1,183 @@
+import ast
+import re
+from typing import NamedTuple, Optional
+
+# The markers after which the code generated by the LLM is followed by explanations: the response is cut at the first
+# one which begins a line outside the strings and comments of the code, and a streamed generation is stopped there.
+CODE_CUT_OFFS = ["Explanation:", "Notes:", "Ce code", "Le code", "Ici", "This line", "This code", "Explication", "Comments:"]
+
+# The markdown escapes and invisible characters which the LLM adds to the code.
+_UNESCAPE = [("\\_", "_"), ("\\#", "#"), ("&#x200B;", ""), ("\u200b", "")]
+
+# The string literals of the code: the triple-quoted ones may span lines (up to a code fence when they are not
+# closed), the others end on their line.
+_STRING = (r'"""[\s\S]*?(?:"""|(?=```)|\Z)'
+           r"|'''[\s\S]*?(?:'''|(?=```)|\Z)"
+           r'|"(?:[^"\\\n]|\\.)*"'
+           r"|'(?:[^'\\\n]|\\.)*'")
+
+# A single scan of the response finds, in order of priority: the code fences, the separator lines and language
+# tags alone on their line, the cut-off markers at the beginning of a line, the strings and comments of the code
+# (copied whole, so that a marker inside them is not seen) and the inline backticks. The leading lookahead lets
+# the regex engine skip the positions which cannot start any of them without trying each alternative.
+_TOKEN = re.compile(r"(?=[`\"'#]|^)"
+                    r"(?:(?P<fence>```[ \t]*[\w+-]*[ \t]*\n?)"
+                    r"|(?P<line>^[ \t]*(?:[=-]{3,}|python)[ \t]*(?:\n|$))"
+                    r"|(?P<cut>^[ \t]*(?:" + "|".join(re.escape(marker) for marker in CODE_CUT_OFFS) + r"))"
+                    r"|(?P<string>" + _STRING + r")"
+                    r"|(?P<comment>#[^\n]*)"
+                    r"|(?P<tick>`+))", re.MULTILINE)
+# Any occurrence of a marker: a streamed text is only scanned again when one was generated.
+_CUT_CANDIDATE = re.compile("|".join(re.escape(marker) for marker in CODE_CUT_OFFS))
+_LONGEST_CUT_OFF = max(map(len, CODE_CUT_OFFS))
+
+# The notebook magics and shell commands are valid in a cell but not in Python.
+_MAGIC = re.compile(r"^([ \t]*)[%!].*$", re.MULTILINE)
+# A line of prose: a capitalized sentence of at least three words, without any code syntax.
+_PROSE = re.compile(r"^[A-ZÀ-ÖØ-Ý][\w'’]*(?: [^\s=(){}\[\]#]+){2,}$")
+
+MAX_REPAIRS = 5
+
+
+class ExtractedCode(NamedTuple):
+    """
+    The code extracted from a response of the LLM, whether it is valid Python (magics allowed) and whether
+    lines of prose had to be removed to make it valid.
+    """
+    code: str
+    valid: bool
+    repaired: bool = False
+
+
+def _syntax_error(code: str) -> Optional[SyntaxError]:
+    """
+    Check that code is valid Python, the notebook magics and shell commands being allowed.
+
+    Args:
+        code (str): The code of the cell.
+
+    Returns:
+        Optional[SyntaxError]: The syntax error, or None if the code is valid.
+    """
+    try:
+        # Compiling checks the same syntax as ast.parse (plus the misplaced return, break, ...) without building 
+        # the Python objects of the tree, which is faster on large cells. Top-level await is valid in a notebook.
+        compile(_MAGIC.sub(r"\1pass", code), "<cell>", "exec", flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT, dont_inherit=True)
+    except SyntaxError as error:
+        return error
+    except ValueError as error:
+        return SyntaxError(str(error))
+    return None
+
+
+def is_valid_code(code: str) -> bool:
+    """
+    Check that the code of a cell is valid Python, the notebook magics and shell commands being allowed.
+
+    Args:
+        code (str): The code of the cell.
+
+    Returns:
+        bool: Whether the code is valid.
+    """
+    return _syntax_error(code) is None
+
+
+def _scan(text: str) -> tuple[str, Optional[int]]:
+    """
+    Pull the code out of a response in a single pass: the content of the fenced blocks if there are any,
+    otherwise the text up to the first cut-off marker, without the separators and backticks. 
+    The markdown escapes are then replaced in the extracted code only.
+
+    Args:
+        text (str): The generated text.
+
+    Returns:
+        tuple: The code, and the position of the cut-off marker where it ends, if any.
+    """
+    fenced, unfenced = [], []
+    in_fence = seen_fence = False
+    position = 0
+    cut = None
+    for match in _TOKEN.finditer(text):
+        if match.start() < position:
+            continue
+        pieces = fenced if in_fence else unfenced
+        pieces.append(text[position:match.start()])
+        position = match.end()
+        kind = match.lastgroup
+        if kind == "fence":
+            if not in_fence and fenced:
+                fenced.append("\n")
+            in_fence = not in_fence
+            seen_fence = True
+        elif kind == "cut":
+            if in_fence:
+                # A comment of the code, not an explanation.
+                fenced.append(match.group())
+            elif seen_fence or "".join(unfenced).strip():
+                position, cut = None, match.start()
+                break
+            else:
+                # A sentence introducing the code: drop its line and keep looking for the code.
+                unfenced.clear()
+                end = text.find("\n", position)
+                position = len(text) if end < 0 else end + 1
+        elif kind in ("string", "comment") or (kind == "tick" and in_fence):
+            pieces.append(match.group())
+    if position is not None:
+        (fenced if in_fence else unfenced).append(text[position:])
+    code = "".join(fenced if seen_fence else unfenced)
+    for escape, character in _UNESCAPE:
+        if escape in code:
+            code = code.replace(escape, character)
+    return code.strip(), cut
+
+
+def find_cut_off(text: str,
+                 start: int = 0) -> Optional[int]:
+    """
+    Find where the explanations which follow the generated code begin: the first cut-off marker at the beginning of
+    a line, outside the code fences, strings and comments, once some code was generated. The text is only scanned
+    when a marker appears after the start position, so that a streamed text can be checked after each token.
+
+    Args:
+        text (str): The generated text.
+        start (int): The length of the text already checked, e.g. at the previous token.
+
+    Returns:
+        Optional[int]: The position of the marker, or None if the text holds no explanation yet.
+    """
+    if not _CUT_CANDIDATE.search(text, max(0, start - _LONGEST_CUT_OFF)):
+        return None
+    return _scan(text)[1]
+
+
+def extract_code(text: str) -> ExtractedCode:
+    """
+    Extract the code of a cell from a response of the LLM and validate it by compiling it. If it is not valid Python,
+    the lines of prose which surround the code are removed, using the position of the syntax error.
+
+    Args:
+        text (str): The generated text, after the last marker of the prompt (e.g. "Le code python est:").
+
+    Returns:
+        ExtractedCode: The code and the result of its validation.
+    """
+    code = _scan(text)[0]
+    lines = code.split("\n")
+    repaired = False
+    for _ in range(MAX_REPAIRS + 1):
+        candidate = "\n".join(lines).strip()
+        error = _syntax_error(candidate)
+        if error is None:
+            return ExtractedCode(candidate, True, repaired)
+        line = min(max(error.lineno or len(lines), 1), len(lines))
+        if len(lines) > 1 and line == 1 and _PROSE.match(lines[0].strip()):
+            lines = lines[1:]
+        elif line > 1 and _PROSE.match(lines[line-1].strip()):
+            lines = lines[:line-1]
+        else:
+            break
+        repaired = True
+    return ExtractedCode(code, False)
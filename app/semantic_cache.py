@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+
+# Local Module
+from fast_router import ngrams, normalize
+from llm_cache import model_signature
+from metrics import METRICS
+
+# The cosine similarity from which two queries are considered as the same request. The n-grams of two opposite
+# requests are close (e.g. "trie par ordre croissant" and "décroissant" score 0.95): the words which change
+# the meaning are also compared (see _SIGNIFICANT).
+SIMILARITY_THRESHOLD = 0.9
+MAX_SEMANTIC_ENTRIES = 512
+# The size of the hashed n-gram vectors.
+VECTOR_SIZE = 4096
+# The actions whose generated content can be reused for a near-duplicate query.
+CACHED_ACTIONS = ("create_code_cell", "create_markdown")
+
+# The words which change the meaning of a query while barely changing its n-grams: the numbers, the names with
+# a dot or an underscore (files, columns, variables), the negations, the directions and orderings, the aggregates
+# and the libraries. They must be identical for a hit. The queries are normalized (lower case, no accents).
+_MEANINGFUL_WORDS = [
+    # Negations
+    r"pas", r"sans", r"ne", r"n", r"not", r"no", r"without", r"aucune?",
+    # Directions and orderings
+    r"(?:de)?croissante?s?", r"ascendante?s?", r"descendante?s?", r"asc", r"desc", r"ascending", r"descending",
+    r"premi(?:er|ere)s?", r"derni(?:er|ere)s?", r"debut", r"fin", r"first", r"last", r"head", r"tail", r"top",
+    r"bottom", r"haut", r"bas", r"gauche", r"droite", r"left", r"right", r"inner", r"outer", r"plus", r"moins",
+    r"avant", r"apres", r"inferieure?s?", r"superieure?s?", r"lignes?", r"colonnes?", r"rows?", r"columns?",
+    # Aggregates
+    r"min", r"minimum", r"minimale?s?", r"max", r"maximum", r"maximale?s?", r"moyennes?", r"medianes?", r"mean",
+    r"median", r"modes?", r"sommes?", r"sum", r"totale?s?", r"count", r"nombre", r"compte", r"ecart", r"ecart-type",
+    r"std", r"variances?", r"quantiles?", r"percentiles?", r"quartiles?", r"correlations?",
+    # Libraries
+    r"pandas", r"numpy", r"polars", r"matplotlib", r"seaborn", r"plotly", r"bokeh", r"altair", r"sklearn",
+    r"scikit-learn", r"scipy", r"statsmodels", r"tensorflow", r"keras", r"torch", r"pytorch", r"xgboost",
+    r"lightgbm", r"catboost", r"spark", r"pyspark", r"dask", r"duckdb", r"sqlalchemy",
+]
+_SIGNIFICANT = re.compile(r"\d+(?:[.,]\d+)?|\w+(?:[._]\w+)+|\b(?:" + "|".join(_MEANINGFUL_WORDS) + r")\b")
+
+
+class SemanticHit(NamedTuple):
+    """
+    A cached content reused for a query.
+    """
+    action: str
+    content: str
+    similarity: float
+    query: str
+
+
+def context_key(llm: Any,
+                codes: list[str]) -> str:
+    """
+    Hash the context of a generation: the model and the code cells of the notebook, since the same query must not
+    reuse a content generated for another notebook or another state of it.
+
+    Args:
+        llm (Any): The large language model object.
+        codes (list): The code cells of the notebook.
+
+    Returns:
+        str: The key of the context.
+    """
+    payload = json.dumps({"model": model_signature(llm), "codes": codes}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def generation_contexts(llm: Any,
+                        codes: list[str],
+                        action: str,
+                        content: str) -> frozenset:
+    """
+    The contexts in which a generated cell can be served again: the state of the notebook it was generated in, and
+    the state once it is added. The repeated query (e.g. the second transcription of a voice command) comes after
+    the cell of the first one, which the generation did not depend on. A markdown cell does not change the code cells.
+
+    Args:
+        llm (Any): The large language model object.
+        codes (list): The code cells of the notebook before the cell is added.
+        action (str): The action of the query, one of CACHED_ACTIONS.
+        content (str): The generated content of the cell.
+
+    Returns:
+        frozenset: The keys of the contexts (context_key).
+    """
+    contexts = {context_key(llm, codes)}
+    if action == "create_code_cell":
+        contexts.add(context_key(llm, codes + [content]))
+    return frozenset(contexts)
+
+
+def vectorize(query: str) -> np.ndarray:
+    """
+    Embed a query as the L2-normalized counts of its character n-grams, hashed into VECTOR_SIZE dimensions.
+
+    Args:
+        query (str): The query.
+
+    Returns:
+        np.ndarray: The vector.
+    """
+    vector = np.zeros(VECTOR_SIZE, dtype=np.float32)
+    for gram, count in ngrams(normalize(query)).items():
+        vector[zlib.crc32(gram.encode('utf-8')) % VECTOR_SIZE] += count
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache():
+    """
+    An in-memory cache of the cells generated for the queries, served for the near-duplicate queries (e.g. two
+    transcriptions of the same voice command) in the same context. The nearest cached query is found with a single
+    matrix product over the vectors of the queries; the least recently used entry is evicted when the cache is full.
+    An undo of the notebook right after a hit rejects the entry, which measures the precision of the cache.
+    """
+
+    def __init__(self,
+                 threshold: float = SIMILARITY_THRESHOLD,
+                 max_entries: int = MAX_SEMANTIC_ENTRIES) -> None:
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._vectors = np.zeros((max_entries, VECTOR_SIZE), dtype=np.float32)
+        # Row -> (context keys, action, query, significant words, content); None for a free row.
+        self._entries = [None] * max_entries
+        self._accessed = np.zeros(max_entries)
+        # Absolute path of the notebook -> (row, entry, whether it was a hit) of the entry served or stored for its
+        # last query, if any.
+        self._last_entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _significant(query: str) -> frozenset:
+        """
+        Extract the words of a query which must be identical for a hit.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            frozenset: The words.
+        """
+        return frozenset(_SIGNIFICANT.findall(normalize(query)))
+
+    def get(self,
+            query: str,
+            context: str,
+            nb_path: Optional[str] = None,
+            actions: tuple[str, ...] = CACHED_ACTIONS) -> Optional[SemanticHit]:
+        """
+        Find the content generated for the most similar cached query of the same context.
+
+        Args:
+            query (str): The query.
+            context (str): The key of the context (context_key).
+            nb_path (Optional[str]): The path to the notebook, to reject the hit if the notebook is then undone.
+            actions (tuple): The actions whose contents can be served, e.g. the action of the fast router.
+
+        Returns:
+            Optional[SemanticHit]: The cached content, or None below the similarity threshold.
+        """
+        vector = vectorize(query)
+        significant = self._significant(query)
+        with self._lock:
+            similarities = self._vectors @ vector
+            for row in np.argsort(-similarities):
+                if similarities[row] < self.threshold:
+                    break
+                entry = self._entries[row]
+                if entry is not None and context in entry[0] and entry[1] in actions and entry[3] == significant:
+                    self._accessed[row] = time.time()
+                    if nb_path is not None:
+                        self._last_entries[os.path.abspath(nb_path)] = (row, entry, True)
+                    METRICS.increment("semantic_cache.hit")
+                    METRICS.observe("semantic_cache.similarity", float(similarities[row]))
+                    return SemanticHit(entry[1], entry[4], float(similarities[row]), entry[2])
+        METRICS.increment("semantic_cache.miss")
+        return None
+
+    def put(self,
+            query: str,
+            contexts: frozenset,
+            action: str,
+            content: str,
+            nb_path: Optional[str] = None) -> None:
+        """
+        Store the content generated for a query, in place of the least recently used entry if the cache is full.
+
+        Args:
+            query (str): The query.
+            contexts (frozenset): The keys of the contexts in which the content can be served (generation_contexts).
+            action (str): The action of the query, one of CACHED_ACTIONS.
+            content (str): The generated content of the cell.
+            nb_path (Optional[str]): The path to the notebook, to remove the entry if the notebook is then undone.
+
+        Returns:
+            None
+        """
+        vector = vectorize(query)
+        with self._lock:
+            row = int(np.argmin(self._accessed))
+            if self._entries[row] is not None:
+                METRICS.increment("semantic_cache.evicted")
+            entry = (contexts, action, query, self._significant(query), content)
+            self._vectors[row] = vector
+            self._entries[row] = entry
+            self._accessed[row] = time.time()
+            if nb_path is not None:
+                self._last_entries[os.path.abspath(nb_path)] = (row, entry, False)
+
+    def forget_last(self,
+                    nb_path: str) -> None:
+        """
+        Forget the entry served or stored for the last query of a notebook, when a new query starts.
+
+        Args:
+            nb_path (str): The path to the notebook.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._last_entries.pop(os.path.abspath(nb_path), None)
+
+    def reject_last(self,
+                    nb_path: str) -> bool:
+        """
+        Reject the entry served or stored for the last query of a notebook, e.g. because the user undid the cell it
+        created: the entry is removed, so that a rephrased query is not served the undone cell, and a served entry
+        is counted as a wrong hit.
+
+        Args:
+            nb_path (str): The path to the notebook.
+
+        Returns:
+            bool: Whether the last query of the notebook was served from the cache.
+        """
+        with self._lock:
+            last = self._last_entries.pop(os.path.abspath(nb_path), None)
+            if last is None:
+                return False
+            row, entry, hit = last
+            # The row may have been reused since by another query.
+            if self._entries[row] is entry:
+                self._drop(row)
+        if hit:
+            METRICS.increment("semantic_cache.rejected")
+        return hit
+
+    def _drop(self, row: int) -> None:
+        """
+        Free a row of the cache, under the lock.
+
+        Args:
+            row (int): The row.
+
+        Returns:
+            None
+        """
+        self._vectors[row] = 0
+        self._entries[row] = None
+        self._accessed[row] = 0
+
+    def precision(self) -> Optional[float]:
+        """
+        The share of the hits which were not rejected since the start of the process.
+
+        Returns:
+            Optional[float]: The precision, or None before the first hit.
+        """
+        hits = METRICS.counter("semantic_cache.hit")
+        return 1 - METRICS.counter("semantic_cache.rejected") / hits if hits else None
+
+    def clear(self) -> None:
+        """
+        Remove every cached content.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for row in range(self.max_entries):
+                self._drop(row)
+            self._last_entries.clear()
+
+
+SEMANTIC_CACHE = SemanticCache()
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+import nbformat
+from nbformat.v4.rwbase import rejoin_lines
+
+BACKUP_DIR = "backup"
+MAX_BACKUP_BYTES = 200 * 1024 * 1024
+MAX_UNDO_LEVELS = 50
+
+
+def canonical_cell(cell: Any) -> str:
+    """
+    Serialize a cell in the canonical form hashed and stored by the snapshot store: the multiline texts joined
+    (as nbformat.read returns them, whereas the file holds them split into lines), the keys sorted and no
+    indentation. A cell gets the same hash whether it was parsed by nbformat or copied from the file.
+
+    Args:
+        cell (Any): The cell, a dict or a notebook node.
+
+    Returns:
+        str: The canonical JSON text of the cell.
+    """
+    cell = rejoin_lines(nbformat.from_dict({"cells": [cell]})).cells[0]
+    return json.dumps(cell, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+class SnapshotStore():
+    """
+    A versioned, content-addressed backup store of a Jupyter notebook. Each snapshot is a small manifest
+    listing the hashes of its cells; the cells themselves are stored once per distinct content, so a snapshot
+    only writes the cells which changed since the previous one. The store keeps an undo and a redo stack of
+    snapshots and evicts the oldest ones when it exceeds its disk budget.
+    """
+
+    def __init__(self,
+                 nb_path: str,
+                 root: str = BACKUP_DIR,
+                 max_bytes: int = MAX_BACKUP_BYTES,
+                 max_levels: int = MAX_UNDO_LEVELS) -> None:
+        notebook_name = os.path.basename(nb_path)
+        path_hash = hashlib.sha1(os.path.abspath(nb_path).encode('utf-8')).hexdigest()[:8]
+        self.root = os.path.join(root, f"{notebook_name}-{path_hash}")
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.snapshots_dir = os.path.join(self.root, "snapshots")
+        self.history_path = os.path.join(self.root, "history.json")
+        self.max_bytes = max_bytes
+        self.max_levels = max_levels
+
+    def _load_history(self) -> dict:
+        """
+        Load the undo/redo stacks of the notebook.
+
+        Returns:
+            dict: The history with the "undo" and "redo" stacks of snapshot numbers and the next snapshot number.
+        """
+        if not os.path.exists(self.history_path):
+            return {"undo": [], "redo": [], "next": 0}
+        with open(self.history_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_history(self, history: dict) -> None:
+        """
+        Atomically save the undo/redo stacks of the notebook.
+
+        Args:
+            history (dict): The history to save.
+
+        Returns:
+            None
+        """
+        tmp_path = self.history_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(history, f)
+        os.replace(tmp_path, self.history_path)
+
+    def capture(self, nb: Any) -> dict:
+        """
+        Store the cells of a notebook which are not in the store yet and build the manifest of its current state.
+
+        Args:
+            nb (Any): The Jupyter notebook object.
+
+        Returns:
+            dict: The manifest of the notebook state.
+        """
+        header = {"nbformat": nb["nbformat"], "nbformat_minor": nb["nbformat_minor"], "metadata": nb["metadata"]}
+        return self._store(header, nb["cells"])
+
+    def capture_raw(self, header: dict, contents: list[str]) -> dict:
+        """
+        Store the cells not in the store yet and build the manifest of a notebook state, from the JSON text 
+        of its cells (e.g. copied from the file without parsing it). The cells are stored in the canonical form,
+        so the manifest is the one capture builds for the same notebook.
+
+        Args:
+            header (dict): The nbformat, nbformat_minor and metadata fields of the notebook.
+            contents (list): The JSON text of each cell.
+
+        Returns:
+            dict: The manifest of the notebook state.
+        """
+        return self._store(header, [json.loads(content) for content in contents])
+
+    def _store(self, header: dict, cells: list) -> dict:
+        """
+        Store the cells not in the store yet, under the hash of their canonical form, and build the manifest
+        of a notebook state.
+
+        Args:
+            header (dict): The nbformat, nbformat_minor and metadata fields of the notebook.
+            cells (list): The cells of the notebook.
+
+        Returns:
+            dict: The manifest of the notebook state.
+        """
+        os.makedirs(self.objects_dir, exist_ok=True)
+        cell_hashes = []
+        for cell in cells:
+            content = canonical_cell(cell)
+            cell_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            object_path = os.path.join(self.objects_dir, cell_hash + ".json")
+            if not os.path.exists(object_path):
+                with open(object_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            cell_hashes.append(cell_hash)
+        return {"nbformat": header["nbformat"],
+                "nbformat_minor": header["nbformat_minor"],
+                "metadata": header["metadata"],
+                "cells": cell_hashes}
+
+    def _write_snapshot(self, history: dict, manifest: dict) -> int:
+        """
+        Write a manifest as a new snapshot.
+
+        Args:
+            history (dict): The history, whose next snapshot number is incremented.
+            manifest (dict): The manifest of the notebook state.
+
+        Returns:
+            int: The number of the new snapshot.
+        """
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        number = history["next"]
+        history["next"] += 1
+        with open(os.path.join(self.snapshots_dir, f"{number}.json"), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        return number
+
+    def _read_snapshot(self, number: int) -> dict:
+        """
+        Read the manifest of a snapshot.
+
+        Args:
+            number (int): The number of the snapshot.
+
+        Returns:
+            dict: The manifest of the notebook state.
+        """
+        with open(os.path.join(self.snapshots_dir, f"{number}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _delete_snapshot(self, number: int) -> None:
+        """
+        Delete the manifest of a snapshot. Its cells are removed by the next garbage collection.
+
+        Args:
+            number (int): The number of the snapshot.
+
+        Returns:
+            None
+        """
+        snapshot_path = os.path.join(self.snapshots_dir, f"{number}.json")
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+    def restore(self, manifest: dict) -> Any:
+        """
+        Rebuild the notebook described by a manifest.
+
+        Args:
+            manifest (dict): The manifest of the notebook state.
+
+        Returns:
+            Any: The Jupyter notebook object.
+        """
+        cells = []
+        for cell_hash in manifest["cells"]:
+            with open(os.path.join(self.objects_dir, cell_hash + ".json"), 'r', encoding='utf-8') as f:
+                cells.append(json.load(f))
+        return nbformat.from_dict({"nbformat": manifest["nbformat"],
+                                   "nbformat_minor": manifest["nbformat_minor"],
+                                   "metadata": manifest["metadata"],
+                                   "cells": cells})
+
+    def push(self, manifest: dict) -> None:
+        """
+        Record the state of the notebook before a modifying action. The redo stack is dropped.
+
+        Args:
+            manifest (dict): The manifest of the notebook state, from capture.
+
+        Returns:
+            None
+        """
+        history = self._load_history()
+        if history["undo"] and self._read_snapshot(history["undo"][-1]) == manifest:
+            return
+        history["undo"].append(self._write_snapshot(history, manifest))
+        for number in history["redo"]:
+            self._delete_snapshot(number)
+        history["redo"] = []
+        self._evict(history)
+        self._save_history(history)
+
+    def can_undo(self) -> bool:
+        """
+        Check whether there is a version to step back to, before the current state is captured.
+
+        Returns:
+            bool: Whether the undo stack is not empty.
+        """
+        return bool(self._load_history()["undo"])
+
+    def can_redo(self) -> bool:
+        """
+        Check whether there is an undone version to step forward to, before the current state is captured.
+
+        Returns:
+            bool: Whether the redo stack is not empty.
+        """
+        return bool(self._load_history()["redo"])
+
+    def undo(self, current: dict) -> Optional[dict]:
+        """
+        Step one version back. The current state is kept on the redo stack.
+
+        Args:
+            current (dict): The manifest of the current notebook state, from capture.
+
+        Returns:
+            Optional[dict]: The manifest of the previous state, or None if there is nothing to undo.
+        """
+        return self._step(current, "undo", "redo")
+
+    def redo(self, current: dict) -> Optional[dict]:
+        """
+        Step one version forward, after an undo. The current state is kept on the undo stack.
+
+        Args:
+            current (dict): The manifest of the current notebook state, from capture.
+
+        Returns:
+            Optional[dict]: The manifest of the next state, or None if there is nothing to redo.
+        """
+        return self._step(current, "redo", "undo")
+
+    def _step(self, current: dict, source: str, target: str) -> Optional[dict]:
+        """
+        Pop a snapshot from a stack and push the current state on the other one.
+
+        Args:
+            current (dict): The manifest of the current notebook state.
+            source (str): The stack to pop from.
+            target (str): The stack to push the current state on.
+
+        Returns:
+            Optional[dict]: The manifest of the popped snapshot, or None if the stack is empty.
+        """
+        history = self._load_history()
+        if not history[source]:
+            return None
+        number = history[source].pop()
+        manifest = self._read_snapshot(number)
+        self._delete_snapshot(number)
+        history[target].append(self._write_snapshot(history, current))
+        # No eviction here: the cells of the popped snapshot must survive until the caller has restored it.
+        self._save_history(history)
+        return manifest
+
+    def _disk_usage(self) -> int:
+        """
+        Compute the size of the store on disk.
+
+        Returns:
+            int: The size in bytes.
+        """
+        size = 0
+        for directory in (self.objects_dir, self.snapshots_dir):
+            if os.path.exists(directory):
+                with os.scandir(directory) as entries:
+                    size += sum(entry.stat().st_size for entry in entries)
+        return size
+
+    def _evict(self, history: dict) -> None:
+        """
+        Drop the oldest snapshots beyond the maximum number of levels or the disk budget, then remove the
+        cells which are no longer referenced. The most recent undo snapshot is always kept.
+
+        Args:
+            history (dict): The history, updated in place.
+
+        Returns:
+            None
+        """
+        while len(history["undo"]) > self.max_levels:
+            self._delete_snapshot(history["undo"].pop(0))
+        self._collect_garbage(history)
+        while len(history["undo"]) > 1 and self._disk_usage() > self.max_bytes:
+            self._delete_snapshot(history["undo"].pop(0))
+            self._collect_garbage(history)
+
+    def collect_garbage(self) -> None:
+        """
+        Remove the stored cells which are referenced by no snapshot, e.g. the cells captured for an action which
+        failed before its snapshot was pushed.
+
+        Returns:
+            None
+        """
+        self._collect_garbage(self._load_history())
+
+    def _collect_garbage(self, history: dict) -> None:
+        """
+        Remove the stored cells which are referenced by no snapshot.
+
+        Args:
+            history (dict): The history of the snapshots still in use.
+
+        Returns:
+            None
+        """
+        if not os.path.exists(self.objects_dir):
+            return
+        referenced = set()
+        for number in history["undo"] + history["redo"]:
+            referenced.update(self._read_snapshot(number)["cells"])
+        with os.scandir(self.objects_dir) as entries:
+            for entry in entries:
+                if entry.name[:-len(".json")] not in referenced:
+                    os.remove(entry.path)
@@ -0,0 +1,152 @@
+import threading
+from typing import Any, Optional
+
+# The tokenizer of the model served by the HuggingFace Inference API (jupy_app.load_llm).
+TOKENIZER_REPO = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+# The context window of the model: the prompt and the generated tokens must fit in it.
+CONTEXT_TOKENS = 32768
+# Without the tokenizer, the number of tokens is estimated from the number of characters.
+CHARS_PER_TOKEN = 4
+# Inserted where the middle of a text was removed to fit its prompt within the budget.
+TRUNCATION_MARKER = "\n[...]\n"
+
+_tokenizer = None
+_lock = threading.Lock()
+
+
+class RankedList(list):
+    """
+    A list input of a prompt, in the order of the prompt, with the relevance rank of each entry (0 for the most
+    relevant), e.g. the cells selected by cell_retrieval: fit_inputs drops its least relevant entries first.
+    """
+
+    def __init__(self,
+                 items: list,
+                 ranks: list[int]) -> None:
+        super().__init__(items)
+        self.ranks = list(ranks)
+
+
+def load_tokenizer(token: Optional[str] = None,
+                   repo_id: str = TOKENIZER_REPO) -> bool:
+    """
+    Load the tokenizer of the model (only its tokenizer.json, with the tokenizers package), used from then on by
+    count_tokens. Without the package or the network, the heuristic estimation is kept.
+
+    Args:
+        token (Optional[str]): The HuggingFace token, the repositories of some models being gated.
+        repo_id (str): The HuggingFace repository of the model.
+
+    Returns:
+        bool: Whether the tokenizer is loaded.
+    """
+    global _tokenizer
+    with _lock:
+        if _tokenizer is not None:
+            return True
+        try:
+            from tokenizers import Tokenizer
+            _tokenizer = Tokenizer.from_pretrained(repo_id, auth_token=token)
+        except Exception as error:
+            print(f"Tokenizer de {repo_id} indisponible, le nombre de tokens sera estimé : {error}")
+            return False
+        return True
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text from its number of characters.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text with the tokenizer of the model if it is loaded, estimate them otherwise.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The number of tokens.
+    """
+    if _tokenizer is None or not text:
+        return estimate_tokens(text)
+    return len(_tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def truncate(text: str,
+             max_tokens: int) -> str:
+    """
+    Shorten a text to a number of tokens, keeping its beginning and its end (e.g. the imports and the last lines
+    of a cell) around TRUNCATION_MARKER.
+
+    Args:
+        text (str): The text.
+        max_tokens (int): The maximum number of tokens.
+
+    Returns:
+        str: The text, shortened if needed.
+    """
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = len(text) * max(max_tokens - count_tokens(TRUNCATION_MARKER), 0) // tokens
+    while keep > 0:
+        head = keep * 2 // 3
+        candidate = text[:head] + TRUNCATION_MARKER + text[len(text) - (keep - head):]
+        if count_tokens(candidate) <= max_tokens:
+            return candidate
+        keep = keep * 9 // 10
+    return ""
+
+
+def fit_inputs(template: Any,
+               inputs: dict,
+               max_tokens: int,
+               trim_order: tuple[str, ...]) -> tuple[dict, str, int]:
+    """
+    Fit a prompt within a token budget, trimming its variable parts in priority order: the least relevant entries
+    of a RankedList (e.g. the cells of the history, the imports last) or the first entries of another list are
+    dropped, the middle of a text is removed.
+
+    Args:
+        template (Any): The LangChain PromptTemplate.
+        inputs (dict): The values of the prompt variables.
+        max_tokens (int): The maximum number of tokens of the rendered prompt.
+        trim_order (tuple): The variables which can be trimmed, the first ones trimmed first.
+
+    Returns:
+        tuple: The values of the variables, the rendered prompt and its number of tokens. The prompt can still
+            exceed the budget if its fixed part does.
+    """
+    prompt = template.format(**inputs)
+    tokens = count_tokens(prompt)
+    if tokens <= max_tokens:
+        return inputs, prompt, tokens
+    inputs = dict(inputs)
+    for name in trim_order:
+        value = inputs.get(name)
+        if isinstance(value, list):
+            kept = list(value)
+            ranks = value.ranks if isinstance(value, RankedList) else [-ind for ind in range(len(value))]
+            ranks = list(ranks)
+            while kept and tokens > max_tokens:
+                drop = ranks.index(max(ranks))
+                del kept[drop], ranks[drop]
+                inputs[name] = RankedList(kept, ranks) if isinstance(value, RankedList) else list(kept)
+                prompt = template.format(**inputs)
+                tokens = count_tokens(prompt)
+        elif isinstance(value, str) and value:
+            inputs[name] = truncate(value, count_tokens(value) - (tokens - max_tokens))
+            prompt = template.format(**inputs)
+            tokens = count_tokens(prompt)
+        if tokens <= max_tokens:
+            break
+    return inputs, prompt, tokens
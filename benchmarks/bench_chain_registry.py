@@ -0,0 +1,49 @@
+"""
+Measure the per-request overhead of building the LangChain chains, before (a new PromptTemplate and LLMChain
+on every call) and after the chain registry. A fake LLM isolates the overhead from the network latency.
+If HUGGINGFACEHUB_API_TOKEN is set, the construction of the HuggingFaceHub client done on each Streamlit rerun
+before load_llm was cached is measured as well.
+
+Usage: python benchmarks/bench_chain_registry.py [n_calls]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain_community.llms.fake import FakeListLLM
+
+import chain_inferences
+
+
+def main(n_calls: int) -> None:
+    llm = FakeListLLM(responses=["Nom de la fonction à choisir: create_code_cell"])
+
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        template = PromptTemplate(input_variables=["query"], template=chain_inferences.PROMPT_ROUTER)
+        LLMChain(prompt=template, llm=llm).invoke({"query": "Crée une cellule qui charge le csv"})
+    before = (time.perf_counter() - start) / n_calls
+
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        chain_inferences.chain_router(llm, "Crée une cellule qui charge le csv")
+    after = (time.perf_counter() - start) / n_calls
+
+    print(f"chain_router, new chain on every call : {before * 1000:.3f} ms/call")
+    print(f"chain_router, registered chain        : {after * 1000:.3f} ms/call")
+
+    token = os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    if token:
+        from langchain_community.llms import HuggingFaceHub
+        start = time.perf_counter()
+        HuggingFaceHub(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1", huggingfacehub_api_token=token,
+                       model_kwargs={"temperature": 0.1, "max_new_tokens": 500})
+        print(f"HuggingFaceHub client construction (per rerun before caching) : {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,82 @@
+"""
+Compare the update of a large code cell by regeneration (chain_code_update, the model writes the whole cell again)
+with the update by search/replace edits (chain_code_edit, the model only writes the changed lines): generated tokens
+and latency, for a one-line change in cells of growing size.
+
+A simulated endpoint generates the expected answer token by token with a fixed latency per token, like
+a text-generation-inference server. The response cache is bypassed.
+
+Usage: python benchmarks/bench_code_patch.py [latency_per_token_in_s]
+"""
+import os
+import sys
+import time
+from typing import Any, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from langchain_core.language_models.llms import LLM
+
+import chain_inferences
+from metrics import METRICS
+
+QUERY = "Remplace la moyenne par la médiane dans la fonction step_3"
+
+
+def make_cell(n_lines: int) -> str:
+    return "\n".join(f"def step_{i}(df):\n    return df['col_{i}'].mean()" for i in range(n_lines // 2))
+
+
+def updated_cell(code: str) -> str:
+    return code.replace("df['col_3'].mean()", "df['col_3'].median()")
+
+
+class SimulatedEndpoint(LLM):
+    """
+    A text-generation endpoint which returns the prompt followed by the expected update of the cell, as edits
+    or as the whole code depending on the prompt, generated token by token.
+    """
+    latency: float = 0.005
+    chars_per_token: int = 4
+    code: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated-endpoint"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        if prompt.rstrip().endswith("Edits:"):
+            answer = (" <<<<<<< SEARCH\ndef step_3(df):\n    return df['col_3'].mean()\n=======\n"
+                      "def step_3(df):\n    return df['col_3'].median()\n>>>>>>> REPLACE")
+        else:
+            answer = " " + updated_cell(self.code)
+        n_tokens = min(len(answer) // self.chars_per_token + 1, kwargs.get("max_new_tokens", 500))
+        time.sleep(self.latency * n_tokens)
+        return prompt + answer[:n_tokens * self.chars_per_token]
+
+
+def main(latency: float) -> None:
+    llm = SimulatedEndpoint(latency=latency)
+    # The regeneration of the largest cells must not be cut by the generation profile.
+    chain_inferences.set_generation_profile("code_update", max_new_tokens=4000, max_input_tokens=8000)
+    chain_inferences.set_generation_profile("code_patch", max_input_tokens=8000)
+    for n_lines in (20, 50, 100, 200):
+        code = make_cell(n_lines)
+        llm.code = code
+        expected = updated_cell(code)
+        results = {}
+        for label, patch in (("regeneration", False), ("edits", True)):
+            METRICS.reset()
+            start = time.perf_counter()
+            updated = chain_inferences.chain_code_edit(llm, QUERY, code, use_cache=False, patch=patch)
+            elapsed = time.perf_counter() - start
+            counters = METRICS.summary()["counters"]
+            tokens = sum(value for name, value in counters.items() if name.startswith("tokens.completion."))
+            results[label] = (tokens, elapsed, updated.strip() == expected.strip())
+        print(f"{n_lines:4d} lines  " + "  ".join(f"{label} {tokens:5d} generated tokens {elapsed:6.2f} s "
+                                                 f"(correct: {correct})"
+                                                 for label, (tokens, elapsed, correct) in results.items()))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.005)
@@ -0,0 +1,38 @@
+"""
+Check the local router (fast_router) on the labelled queries of bench_route_and_generate: share of the queries
+routed without the LLM, time per query, and the queries routed to a wrong action, which JupyCoder would execute
+without asking the LLM. A query left to the LLM router is not an error.
+
+Usage: python benchmarks/bench_fast_router.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_route_and_generate import LABELLED_QUERIES
+from fast_router import FAST_ROUTER, ROUTER_EXAMPLES
+
+
+def main() -> None:
+    queries = LABELLED_QUERIES + [(query, action) for action, examples in ROUTER_EXAMPLES.items() for query in examples]
+    routed, wrong = 0, []
+    start = time.perf_counter()
+    for query, label in queries:
+        action = FAST_ROUTER.route(query)
+        routed += action is not None
+        if action is not None and action != label:
+            wrong.append((query, label, action))
+    elapsed = time.perf_counter() - start
+    print(f"{len(queries)} queries: {routed / len(queries):.0%} routed locally, "
+          f"{elapsed / len(queries) * 1000:.3f} ms per query, {len(wrong)} wrong")
+    for query, label, action in wrong:
+        print(f"  {query!r}: {action} instead of {label}")
+    if wrong:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Measure the generated tokens and the latency of each chain with one shared generation profile (500 new tokens,
+no stop sequence, as before) and with the per-action profiles of chain_inferences.GENERATION_PROFILES.
+
+Without HUGGINGFACEHUB_API_TOKEN, a simulated endpoint generates a canned answer token by token with a fixed
+latency per token, stopping at max_new_tokens or at a stop sequence like a text-generation-inference server.
+With the token, the Mixtral endpoint is used through HuggingFaceEndpoint, which sends the stop sequences.
+
+Usage: python benchmarks/bench_generation_profiles.py [latency_per_token_in_s]
+"""
+import os
+import sys
+import time
+from typing import Any, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from langchain_core.language_models.llms import LLM
+
+import chain_inferences
+from metrics import METRICS
+
+EXPLANATION = ("Ce paragraphe détaille chaque étape, les arguments utilisés et les alternatives possibles "
+               "avec leurs avantages et leurs inconvénients, puis revient sur le contexte de l'analyse. ") * 6
+
+ANSWERS = {
+    "choisir:": " create_code_cell\n\nJ'ai choisi create_code_cell car la requête demande de nouvelles lignes de code. " + EXPLANATION,
+    "est:": " import pandas as pd\ndf = pd.read_csv('data.csv')\ndf.head()\n\nThis code reads the csv file. " + EXPLANATION,
+    "Markdown:": " ## Présentation des données\nLe jeu de données décrit les passagers du Titanic.\n\n" + EXPLANATION,
+    "Explication:": " Ce code charge le fichier csv dans un dataframe pandas et affiche ses premières lignes. " + EXPLANATION,
+    "notebook,": " on charge les données puis on affiche leurs premières lignes. " + EXPLANATION,
+}
+
+CALLS = [
+    ("router", lambda llm: chain_inferences.chain_router(llm, "Charge le fichier data.csv", use_cache=False)),
+    ("code_generation", lambda llm: chain_inferences.chain_code_generation(llm, "Charge le fichier data.csv", [], use_cache=False)),
+    ("markdown_generation", lambda llm: chain_inferences.chain_markdown_generation(llm, "Présente le jeu de données", use_cache=False)),
+    ("code_explanation", lambda llm: chain_inferences.chain_code_explanation(llm, "df = pd.read_csv('data.csv')", use_cache=False)),
+    ("summary", lambda llm: chain_inferences.chain_summary(llm, "df = pd.read_csv('data.csv')", use_cache=False)),
+]
+
+
+class SimulatedEndpoint(LLM):
+    """
+    A text-generation endpoint which returns the prompt followed by a canned answer, generated token by token.
+    """
+    latency: float = 0.01
+    chars_per_token: int = 4
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated-endpoint"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        answer = next(text for marker, text in ANSWERS.items() if prompt.rstrip().endswith(marker))
+        generated = ""
+        for start in range(0, len(answer), self.chars_per_token):
+            if start // self.chars_per_token >= kwargs.get("max_new_tokens", 500):
+                break
+            time.sleep(self.latency)
+            generated += answer[start:start + self.chars_per_token]
+            if stop and any(sequence in generated for sequence in stop):
+                break
+        return prompt + generated
+
+
+def run(llm: Any, label: str, repeat: int) -> None:
+    METRICS.reset()
+    for _ in range(repeat):
+        for _, call in CALLS:
+            call(llm)
+    measures = METRICS.summary()["measures"]
+    print(label)
+    for name, _ in CALLS:
+        tokens = measures[f"chain.generated_tokens.{name}"]["mean"]
+        latency = measures[f"chain.invoke.{name}"]["mean"]
+        print(f"  {name:<20} {tokens:6.0f} generated tokens  {latency:6.2f} s")
+
+
+def main(latency: float) -> None:
+    token = os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    if token:
+        from langchain_community.llms import HuggingFaceEndpoint
+        llm = HuggingFaceEndpoint(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1", huggingfacehub_api_token=token,
+                                  temperature=0.1, max_new_tokens=500, return_full_text=True)
+        repeat = 3
+    else:
+        llm = SimulatedEndpoint(latency=latency)
+        repeat = 1
+
+    profiles = dict(chain_inferences.GENERATION_PROFILES)
+    for name in profiles:
+        chain_inferences.set_generation_profile(name, max_new_tokens=500, temperature=0.1, stop=())
+    run(llm, "Shared profile (500 new tokens, no stop sequence)", repeat)
+
+    for name, profile in profiles.items():
+        chain_inferences.set_generation_profile(name, **profile._asdict())
+    run(llm, "Per-action profiles", repeat)
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.01)
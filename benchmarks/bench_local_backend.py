@@ -0,0 +1,74 @@
+"""
+Compare the local CPU backend (local_llm, a GGUF model run by llama.cpp) with the remote backend (the Mixtral model
+of the HuggingFace Inference API): load time of the local model and time of its second load (the model kept warm
+in the process), then the latency per request and the generated tokens per second of each backend on the prompts
+of chain_inferences. The response cache is bypassed.
+
+The local model is the GGUF file given on the command line or in JUPYCODER_LOCAL_MODEL (llama-cpp-python must be
+installed), the remote backend is used when HUGGINGFACEHUB_API_TOKEN is set. A missing backend is skipped.
+
+Usage: python benchmarks/bench_local_backend.py [model.gguf] [n_threads]
+"""
+import os
+import sys
+import time
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import chain_inferences
+import local_llm
+from metrics import METRICS
+
+CODE = "import pandas as pd\ndf = pd.read_csv('data.csv')\ndf['age'].mean()"
+REQUESTS = [
+    ("router", lambda llm: chain_inferences.chain_router(llm, "Crée une cellule qui trace un histogramme de l'âge",
+                                                         use_cache=False)),
+    ("code_generation", lambda llm: chain_inferences.chain_code_generation(llm, "Trace un histogramme de l'âge",
+                                                                           CODE, use_cache=False)),
+    ("markdown_generation", lambda llm: chain_inferences.chain_markdown_generation(llm, "Présente le jeu de données",
+                                                                                   use_cache=False)),
+    ("code_explanation", lambda llm: chain_inferences.chain_code_explanation(llm, CODE, use_cache=False)),
+]
+
+
+def run(llm: Any, repeat: int = 2) -> None:
+    for name, request in REQUESTS:
+        METRICS.reset()
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            request(llm)
+            latencies.append(time.perf_counter() - start)
+        tokens = METRICS.counter(f"tokens.completion.{name}")
+        print(f"  {name:<20} {sum(latencies) / repeat:6.2f} s/request  "
+              f"{tokens / repeat:5.0f} generated tokens  {tokens / sum(latencies):6.1f} tokens/s")
+
+
+def main(model_path: str, n_threads: int) -> None:
+    try:
+        start = time.perf_counter()
+        llm = local_llm.load_local_llm(model_path, n_threads=n_threads)
+        loaded = time.perf_counter() - start
+        start = time.perf_counter()
+        local_llm.load_local_llm(model_path, n_threads=n_threads)
+        print(f"local ({os.path.basename(llm.model_path)}): loaded in {loaded:.2f} s (warm-up included), "
+              f"reloaded in {(time.perf_counter() - start) * 1000:.3f} ms")
+        run(llm)
+    except (ImportError, FileNotFoundError, ValueError) as error:
+        print(f"local: skipped ({error})")
+
+    token = os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    if token:
+        from langchain_community.llms import HuggingFaceHub
+        llm = HuggingFaceHub(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1", huggingfacehub_api_token=token,
+                             model_kwargs={"temperature": 0.1, "max_new_tokens": 500})
+        print("remote (Mixtral-8x7B-Instruct, HuggingFace Inference API):")
+        run(llm)
+    else:
+        print("remote: skipped (HUGGINGFACEHUB_API_TOKEN is not set)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else os.environ.get(local_llm.MODEL_PATH_VARIABLE, ""),
+         int(sys.argv[2]) if len(sys.argv) > 2 else None)
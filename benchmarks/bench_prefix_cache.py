@@ -0,0 +1,64 @@
+"""
+Measure the time to first token of the local CPU backend (local_llm) with and without the reuse of the fixed prompt
+prefixes (local_llm.PrefixCache): the state of the model after the beginning of the router prompt, which lists the
+functions of JupyCoder, is restored instead of being evaluated again. Before each request the model state is reset,
+as after a request with another prompt.
+
+The local model is the GGUF file given on the command line or in JUPYCODER_LOCAL_MODEL (llama-cpp-python must be
+installed).
+
+Usage: python benchmarks/bench_prefix_cache.py [model.gguf] [repeat]
+"""
+import os
+import sys
+import time
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import chain_inferences
+import local_llm
+import token_budget
+
+INPUTS = {
+    "router": {"query": "Crée une cellule qui trace un histogramme de la colonne age"},
+    "route_and_generate": {"query": "Trace un histogramme de la colonne age",
+                           "history": "import pandas as pd\ndf = pd.read_csv('data.csv')",
+                           "last_cell": "df.head()"},
+    "code_generation": {"query": "Trace un histogramme de la colonne age",
+                        "history": "import pandas as pd\ndf = pd.read_csv('data.csv')"},
+}
+
+
+def first_token(llm: Any, prompt: str) -> float:
+    llm.client.reset()
+    start = time.perf_counter()
+    stream = llm.stream(prompt, max_new_tokens=8)
+    next(stream, None)
+    elapsed = time.perf_counter() - start
+    stream.close()
+    return elapsed
+
+
+def main(model_path: str, repeat: int) -> None:
+    llm = local_llm.load_local_llm(model_path)
+    prefix_cache = llm.prefix_cache
+    print(f"{os.path.basename(llm.model_path)}: {len(prefix_cache)} prefixes saved, "
+          f"{prefix_cache.size / 1024 ** 2:.0f} MiB")
+    prefixes = chain_inferences.static_prefixes()
+    for name, inputs in INPUTS.items():
+        prompt = chain_inferences.PROMPT_TEMPLATES[name].format(**inputs)
+        results = {}
+        for label, cache in (("without reuse", None), ("with reuse", prefix_cache)):
+            llm.prefix_cache = cache
+            results[label] = sum(first_token(llm, prompt) for _ in range(repeat)) / repeat
+        llm.prefix_cache = prefix_cache
+        print(f"  {name:<20} {token_budget.count_tokens(prompt):5d} prompt tokens "
+              f"({token_budget.count_tokens(prefixes[name]):4d} fixed)  "
+              + "  ".join(f"{label} {ttft * 1000:7.0f} ms" for label, ttft in results.items())
+              + f"  x{results['without reuse'] / results['with reuse']:.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else os.environ.get(local_llm.MODEL_PATH_VARIABLE, ""),
+         int(sys.argv[2]) if len(sys.argv) > 2 else 3)
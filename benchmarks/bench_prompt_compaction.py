@@ -0,0 +1,72 @@
+"""
+Measure the tokens saved by prompt_compaction on a corpus of notebooks: the code cells of each notebook as they
+are sent to the summary prompt, without compaction, with the strict compaction (comments, blank lines, repeated
+imports) and with the default compaction (also docstrings and large literals), and the time spent per cell.
+
+The notebooks are the .ipynb files given on the command line, directories being searched recursively.
+The tokens are counted with the Mixtral tokenizer when HUGGINGFACEHUB_API_TOKEN is set and the tokenizers package
+is installed, estimated otherwise.
+
+Usage: python benchmarks/bench_prompt_compaction.py notebook_or_directory [...]
+"""
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import notebook_modification
+import prompt_compaction
+import token_budget
+
+
+def find_notebooks(paths: list[str]) -> list[str]:
+    notebooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            notebooks += sorted(glob.glob(os.path.join(path, "**", "*.ipynb"), recursive=True))
+        else:
+            notebooks.append(path)
+    return [path for path in notebooks if ".ipynb_checkpoints" not in path]
+
+
+def main(paths: list[str]) -> None:
+    token = os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    exact = bool(token) and token_budget.load_tokenizer(token)
+    notebooks = find_notebooks(paths)
+    if not notebooks:
+        sys.exit("No notebook found.")
+
+    totals = {"raw": 0, "strict": 0, "default": 0}
+    n_cells, elapsed = 0, 0.0
+    for path in notebooks:
+        try:
+            codes = notebook_modification.NotebookSession(path).get_all_cell()
+        except Exception as error:
+            print(f"{path}: skipped ({error})")
+            continue
+        prompt_compaction.compact_code.cache_clear()
+        start = time.perf_counter()
+        strict = prompt_compaction.compact_cells(codes, strict=True)
+        default = prompt_compaction.compact_cells(codes)
+        elapsed += time.perf_counter() - start
+        n_cells += len(codes)
+        tokens = {"raw": token_budget.count_tokens(str(codes)),
+                  "strict": token_budget.count_tokens(str(strict)),
+                  "default": token_budget.count_tokens(str(default))}
+        for name, value in tokens.items():
+            totals[name] += value
+        print(f"{os.path.basename(path):<40} {len(codes):4d} cells  {tokens['raw']:7d} tokens  "
+              f"strict -{1 - tokens['strict'] / max(tokens['raw'], 1):4.0%}  "
+              f"default -{1 - tokens['default'] / max(tokens['raw'], 1):4.0%}")
+
+    print(f"\n{len(notebooks)} notebooks, {n_cells} cells, {totals['raw']} tokens "
+          f"({'Mixtral tokenizer' if exact else 'estimated'})")
+    for name in ("strict", "default"):
+        print(f"  {name:<8} {totals[name]:8d} tokens  saved {1 - totals[name] / max(totals['raw'], 1):5.1%}")
+    print(f"  compaction time {elapsed / max(n_cells, 1) * 1000:.2f} ms per cell (strict + default)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,149 @@
+"""
+Measure the resilience layer of the remote LLM (resilient_llm.ResilientLLM) against a local fake HTTP server which
+answers like the HuggingFace Inference API (POST {"inputs", "parameters"} -> [{"generated_text"}]) and injects
+latency: most requests answer after a short latency, a few are very slow and a few fail with a 503. The same
+HuggingFaceHub client is used without the layer, with deadlines and retries, and with hedged requests: latency
+percentiles and failed calls. Then the server goes down: time to fail with an open circuit, and with the local
+secondary backend.
+
+Usage: python benchmarks/bench_resilience.py [n_requests] [slow_rate] [error_rate]
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from langchain_community.llms import HuggingFaceHub
+from langchain_core.language_models.llms import LLM
+
+import resilient_llm
+from metrics import METRICS
+
+ANSWER = " Nom de la fonction à choisir: create_code_cell"
+
+
+class FakeInferenceServer(ThreadingHTTPServer):
+    """
+    A text-generation server on localhost with an injected latency: a lognormal latency around `latency`, a `slow`
+    latency for a share `slow_rate` of the requests and a 503 error for a share `error_rate`; always 503 when `down`.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.05, slow: float = 2.0, slow_rate: float = 0.05, error_rate: float = 0.03):
+        super().__init__(("127.0.0.1", 0), FakeInferenceHandler)
+        self.latency, self.slow, self.slow_rate, self.error_rate = latency, slow, slow_rate, error_rate
+        self.down = False
+        self.requests = 0
+        self.random = random.Random(0)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class FakeInferenceHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self) -> None:
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests += 1
+        draw = server.random.random()
+        if server.down or draw < server.error_rate:
+            self.reply(503, {"error": "Model is currently loading", "estimated_time": 20.0})
+            return
+        time.sleep(server.slow if draw > 1 - server.slow_rate else server.random.lognormvariate(0, 0.3) * server.latency)
+        self.reply(200, [{"generated_text": body["inputs"] + ANSWER}])
+
+    def reply(self, status: int, payload: Any) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class LocalBackend(LLM):
+    """
+    A secondary backend which answers at once, standing for the local model (local_llm).
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "local"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return prompt + ANSWER
+
+
+def make_client(server: FakeInferenceServer, timeout: float) -> HuggingFaceHub:
+    client = HuggingFaceHub(repo_id=server.url, task="text-generation", huggingfacehub_api_token="fake",
+                            model_kwargs={"temperature": 0.1, "max_new_tokens": 20})
+    client.client.timeout = timeout
+    return client
+
+
+def run(llm: Any, n_requests: int) -> str:
+    latencies, failures = [], 0
+    for number in range(n_requests):
+        start = time.perf_counter()
+        try:
+            llm.invoke(f"[INST] Requête {number} [/INST]")
+        except Exception:
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    return (f"p50 {percentile(0.5) * 1000:6.0f} ms  p95 {percentile(0.95) * 1000:6.0f} ms  "
+            f"p99 {percentile(0.99) * 1000:6.0f} ms  max {latencies[-1] * 1000:6.0f} ms  failed {failures}")
+
+
+def main(n_requests: int, slow_rate: float, error_rate: float) -> None:
+    server = FakeInferenceServer(slow_rate=slow_rate, error_rate=error_rate)
+    print(f"fake server {server.url}: {slow_rate:.0%} slow requests (2 s), {error_rate:.0%} 503 errors")
+    # Without the layer, the client waits for a 503 (model loading) until its own timeout.
+    settings = [("client only", make_client(server, 10.0)),
+                ("deadline + retries", resilient_llm.ResilientLLM(primary=make_client(server, 5.0), deadline=5.0,
+                                                                  attempt_timeout=1.0)),
+                ("+ hedging (p95)", resilient_llm.ResilientLLM(primary=make_client(server, 5.0), deadline=5.0,
+                                                               attempt_timeout=1.0, hedging=True))]
+    for label, llm in settings:
+        METRICS.reset()
+        server.requests = 0
+        if isinstance(llm, resilient_llm.ResilientLLM) and llm.hedging:
+            # The p95 of the backend is learnt on a first series of requests.
+            run(llm, resilient_llm.MIN_HEDGE_SAMPLES)
+            server.requests = 0
+        stats = run(llm, n_requests)
+        counters = METRICS.summary()["counters"]
+        print(f"  {label:<20} {stats}  {server.requests / n_requests:.2f} HTTP requests/call  "
+              f"retries {counters.get('llm.retry', 0)}  hedged {counters.get('llm.hedged', 0)} "
+              f"(won {counters.get('llm.hedge_won', 0)})")
+
+    server.down = True
+    print("server down:")
+    for label, secondary in (("fail fast", None), ("secondary backend", LocalBackend())):
+        METRICS.reset()
+        llm = resilient_llm.ResilientLLM(primary=make_client(server, 5.0), secondary=secondary, deadline=2.0,
+                                         attempt_timeout=1.0)
+        stats = run(llm, n_requests // 4)
+        print(f"  {label:<20} {stats}  circuit {llm.breaker.state}, "
+              f"rejected by the circuit {METRICS.counter('llm.circuit.rejected')}, "
+              f"served by the secondary {METRICS.counter('llm.fallback')}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.05,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 0.03)
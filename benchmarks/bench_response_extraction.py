@@ -0,0 +1,78 @@
+"""
+Measure the throughput of the extraction of the code from large LLM completions: the former pipeline (the chain of
+split steps of chain_code_generation, then JupyCoder._cleaning_code_inference and _global_cleaning_cell) against
+the single scan of response_extraction, alone and followed by the syntax validation of extract_code, which the
+former pipeline did not do.
+
+Usage: python benchmarks/bench_response_extraction.py [n_lines_of_code]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import response_extraction
+from response_extraction import extract_code
+
+
+def legacy_extraction(response: str) -> str:
+    if 'Explanation' in response:
+        response = response.split("Explanation:")[0].strip()
+    if 'Notes' in response:
+        response = response.split("Notes:")[0].strip()
+    if 'Ce code' in response:
+        response = response.split("Ce code")[0].strip()
+    if 'Le code' in response:
+        response = response.split("Le code")[0].strip()
+    if 'Ici' in response:
+        response = response.split("Ici")[0].strip()
+    if 'This line' in response:
+        response = response.split("This line")[0].strip()
+    if 'This code' in response:
+        response = response.split("This code")[0].strip()
+    if 'Explication' in response:
+        response = response.split("Explication")[0].strip()
+    if 'Notez' in response:
+        response = response.split("Explication")[0].strip()
+    if 'Comments:' in response:
+        response = response.split("Comments:")[0].strip()
+    text = response.replace('\\_', '_').replace('`', "").replace("python", "").replace('\\#', '#')
+    clean_cell = re.sub(r'[=-]{3,}', '', text)
+    clean_cell = re.sub(r' {5,}', '', clean_cell)
+    clean_cell = re.sub('&#x200B;', '', clean_cell)
+    return clean_cell.split("This code")[0].strip()
+
+
+def completions(n_lines: int) -> dict[str, str]:
+    body = "\n".join(f"def step\\_{i}(df):\n    # étape {i}\n    return df[df['col\\_{i}'] > {i}]" for i in range(n_lines // 3))
+    prose = "Cette fonction filtre le dataframe selon la colonne indiquée et retourne le résultat. " * 20
+    return {
+        "unfenced": f" {body}\n\nThis code defines the filtering steps. {prose}",
+        "fenced": f" Voici le code demandé :\n```python\n{body}\n```\n\nExplication : {prose}",
+        "prose tail": f" {body}\nCette dernière ligne décrit le résultat obtenu",
+    }
+
+
+def measure(function, text: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main(n_lines: int) -> None:
+    for name, text in completions(n_lines).items():
+        repeat = max(3, 2_000_000 // len(text))
+        legacy = measure(legacy_extraction, text, repeat)
+        scan = measure(response_extraction._scan, text, repeat)
+        extraction = measure(extract_code, text, repeat)
+        megabytes = len(text.encode('utf-8')) / 1e6
+        print(f"{name:<11} {len(text) / 1000:5.0f} kB  legacy {megabytes / legacy:5.1f} MB/s  "
+              f"scan {megabytes / scan:5.1f} MB/s  scan + validation {megabytes / extraction:5.1f} MB/s "
+              f"({extraction * 1000:.2f} ms, valid: {extract_code(text).valid})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,141 @@
+"""
+Compare the two-call mode of JupyCoder (chain_router, then the chain of the action) with the single-call mode
+(chain_route_and_generate, one JSON answer with the action and the content of the cell): end-to-end latency,
+number of LLM requests and routing accuracy on a set of labelled queries. The local fast router is disabled and
+the response cache is bypassed, so that every query goes through the LLM.
+
+Without HUGGINGFACEHUB_API_TOKEN, a simulated LLM with a fixed latency per request answers with the expected action:
+the latency and the number of requests are meaningful, the accuracy is 100 % by construction. With the token, the
+Mixtral endpoint of the application is used and the accuracy is the real one.
+
+Usage: python benchmarks/bench_route_and_generate.py [latency_per_request_in_s]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from langchain_core.language_models.llms import LLM
+
+import notebook_modification
+from jupycoder import JupyCoder
+from metrics import METRICS
+
+LABELLED_QUERIES = [
+    ("Charge le fichier data.csv dans un dataframe", "create_code_cell"),
+    ("Affiche les cinq premières lignes du dataframe", "create_code_cell"),
+    ("Trace un histogramme de la colonne age", "create_code_cell"),
+    ("Entraîne une régression logistique sur les données", "create_code_cell"),
+    ("Écris un markdown qui présente le jeu de données", "create_markdown"),
+    ("Rédige un markdown d'introduction à l'analyse", "create_markdown"),
+    ("Modifie la dernière cellule pour utiliser seaborn", "update_last_cell"),
+    ("Mets à jour le dernier markdown pour le raccourcir", "update_last_markdown"),
+    ("Modifie la cellule avec la clé JupyCoder pour ajouter un titre", "update_selected_cell"),
+    ("Supprime la dernière cellule", "delete_last_cell"),
+    ("Supprime la cellule qui a la clé JupyCoder", "delete_selected_cell"),
+    ("Explique la dernière cellule", "explain_last_cell"),
+    ("Explique la cellule avec la clé JupyCoder", "explain_selected_cell"),
+    ("Résume tout le notebook", "summary_all"),
+    # The name of a key of the user's data, or a markdown mentioned in the request, must not select a marked cell.
+    ("Modifie la dernière cellule pour trier le dictionnaire par clé", "update_last_cell"),
+    ("Corrige la dernière cellule : la clé 'age' n'existe pas", "update_last_cell"),
+    ("Modifie la cellule avec la clé pour utiliser le markdown", "update_selected_cell"),
+    ("Ajoute une cellule de texte", "create_markdown"),
+    # The markdown of the last cell is not its code.
+    ("Mets à jour le markdown de la dernière cellule", "update_last_markdown"),
+    ("Modifie le dernier texte pour le raccourcir", "update_last_markdown"),
+]
+
+
+class SimulatedLLM(LLM):
+    """
+    An LLM which waits a fixed latency and answers each prompt of chain_inferences with the expected action
+    of the labelled query and a dummy content.
+    """
+    latency: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        time.sleep(self.latency)
+        # The routing prompts describe the actions with sentences close to the queries: only look after "QUERY".
+        tail = prompt[max(0, prompt.rfind('"QUERY"')):]
+        label = next((label for query, label in LABELLED_QUERIES if query in tail), "create_code_cell")
+        if "JSON:" in prompt:
+            content = "print('ok')" if "cell" in label else "Un paragraphe."
+            return json.dumps({"action": label, "content": content})
+        answers = [("choisir:", f"Nom de la fonction à choisir: {label}"),
+                   ("Updated Code:", "Updated Code: print('ok')"),
+                   ("Markdown modifié:", "Markdown modifié: Un paragraphe."),
+                   ("Le code python est:", "Le code python est: print('ok')"),
+                   ("Explication:", "Explication: Une explication."),
+                   ("Réponse:", "Réponse: Un résumé."),
+                   ("Markdown:", "Markdown: Un paragraphe.")]
+        return next(answer for marker, answer in answers if marker in prompt)
+
+
+class RecordingJupyCoder(JupyCoder):
+    """
+    A JupyCoder which records the routed action of each query.
+    """
+    action = None
+
+    def tools(self, llm, router_action, query, path, content=None):
+        self.action = router_action
+        return super().tools(llm, router_action, query, path, content)
+
+
+def invoke_count() -> int:
+    measures = METRICS.summary()["measures"]
+    return sum(stats["count"] for name, stats in measures.items() if name.startswith("chain.invoke."))
+
+
+def run(llm: Any, single_call: bool) -> dict:
+    latencies, correct = [], 0
+    requests = invoke_count()
+    for number, (query, label) in enumerate(LABELLED_QUERIES):
+        path = f"bench_{int(single_call)}_{number}.ipynb"
+        notebook_modification.create_notebook(path)
+        notebook_modification.create_code_cell(path, "import pandas as pd\ndf = pd.read_csv('data.csv')")
+        notebook_modification.create_markdown(path, "Chargement des données.")
+        agent = RecordingJupyCoder(path, llm, fast_routing=False, single_call=single_call)
+        start = time.perf_counter()
+        agent(query, use_cache=False)
+        latencies.append(time.perf_counter() - start)
+        correct += agent.action is not None and label in agent.action
+    latencies.sort()
+    return {"mean": sum(latencies) / len(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "requests": (invoke_count() - requests) / len(LABELLED_QUERIES),
+            "accuracy": correct / len(LABELLED_QUERIES)}
+
+
+def main(latency: float) -> None:
+    token = os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    if token:
+        from langchain_community.llms import HuggingFaceHub
+        llm = HuggingFaceHub(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1", huggingfacehub_api_token=token,
+                             model_kwargs={"temperature": 0.1, "max_new_tokens": 500})
+    else:
+        llm = SimulatedLLM(latency=latency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        for single_call in (False, True):
+            stats = run(llm, single_call)
+            print(f"{'single call' if single_call else 'two calls  '} : "
+                  f"mean {stats['mean']:.2f} s, p50 {stats['p50']:.2f} s, "
+                  f"{stats['requests']:.2f} requests/query, routing accuracy {stats['accuracy']:.0%}")
+    malformed = METRICS.counter("route_and_generate.malformed")
+    valid = METRICS.counter("route_and_generate.valid")
+    print(f"single-call answers malformed (fallback to two calls) : {malformed}/{malformed + valid}")
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.5)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the application are imported as top-level modules, as Streamlit runs them from app/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
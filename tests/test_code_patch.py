@@ -0,0 +1,85 @@
+"""
+Tests of the search/replace edits of a code cell (code_patch.patch_code): an edit applies to the single occurrence
+of its lines, exactly or up to the indentation; a missing, ambiguous or invalid edit is rejected, so that the cell
+is regenerated as a whole instead of being wrongly edited.
+"""
+import pytest
+
+from code_patch import parse_blocks, patch_code
+
+CELL = """import pandas as pd
+
+def load(path):
+    df = pd.read_csv(path)
+    df = df.dropna()
+    return df
+
+df = load('ventes.csv')
+print(df.head())"""
+
+
+def edit(search: str, replace: str, before: str = "Voici la modification :\n", after: str = "\nC'est fait.") -> str:
+    return f"{before}<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE{after}"
+
+
+def test_blocks_are_parsed_without_the_text_around():
+    text = edit("a = 1", "a = 2") + "\n" + edit("b = 1", "b = 2", before="")
+    assert parse_blocks(text) == [("a = 1", "a = 2"), ("b = 1", "b = 2")]
+
+
+def test_exact_match_is_replaced():
+    patched = patch_code(CELL, edit("print(df.head())", "print(df.describe())"))
+    assert patched == CELL.replace("print(df.head())", "print(df.describe())")
+
+
+def test_match_up_to_the_indentation_is_reindented():
+    # The model copied the body of the function without its indentation.
+    text = edit("df = df.dropna()\nreturn df", "df = df.dropna()\ndf = df.drop_duplicates()\nreturn df")
+    patched = patch_code(CELL, text)
+    assert patched == CELL.replace("    df = df.dropna()\n",
+                                   "    df = df.dropna()\n    df = df.drop_duplicates()\n")
+
+
+def test_blocks_are_applied_in_order():
+    text = edit("import pandas as pd", "import pandas as pd\nimport numpy as np") + "\n" + \
+        edit("print(df.head())", "print(np.mean(df['prix']))", before="")
+    patched = patch_code(CELL, text)
+    assert patched.startswith("import pandas as pd\nimport numpy as np\n")
+    assert patched.endswith("print(np.mean(df['prix']))")
+
+
+def test_empty_search_appends_lines():
+    assert patch_code(CELL, edit("", "df.to_csv('propre.csv')")) == CELL + "\ndf.to_csv('propre.csv')"
+
+
+@pytest.mark.parametrize("text", [
+    # No edit in the response.
+    "df = load('ventes.csv')\nprint(df.tail())",
+    # The searched lines are not in the cell.
+    edit("df = df.fillna(0)", "df = df.fillna(1)"),
+    # A part of a line only: the edits replace whole lines.
+    edit("df.head()", "df.tail()"),
+    # The edit changes nothing.
+    edit("print(df.head())", "print(df.head())"),
+    # The edited cell is no longer valid Python.
+    edit("print(df.head())", "print(df.head()"),
+    # A later block does not apply: none is applied.
+    edit("print(df.head())", "print(df.tail())") + "\n" + edit("absent = 1", "absent = 2", before=""),
+])
+def test_rejected_edits(text):
+    assert patch_code(CELL, text) is None
+
+
+@pytest.mark.parametrize("cell", [
+    # The searched line occurs twice, exactly or up to the indentation.
+    "x = 1\ny = 2\nx = 1",
+    "if a:\n    x = 1\nif b:\n        x = 1",
+])
+def test_ambiguous_match_is_rejected(cell):
+    assert patch_code(cell, edit("x = 1", "x = 2")) is None
+
+
+def test_invalid_cell_may_stay_invalid():
+    # A cell already invalid (e.g. cut by the user) can still be edited.
+    cell = "for x in range(3):\nprint(x)"
+    assert patch_code(cell, edit("for x in range(3):", "for x in range(5):")) == "for x in range(5):\nprint(x)"
@@ -0,0 +1,42 @@
+"""
+Tests of the local router (fast_router): the obvious queries are routed by the rules, the ambiguous ones are left
+to the LLM router (None), never routed to a wrong action.
+"""
+import pytest
+
+from fast_router import FAST_ROUTER
+
+
+@pytest.mark.parametrize("query, action", [
+    ("Modifie la dernière cellule pour utiliser seaborn", "update_last_cell"),
+    ("Corrige la dernière cellule : la clé 'age' n'existe pas", "update_last_cell"),
+    ("Modifie la dernière cellule pour trier le dictionnaire par clé", "update_last_cell"),
+    ("Mets à jour le dernier markdown pour le raccourcir", "update_last_markdown"),
+    ("Mets à jour la dernière cellule markdown", "update_last_markdown"),
+    ("Mets à jour le markdown de la dernière cellule", "update_last_markdown"),
+    ("Modifie le dernier texte pour le raccourcir", "update_last_markdown"),
+    ("Supprime la dernière cellule", "delete_last_cell"),
+    ("Explique la dernière cellule", "explain_last_cell"),
+    ("Modifie la cellule avec la clé JupyCoder pour ajouter un titre", "update_selected_cell"),
+    ("Modifie la cellule ## A MODIFIER ## pour ajouter un titre", "update_selected_cell"),
+    ("Modifie le markdown avec la clé Jupycoder", "update_selected_markdown"),
+    ("Supprime la cellule qui a la clé JupyCoder", "delete_selected_cell"),
+    ("Explique la cellule avec la clé JupyCoder", "explain_selected_cell"),
+    ("Résume tout le notebook", "summary_all"),
+    ("Ajoute une cellule de texte", "create_markdown"),
+    ("Crée une cellule qui trace un histogramme", "create_code_cell"),
+])
+def test_obvious_queries_are_routed(query, action):
+    assert FAST_ROUTER.route(query) == action
+
+
+@pytest.mark.parametrize("query", [
+    # A conversion or a mention of a markdown in a request on the last cell: not the code of the last cell.
+    "Change la dernière cellule en markdown",
+    "Modifie la dernière cellule pour afficher le texte en gras",
+    "Explique la dernière cellule de texte",
+    # A key of the user's data is not the JupyCoder key.
+    "Modifie la cellule avec la clé 'age'",
+])
+def test_ambiguous_queries_are_left_to_the_llm(query):
+    assert FAST_ROUTER.route(query) is None
@@ -0,0 +1,84 @@
+"""
+Tests of the persistent cache of the LLM responses (llm_cache.LLMResponseCache): the key of a request, the expiry
+of the responses after their time-to-live and the eviction of the least recently used ones.
+"""
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import pytest
+from langchain_core.language_models.llms import LLM
+
+import llm_cache
+from metrics import METRICS
+
+
+class FakeLLM(LLM):
+    repo_id: str = "modele-a"
+    temperature: float = 0.1
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"repo_id": self.repo_id, "temperature": self.temperature}
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return prompt
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # The cache reads the time through its module: the tests move it forward by hand.
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: now.value))
+    METRICS.reset()
+    return now
+
+
+def test_key_depends_on_prompt_model_and_parameters():
+    key = llm_cache.LLMResponseCache.key("prompt", FakeLLM(), {"max_new_tokens": 20})
+
+    assert key == llm_cache.LLMResponseCache.key("prompt", FakeLLM(), {"max_new_tokens": 20})
+    assert key != llm_cache.LLMResponseCache.key("autre prompt", FakeLLM(), {"max_new_tokens": 20})
+    assert key != llm_cache.LLMResponseCache.key("prompt", FakeLLM(repo_id="modele-b"), {"max_new_tokens": 20})
+    assert key != llm_cache.LLMResponseCache.key("prompt", FakeLLM(temperature=0.7), {"max_new_tokens": 20})
+    assert key != llm_cache.LLMResponseCache.key("prompt", FakeLLM(), {"max_new_tokens": 500})
+
+
+def test_response_persists_across_instances(tmp_path, clock):
+    path = str(tmp_path / "cache" / "llm.sqlite")
+    llm_cache.LLMResponseCache(path).put("k", "réponse")
+
+    assert llm_cache.LLMResponseCache(path).get("k") == "réponse"
+    assert METRICS.counter("llm_cache.hit") == 1
+
+
+def test_response_expires_after_ttl(tmp_path, clock):
+    cache = llm_cache.LLMResponseCache(str(tmp_path / "llm.sqlite"), ttl=60)
+    cache.put("k", "réponse")
+
+    clock.value += 59
+    assert cache.get("k") == "réponse"
+    clock.value += 2
+    assert cache.get("k") is None
+    assert METRICS.counter("llm_cache.miss") == 1
+    # The expired entry was deleted.
+    assert cache._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+
+def test_least_recently_used_is_evicted(tmp_path, clock):
+    cache = llm_cache.LLMResponseCache(str(tmp_path / "llm.sqlite"), max_entries=2, ttl=None)
+    cache.put("a", "1")
+    clock.value += 1
+    cache.put("b", "2")
+    clock.value += 1
+    # Reading "a" makes "b" the least recently used entry.
+    assert cache.get("a") == "1"
+    clock.value += 1
+    cache.put("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
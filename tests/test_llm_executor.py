@@ -0,0 +1,37 @@
+"""
+Tests of the concurrent LLM requests (llm_executor.map_concurrently): a failed or late request gives None and is
+counted in the metrics, so that the page can warn about it, and the other results are kept in order.
+"""
+import time
+
+import pytest
+
+import llm_executor
+from metrics import METRICS
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    METRICS.reset()
+
+
+def request(delay: float, answer: str) -> str:
+    time.sleep(delay)
+    if answer == "erreur":
+        raise ConnectionError("LLM injoignable")
+    return answer
+
+
+def test_failed_and_late_requests_are_counted():
+    results = llm_executor.map_concurrently(request, [(0, "a"), (0, "erreur"), (1.0, "lent"), (0.05, "b")],
+                                            max_workers=4, timeout=0.3)
+
+    assert results == ["a", None, None, "b"]
+    assert METRICS.counter("llm_executor.failed") == 1
+    assert METRICS.counter("llm_executor.timeout") == 1
+    assert llm_executor.failed_requests() == 2
+
+
+def test_successful_requests_count_nothing():
+    assert llm_executor.map_concurrently(request, [(0, "a"), (0, "b")]) == ["a", "b"]
+    assert llm_executor.failed_requests() == 0
@@ -0,0 +1,142 @@
+"""
+Round-trip tests of the splice writer (notebook_writer.splice_cells) against the writer it replaces (nbformat.write):
+random notebooks receive random sequences of appends, insertions after a cell, source replacements and deletions,
+and the spliced file must be byte for byte the file written by nbformat.write for the same cells, and valid nbformat v4.
+The layout returned by the splice writer must be the layout read back from the written file.
+"""
+import copy
+import random
+
+import nbformat
+import pytest
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+import notebook_modification
+from notebook_cache import CELL_RECORD_CACHE
+from notebook_reader import read_notebook_layout
+from notebook_writer import PlannedCell, splice_cells
+
+SOURCES = ["", "a = 1", 'x = "é\\"\\n"\nprint(x)\n', "def f():\n    return 1", "# Titre", "texte\n\nsuite",
+           "l1\nl2\n", 'ü "q" ]}', "    indenté\n\ttabulé"]
+OPERATIONS = ["append_code", "append_markdown", "insert_after", "update", "delete"]
+
+
+def make_notebook(rng: random.Random, n_cells: int):
+    nb = new_notebook()
+    for _ in range(n_cells):
+        if rng.random() < 0.5:
+            cell = new_code_cell(rng.choice(SOURCES), execution_count=rng.choice([None, 1, 42]))
+            cell.outputs = [new_output("stream", text="sortie ]}\n" * rng.randint(1, 3))] if rng.random() < 0.5 else []
+        else:
+            cell = new_markdown_cell(rng.choice(SOURCES))
+        nb.cells.append(cell)
+    return nb
+
+
+def apply_random_operations(rng: random.Random, reference, plan: list):
+    for _ in range(rng.randint(1, 5)):
+        operation, source = rng.choice(OPERATIONS), rng.choice(SOURCES)
+        n_cells = len(plan)
+        if operation == "append_code":
+            cell = new_code_cell(source)
+            plan.append(PlannedCell(cell=cell))
+            reference.cells.append(copy.deepcopy(cell))
+        elif operation == "append_markdown":
+            cell = new_markdown_cell(source)
+            plan.append(PlannedCell(cell=cell))
+            reference.cells.append(copy.deepcopy(cell))
+        elif operation == "insert_after" and n_cells:
+            ind = rng.randrange(n_cells)
+            cell = new_markdown_cell(source)
+            plan.insert(ind + 1, PlannedCell(cell=cell))
+            reference.cells.insert(ind + 1, copy.deepcopy(cell))
+        elif operation == "update" and n_cells:
+            ind = rng.randrange(n_cells)
+            planned = plan[ind]
+            plan[ind] = planned._replace(source=source) if planned.cell is None else PlannedCell(cell={**planned.cell, "source": source})
+            reference.cells[ind].source = source
+        elif operation == "delete" and n_cells:
+            ind = rng.randrange(n_cells)
+            del plan[ind]
+            del reference.cells[ind]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_splice_matches_nbformat_write(tmp_path, seed):
+    rng = random.Random(seed)
+    nb = make_notebook(rng, rng.randint(0, 6))
+    spliced, expected = tmp_path / "spliced.ipynb", tmp_path / "expected.ipynb"
+    nbformat.write(nb, str(spliced))
+
+    layout = read_notebook_layout(str(spliced))
+    plan = [PlannedCell(record=record) for record in layout.records]
+    reference = copy.deepcopy(nb)
+    apply_random_operations(rng, reference, plan)
+    written = splice_cells(str(spliced), layout, plan)
+    nbformat.write(reference, str(expected))
+
+    assert spliced.read_bytes() == expected.read_bytes()
+    assert written == read_notebook_layout(str(spliced))
+    nbformat.validate(nbformat.read(str(spliced), as_version=4))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_session_round_trip(tmp_path, monkeypatch, seed):
+    # The session plans the same operations through its public methods; the file must stay exactly as nbformat
+    # would write it, with the expected cells. The indices are passed in lists, as JupyCoder.tools does.
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(seed)
+    path = str(tmp_path / "session.ipynb")
+    nbformat.write(make_notebook(rng, rng.randint(1, 6)), path)
+    expected = [(cell.cell_type, cell.source) for cell in nbformat.read(path, as_version=4).cells]
+    with notebook_modification.NotebookSession(path) as session:
+        for _ in range(rng.randint(1, 4)):
+            source = rng.choice(SOURCES)
+            operation = rng.choice(["code", "markdown", "explicate", "update", "update_last", "delete"])
+            ind = rng.randrange(len(expected))
+            if operation == "code":
+                session.create_code_cell(source)
+                expected.append(("code", source))
+            elif operation == "markdown":
+                session.create_markdown(source)
+                expected.append(("markdown", source))
+            elif operation == "explicate":
+                session.create_explicate_markdown([ind], source)
+                expected.insert(ind + 1, ("markdown", source))
+            elif operation == "update":
+                session.update_cell(source, [ind])
+                expected[ind] = (expected[ind][0], source)
+            elif operation == "update_last":
+                session.update_last_cell(source)
+                expected[-1] = (expected[-1][0], source)
+            elif len(expected) > 1:
+                session.delete_cell([ind])
+                del expected[ind]
+
+    written = open(path, "rb").read()
+    nb = nbformat.read(path, as_version=4)
+    nbformat.validate(nb)
+    assert [(cell.cell_type, cell.source) for cell in nb.cells] == expected
+    rewritten = tmp_path / "rewritten.ipynb"
+    nbformat.write(nb, str(rewritten))
+    assert written == rewritten.read_bytes()
+    # The layout cached after the write is the layout of the file.
+    cached = CELL_RECORD_CACHE.get(path)
+    assert cached is None or cached == read_notebook_layout(path)
+
+
+def test_concurrent_modification_is_not_undoable(tmp_path, monkeypatch):
+    # A file modified during the action is neither written nor recorded in the undo history.
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "concurrent.ipynb")
+    nbformat.write(make_notebook(random.Random(0), 3), path)
+    session = notebook_modification.NotebookSession(path)
+    session.create_code_cell("a = 2")
+    nb = nbformat.read(path, as_version=4)
+    nb.cells.append(new_markdown_cell("ajoutée dans Jupyter"))
+    nbformat.write(nb, path)
+
+    with pytest.raises(RuntimeError):
+        session.flush()
+    assert nbformat.read(path, as_version=4) == nb
+    assert session.snapshots.undo(session.snapshots.capture(nb)) is None
@@ -0,0 +1,264 @@
+"""
+Tests of the resilience layer of the LLM (resilient_llm.ResilientLLM) against a fake text-generation server on
+localhost, which answers each request after a scripted latency and with a scripted HTTP status: retries of the
+transient errors, jittered backoff, circuit breaker, secondary backend and hedged requests.
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import pytest
+import requests
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+import resilient_llm
+from metrics import METRICS
+
+ANSWER = " create_code_cell"
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    Answers the n-th request with the n-th (status, latency) of its script, and the last one after the script.
+    """
+    daemon_threads = True
+
+    def __init__(self, script: list):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.script = script
+        self.requests = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self) -> None:
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            status, latency = server.script[min(server.requests, len(server.script) - 1)]
+            server.requests += 1
+        time.sleep(latency)
+        payload = [{"generated_text": body["inputs"] + ANSWER}] if status == 200 else {"error": "erreur"}
+        data = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            # The client gave up on the request.
+            pass
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class HttpClient(LLM):
+    """
+    A text-generation client over requests, which raises the HTTP and transport errors of the requests library.
+    """
+    url: str
+    timeout: float = 5.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake_http"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        response = requests.post(self.url, json={"inputs": prompt, "parameters": kwargs}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()[0]["generated_text"]
+
+
+class LocalBackend(LLM):
+
+    @property
+    def _llm_type(self) -> str:
+        return "local"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return prompt + " local"
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(*script):
+        servers.append(FakeServer(list(script)))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # The backoffs of the layer are recorded instead of slept.
+    sleeps = []
+    monkeypatch.setattr(resilient_llm, "time", SimpleNamespace(monotonic=time.monotonic, sleep=sleeps.append))
+    METRICS.reset()
+    return sleeps
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_transient_status_is_retried_with_backoff(serve, no_backoff):
+    server = serve((503, 0), (502, 0), (200, 0))
+    llm = resilient_llm.ResilientLLM(primary=HttpClient(url=server.url), retries=2)
+
+    assert llm.invoke("q") == "q" + ANSWER
+    assert server.requests == 3
+    assert METRICS.counter("llm.retry") == 2
+    assert len(no_backoff) == 2
+    for retry, backoff in enumerate(no_backoff):
+        assert 0 <= backoff <= min(resilient_llm.BACKOFF_CAP, resilient_llm.BACKOFF_BASE * 2 ** retry)
+
+
+def test_timeout_is_retried(serve):
+    server = serve((200, 1.0), (200, 0))
+    llm = resilient_llm.ResilientLLM(primary=HttpClient(url=server.url), attempt_timeout=0.3, retries=1)
+
+    assert llm.invoke("q") == "q" + ANSWER
+    assert METRICS.counter("llm.timeout") == 1
+    assert server.requests == 2
+
+
+def test_connection_error_is_retried():
+    llm = resilient_llm.ResilientLLM(primary=HttpClient(url=f"http://127.0.0.1:{closed_port()}"), retries=2)
+
+    with pytest.raises(resilient_llm.LLMUnavailableError):
+        llm.invoke("q")
+    assert METRICS.counter("llm.failed_attempt") == 3
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+def test_client_error_is_not_retried(serve, status):
+    server = serve((status, 0), (200, 0))
+    llm = resilient_llm.ResilientLLM(primary=HttpClient(url=server.url), retries=2)
+
+    with pytest.raises(requests.HTTPError):
+        llm.invoke("q")
+    assert server.requests == 1
+    assert llm.breaker.failures == 0
+
+
+def test_circuit_opens_after_threshold(serve):
+    server = serve((503, 0))
+    llm = resilient_llm.ResilientLLM(primary=HttpClient(url=server.url), retries=0)
+
+    for _ in range(resilient_llm.FAILURE_THRESHOLD):
+        assert llm.breaker.state == "closed"
+        with pytest.raises(resilient_llm.LLMUnavailableError):
+            llm.invoke("q")
+    assert llm.breaker.state == "open"
+    # The open circuit fails fast, without sending the request.
+    with pytest.raises(resilient_llm.LLMUnavailableError):
+        llm.invoke("q")
+    assert server.requests == resilient_llm.FAILURE_THRESHOLD
+    assert METRICS.counter("llm.circuit.rejected") == 1
+
+
+def test_single_half_open_trial():
+    breaker = resilient_llm.CircuitBreaker(failure_threshold=1, recovery_time=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A failed trial opens the circuit again, a successful one closes it.
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_secondary_serves_when_primary_is_down(serve):
+    server = serve((503, 0))
+    llm = resilient_llm.ResilientLLM(primary=HttpClient(url=server.url), secondary=LocalBackend(), retries=1)
+
+    assert llm.invoke("q") == "q local"
+    assert llm.served_by_secondary()
+    assert METRICS.counter("llm.fallback") == 1
+    server.script = [(200, 0)]
+    assert llm.invoke("q") == "q" + ANSWER
+    assert not llm.served_by_secondary()
+
+
+def test_hedge_wins_when_first_request_is_slow(serve):
+    server = serve((200, 1.5), (200, 0))
+    llm = resilient_llm.ResilientLLM(primary=HttpClient(url=server.url), hedging=True, hedge_delay=0.1,
+                                     attempt_timeout=3.0)
+
+    start = time.monotonic()
+    assert llm.invoke("q") == "q" + ANSWER
+    assert time.monotonic() - start < 1.0
+    assert METRICS.counter("llm.hedged") == 1
+    assert METRICS.counter("llm.hedge_won") == 1
+
+
+def test_hedge_delay_is_per_profile():
+    llm = resilient_llm.ResilientLLM(primary=LocalBackend(), hedging=True)
+    for _ in range(resilient_llm.MIN_HEDGE_SAMPLES):
+        METRICS.observe("llm.latency.20", 0.1)
+        METRICS.observe("llm.latency.500", 5.0)
+
+    assert llm._hedge_delay({"max_new_tokens": 20}) == 0.1
+    assert llm._hedge_delay({"max_new_tokens": 500}) == 5.0
+    assert llm._hedge_delay({"max_new_tokens": 300}) is None
+
+
+class SlowStream(LLM):
+    """
+    A streaming backend whose first stream is slower than the attempt timeout, recording the closed streams.
+    """
+    streams: int = 0
+    closed: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow_stream"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return prompt
+
+    def _stream(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any):
+        self.streams += 1
+        number = self.streams
+        try:
+            if number == 1:
+                time.sleep(0.5)
+            yield GenerationChunk(text=f"flux {number}")
+        finally:
+            self.closed.append(number)
+
+
+def test_abandoned_stream_is_closed():
+    backend = SlowStream()
+    llm = resilient_llm.ResilientLLM(primary=backend, attempt_timeout=0.2, retries=1)
+
+    assert "".join(llm.stream("q")) == "flux 2"
+    time.sleep(0.6)
+    assert sorted(backend.closed) == [1, 2]
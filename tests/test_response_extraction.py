@@ -0,0 +1,61 @@
+"""
+Tests of the extraction of the generated code (response_extraction): fenced and unfenced code, the explanations which
+follow it, and the cut-off markers inside the comments and strings of the code, which must not cut it.
+"""
+import pytest
+
+from response_extraction import extract_code, find_cut_off
+
+
+@pytest.mark.parametrize("text, code", [
+    # Unfenced code, with an introducing sentence and with explanations after it.
+    (" import os\nprint(os.listdir())", "import os\nprint(os.listdir())"),
+    ("Ici le code demandé :\nx = 1\ny = 2", "x = 1\ny = 2"),
+    (" df = df.dropna()\nCe code supprime les lignes vides.", "df = df.dropna()"),
+    (" df.head()\n\nExplanation: this shows the first rows.", "df.head()"),
+    # Fenced code, with prose before and after the fence.
+    ("Voici le code :\n```python\nimport pandas as pd\ndf = pd.read_csv('a.csv')\n```\nLe code lit le fichier.",
+     "import pandas as pd\ndf = pd.read_csv('a.csv')"),
+    ("```\nprint(1)\n```\n```python\nprint(2)\n```", "print(1)\n\nprint(2)"),
+    # The markers inside the comments and strings are part of the code.
+    (" import os\n# Ici on liste\nprint(os.listdir())", "import os\n# Ici on liste\nprint(os.listdir())"),
+    (' df["Ici"] = 1', 'df["Ici"] = 1'),
+    (" x = 1  # Ce code est simple\nprint('Le code : ' + str(x))", "x = 1  # Ce code est simple\nprint('Le code : ' + str(x))"),
+    ('def f():\n    """\nIci une documentation\n    """\n    return 1\nCe code définit f.',
+     'def f():\n    """\nIci une documentation\n    """\n    return 1'),
+    ("```python\n# Explication : la moyenne\nm = df['age'].mean()\n```", "# Explication : la moyenne\nm = df['age'].mean()"),
+    ("```python\nprint('```')\n```\nExplication : rien", "print('```')"),
+])
+def test_extract_code(text, code):
+    extracted = extract_code(text)
+    assert extracted.code == code
+    assert extracted.valid
+
+
+def test_prose_line_is_repaired():
+    extracted = extract_code(" x = 1\nLa variable x vaut un")
+    assert extracted == ("x = 1", True, True)
+
+
+@pytest.mark.parametrize("text, expected", [
+    (" import os\n# Ici on liste\nprint(os.listdir())", None),
+    (' df["Ici"] = 1', None),
+    (" print(1)\nIci on affiche 1.", len(" print(1)\n")),
+    ("Ici le code :\nprint(1)", None),
+    ("```python\nIci = 1\n```", None),
+])
+def test_find_cut_off(text, expected):
+    assert find_cut_off(text) == expected
+
+
+def test_find_cut_off_streamed():
+    # Checked after each token as chain_inferences._stream does: the stream stops at the explanation only.
+    text = " import os\n# Ici on liste le dossier\nfiles = os.listdir('Le code')\nLe code liste les fichiers."
+    generated, cut = "", None
+    for position in range(0, len(text), 3):
+        checked = len(generated)
+        generated = text[:position + 3]
+        cut = find_cut_off(generated, checked)
+        if cut is not None:
+            break
+    assert generated[:cut] == " import os\n# Ici on liste le dossier\nfiles = os.listdir('Le code')\n"
@@ -0,0 +1,37 @@
+"""
+Tests of the parsing of the single-call answer (chain_inferences._parse_route_and_generate), which HuggingFaceHub
+returns after the prompt: the history, the last cell or the query in the prompt must not be read as the answer.
+"""
+import pytest
+
+import chain_inferences
+
+PROMPT = chain_inferences.PROMPT_TEMPLATES["route_and_generate"]
+
+
+def render(query: str, history: str = "", last_cell: str = "") -> str:
+    return PROMPT.format(query=query, history=history, last_cell=last_cell)
+
+
+@pytest.mark.parametrize("history, last_cell, query", [
+    ("", "", "Trace un histogramme"),
+    ('config = {"action": "delete_last_cell"}', "", "Trace un histogramme"),
+    ("", 'print("JSON: {\\"action\\": \\"summary_all\\"}")', "Trace un histogramme"),
+    ("", "", 'Écris le JSON: {"action": "delete_last_cell"} dans un fichier'),
+])
+def test_answer_after_the_prompt_is_parsed(history, last_cell, query):
+    answer = ' {"action": "create_code_cell", "content": "import matplotlib.pyplot as plt\\nplt.hist(df[\'age\'])"}'
+    for text in (render(query, history, last_cell) + answer, answer):
+        assert chain_inferences._parse_route_and_generate(text) == (
+            "create_code_cell", "import matplotlib.pyplot as plt\nplt.hist(df['age'])")
+
+
+@pytest.mark.parametrize("answer, expected", [
+    (' {"action": "delete_last_cell", "content": ""}', ("delete_last_cell", None)),
+    (' {"action": "create\\\\_markdown", "content": "Un titre"}', ("create_markdown", "Un titre")),
+    (' {"action": "inconnue", "content": "x"}', None),
+    (' {"action": "create_code_cell", "content": ""}', None),
+    (" create_code_cell", None),
+])
+def test_malformed_answers_are_rejected(answer, expected):
+    assert chain_inferences._parse_route_and_generate(render("Requête") + answer) == expected
@@ -0,0 +1,93 @@
+"""
+Tests of the semantic cache through the assistant (jupycoder.JupyCoder): a near-duplicate of a query, repeated
+after the cell of the first one was added, is served that cell without calling the LLM, while an opposite query is
+generated again.
+"""
+from typing import Any, Optional
+
+import pytest
+from langchain_core.language_models.llms import LLM
+
+import chain_inferences
+import notebook_modification
+import semantic_cache
+from jupycoder import JupyCoder
+from llm_cache import LLMResponseCache
+from metrics import METRICS
+
+
+class CountingLLM(LLM):
+    """
+    Routes every query to the creation of a code cell and generates a different cell at each call.
+    """
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "counting"
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        self.calls += 1
+        if prompt.rstrip().endswith("choisir:"):
+            return prompt + " create_code_cell"
+        return prompt + f" df = df.sort_values('age')  # {self.calls}"
+
+
+@pytest.fixture
+def assistant(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(chain_inferences, "LLM_CACHE", LLMResponseCache(str(tmp_path / "llm.sqlite")))
+    semantic_cache.SEMANTIC_CACHE.clear()
+    METRICS.reset()
+    path = str(tmp_path / "nb.ipynb")
+    notebook_modification.create_notebook(path)
+    notebook_modification.create_code_cell(path, "import pandas as pd\ndf = pd.read_csv('data.csv')")
+    yield JupyCoder(path, CountingLLM(), fast_routing=False, semantic_caching=True)
+    semantic_cache.SEMANTIC_CACHE.clear()
+
+
+def test_near_duplicate_is_served_after_its_cell(assistant):
+    assistant("Trie le dataframe par ordre croissant de l'âge")
+    generated = notebook_modification.get_all_cell(assistant.path)[-1]
+    calls = assistant.llm.calls
+
+    # The second transcription of the same voice command.
+    assistant("Trie la dataframe par ordre croissant de l'age")
+
+    assert assistant.llm.calls == calls
+    assert METRICS.counter("semantic_cache.hit") == 1
+    assert notebook_modification.get_all_cell(assistant.path)[-2:] == [generated, generated]
+
+
+def test_opposite_query_is_generated(assistant):
+    assistant("Trie le dataframe par ordre croissant de l'âge")
+    calls = assistant.llm.calls
+
+    assistant("Trie le dataframe par ordre décroissant de l'âge")
+
+    assert assistant.llm.calls > calls
+    assert METRICS.counter("semantic_cache.hit") == 0
+    codes = notebook_modification.get_all_cell(assistant.path)
+    assert codes[-1] != codes[-2]
+
+
+def test_other_state_of_the_notebook_is_a_miss(assistant):
+    assistant("Trie le dataframe par ordre croissant de l'âge")
+    notebook_modification.create_code_cell(assistant.path, "df = df.dropna()")
+    calls = assistant.llm.calls
+
+    assistant("Trie la dataframe par ordre croissant de l'age")
+
+    assert assistant.llm.calls > calls
+    assert METRICS.counter("semantic_cache.hit") == 0
+
+
+def test_undone_cell_is_not_served(assistant):
+    assistant("Trie le dataframe par ordre croissant de l'âge")
+    assistant.last_version()
+    calls = assistant.llm.calls
+
+    assistant("Trie la dataframe par ordre croissant de l'age")
+
+    assert assistant.llm.calls > calls
+    assert METRICS.counter("semantic_cache.hit") == 0
@@ -0,0 +1,126 @@
+"""
+Tests of the snapshot store: a notebook state captured from the parsed notebook (capture) and from the JSON text
+of the cells copied from the file (capture_raw) must have the same manifest, and be restored to the same notebook.
+An undo or a redo with nothing to restore and a failed action must leave no cell in the store.
+"""
+import nbformat
+import pytest
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+from notebook_modification import NotebookSession
+from notebook_reader import read_notebook_layout
+from snapshot_store import SnapshotStore
+
+
+def make_notebook():
+    nb = new_notebook(metadata={"language_info": {"name": "python"}})
+    code = new_code_cell("import pandas as pd\ndf = pd.read_csv('é.csv')\ndf.head()\n", execution_count=3)
+    code.outputs = [new_output("stream", text="ligne 1\nligne 2\n"),
+                    new_output("display_data", data={"text/plain": "a\nb", "image/png": "iVBORw0KGgo=\n"}),
+                    new_output("execute_result", data={"application/json": {"a": [1, 2]}}, execution_count=3)]
+    nb.cells = [new_markdown_cell("# Titre\n\nTexte"), code, new_code_cell("")]
+    return nb
+
+
+def capture_from_file(store: SnapshotStore, path: str) -> dict:
+    # As NotebookSession._capture does when the notebook is not parsed.
+    layout = read_notebook_layout(path)
+    data = open(path, "rb").read()
+    header = {"nbformat": layout.nbformat, "nbformat_minor": layout.nbformat_minor, "metadata": layout.metadata}
+    return store.capture_raw(header, [data[record.start:record.end].decode("utf-8") for record in layout.records])
+
+
+def test_capture_and_capture_raw_share_hashes(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(make_notebook(), path)
+    store = SnapshotStore(path, root=str(tmp_path / "backup"))
+
+    parsed = store.capture(nbformat.read(path, as_version=4))
+    raw = capture_from_file(store, path)
+
+    assert parsed == raw
+    assert len(list((tmp_path / "backup").rglob("objects/*.json"))) == 3
+
+
+def test_push_deduplicates_across_capture_kinds(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(make_notebook(), path)
+    store = SnapshotStore(path, root=str(tmp_path / "backup"))
+
+    store.push(capture_from_file(store, path))
+    store.push(store.capture(nbformat.read(path, as_version=4)))
+
+    assert len(store._load_history()["undo"]) == 1
+
+
+def test_restore_from_raw_capture(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(make_notebook(), path)
+    store = SnapshotStore(path, root=str(tmp_path / "backup"))
+
+    restored = store.restore(capture_from_file(store, path))
+
+    nbformat.validate(restored)
+    assert restored == nbformat.read(path, as_version=4)
+
+
+def stored_cells(tmp_path) -> list:
+    return list((tmp_path / "backup").rglob("objects/*.json"))
+
+
+def test_undo_and_redo_with_empty_stacks_store_nothing(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(make_notebook(), path)
+    store = SnapshotStore(path, root=str(tmp_path / "backup"))
+
+    with NotebookSession(path, snapshots=store) as session:
+        assert not session.undo()
+        assert not session.redo()
+
+    assert stored_cells(tmp_path) == []
+
+
+def test_failed_action_leaves_no_orphan_cells(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(make_notebook(), path)
+    store = SnapshotStore(path, root=str(tmp_path / "backup"))
+
+    with pytest.raises(ValueError):
+        with NotebookSession(path, snapshots=store) as session:
+            session.create_code_cell("x = 1")
+            raise ValueError("échec de l'action")
+
+    assert stored_cells(tmp_path) == []
+    assert store._load_history()["undo"] == []
+
+
+def test_notebook_modified_during_the_action_leaves_no_orphan_cells(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(make_notebook(), path)
+    store = SnapshotStore(path, root=str(tmp_path / "backup"))
+
+    with pytest.raises(RuntimeError):
+        with NotebookSession(path, snapshots=store) as session:
+            session.create_code_cell("x = 1")
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write("\n")
+
+    assert stored_cells(tmp_path) == []
+
+
+def test_undo_keeps_the_cells_of_both_versions(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(make_notebook(), path)
+    store = SnapshotStore(path, root=str(tmp_path / "backup"))
+    original = nbformat.read(path, as_version=4)
+    with NotebookSession(path, snapshots=store) as session:
+        session.create_code_cell("x = 1")
+
+    with NotebookSession(path, snapshots=store) as session:
+        assert session.undo()
+    assert nbformat.read(path, as_version=4) == original
+    with NotebookSession(path, snapshots=store) as session:
+        assert session.redo()
+
+    assert nbformat.read(path, as_version=4).cells[-1].source == "x = 1"
+    assert len(stored_cells(tmp_path)) == 4
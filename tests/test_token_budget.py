@@ -0,0 +1,53 @@
+"""
+Tests of the trimming of a prompt to its token budget (token_budget.fit_inputs): the history selected by the cell
+retrieval loses its least relevant cells first and keeps its imports block.
+"""
+from langchain.prompts import PromptTemplate
+
+import prompt_compaction
+import token_budget
+from cell_retrieval import CellIndex
+
+TEMPLATE = PromptTemplate(input_variables=["history", "query"], template="{history}\n{query}")
+
+
+def test_least_relevant_entries_are_dropped_first():
+    history = token_budget.RankedList(["import pandas as pd", "a = 1", "b = 2", "c = 3"], [0, 3, 1, 2])
+    budget = token_budget.count_tokens(TEMPLATE.format(history=["import pandas as pd", "b = 2"], query="q"))
+
+    inputs, prompt, tokens = token_budget.fit_inputs(TEMPLATE, {"history": history, "query": "q"}, budget,
+                                                     ("history", "query"))
+
+    assert inputs["history"] == ["import pandas as pd", "b = 2"]
+    assert inputs["history"].ranks == [0, 1]
+    assert tokens <= budget
+    # The input of the caller is left as it was.
+    assert history == ["import pandas as pd", "a = 1", "b = 2", "c = 3"]
+
+
+def test_plain_list_loses_its_first_entries():
+    budget = token_budget.count_tokens(TEMPLATE.format(history=["c = 3"], query="q"))
+
+    inputs, _, _ = token_budget.fit_inputs(TEMPLATE, {"history": ["a = 1", "b = 2", "c = 3"], "query": "q"}, budget,
+                                           ("history",))
+
+    assert inputs["history"] == ["c = 3"]
+
+
+def test_retrieved_history_keeps_the_imports_and_the_best_ranked_cells():
+    index = CellIndex()
+    index.update(["import pandas as pd\nimport numpy as np",
+                  "df = pd.read_csv('ventes.csv')",
+                  "prix = df['prix'].mean()",
+                  "print('autre calcul sans rapport')",
+                  "x = np.arange(10)",
+                  "y = x * 2"])
+    # Ranked: the imports, the last cell, the cell defining x, the cell of the query, then the cell defining df.
+    history = prompt_compaction.compact_cells(index.select("trace le prix moyen des ventes", recent=1))
+    assert history.ranks == [0, 4, 3, 2, 1]
+    kept = ["import pandas as pd\nimport numpy as np", "prix = df['prix'].mean()", "x = np.arange(10)", "y = x * 2"]
+    budget = token_budget.count_tokens(TEMPLATE.format(history=kept, query="q"))
+
+    inputs, _, _ = token_budget.fit_inputs(TEMPLATE, {"history": history, "query": "q"}, budget, ("history",))
+
+    assert inputs["history"] == kept